@@ -0,0 +1,187 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+from lexical_index import extract_identifiers
+from collection_stats import get_collection_stats
+
+# 환경변수 로드
+load_dotenv()
+
+# 답변 캐시 설정
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500"))  # 최대 보관 개수 (초과 시 LRU 제거)
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))  # 답변 유효 시간(초)
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))  # 같은 질문으로 볼 코사인 유사도 하한
+
+# 컬렉션 통계 DB에 저장하는 답변 캐시 버전 이름
+ANSWER_CACHE_VERSION = "answer_cache"
+
+def normalize_question(text):
+    # 공백/대소문자 차이는 같은 질문으로 취급
+    return " ".join(text.split()).lower()
+
+def _unit_vector(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = float(np.linalg.norm(vector)) or 1.0
+    return vector / norm
+
+class AnswerCache:
+    """
+    반복되는 질문에 대해 검색과 답변 생성을 건너뛰기 위한 메모리 답변 캐시입니다.
+    - 질문 임베딩의 코사인 유사도가 임계값 이상인 이전 질문이 있으면 그 답변을 반환합니다.
+      단위 벡터를 미리 할당한 float32 행렬에 보관하여 행렬 곱 한 번으로 모든 항목과 비교합니다.
+    - SRM 번호가 들어간 질문은 번호만 다른 질문이 임베딩상 거의 같으므로,
+      번호 집합이 같은 항목만 비교합니다. (임베딩이 없으면 정규화한 질문이 같아야 적중)
+    - TTL이 지난 항목은 사용하지 않고, 최대 개수를 넘으면 가장 오래 사용되지 않은 항목부터 제거합니다.
+    - 새 문서가 저장되면 invalidate()로 전체를 비웁니다.
+      invalidate()는 컬렉션 통계 DB의 버전도 올리고 조회/저장 때마다 그 버전을 확인하므로,
+      다른 프로세스(CLI 적재 등)에서 문서를 저장해도 이 캐시가 비워집니다.
+    """
+
+    def __init__(self, max_entries=None, ttl=None, similarity=None):
+        self.max_entries = max_entries or ANSWER_CACHE_MAX_ENTRIES
+        self.ttl = ttl if ttl is not None else ANSWER_CACHE_TTL
+        self.similarity = similarity if similarity is not None else ANSWER_CACHE_SIMILARITY
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._version = None  # 현재 항목을 채울 때의 답변 캐시 버전
+        self._entries = OrderedDict()  # 정규화한 질문 -> 항목 (뒤쪽일수록 최근 사용)
+        self._matrix = None  # 질문 단위 벡터 행렬 (첫 임베딩 저장 시 할당, 행 수 = 최대 개수 + 1)
+        self._alive = np.zeros(self.max_entries + 1, dtype=bool)  # 사용 중인 행
+        self._row_keys = [None] * (self.max_entries + 1)  # 행 -> 정규화한 질문
+        self._free_rows = list(range(self.max_entries, -1, -1))  # 비어 있는 행 (뒤에서부터 꺼냄)
+        self._lock = threading.Lock()
+
+    def get(self, question, query_embedding=None):
+        """
+        캐시된 답변 항목을 반환합니다. 없으면 None입니다.
+        반환값: {'question', 'answer', 'similarity', 'age'}
+        """
+        key = normalize_question(question)
+        identifiers = tuple(sorted(extract_identifiers(question)))
+        vector = _unit_vector(query_embedding) if query_embedding is not None else None
+        now = time.time()
+        version = get_collection_stats().get_version(ANSWER_CACHE_VERSION)
+        with self._lock:
+            self._sync_version(version)
+            self._drop_expired(now)
+            best_key, best_score = None, None
+            if key in self._entries:
+                best_key, best_score = key, 1.0
+            elif vector is not None and self._matrix is not None and self._matrix.shape[1] == vector.shape[0]:
+                scores = self._matrix @ vector
+                candidates = np.flatnonzero(self._alive & (scores >= self.similarity))
+                # 유사도가 높은 순으로 SRM 번호 집합이 같은 첫 항목을 고름
+                for row in candidates[np.argsort(-scores[candidates])]:
+                    entry_key = self._row_keys[row]
+                    if self._entries[entry_key]["identifiers"] == identifiers:
+                        best_key, best_score = entry_key, float(scores[row])
+                        break
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            entry = self._entries[best_key]
+            self.hits += 1
+            return {
+                "question": entry["question"],
+                "answer": entry["answer"],
+                "similarity": best_score,
+                "age": now - entry["created_at"]
+            }
+
+    def put(self, question, answer, query_embedding=None):
+        key = normalize_question(question)
+        vector = _unit_vector(query_embedding) if query_embedding is not None else None
+        version = get_collection_stats().get_version(ANSWER_CACHE_VERSION)
+        with self._lock:
+            self._sync_version(version)
+            self._remove(key)
+            row = None
+            if vector is not None:
+                if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+                    # 임베딩 차원이 바뀌면(모델 변경) 기존 항목은 비교할 수 없으므로 모두 버림
+                    self._clear()
+                    self._matrix = np.zeros((self.max_entries + 1, vector.shape[0]), dtype=np.float32)
+                row = self._free_rows.pop()
+                self._matrix[row] = vector
+                self._alive[row] = True
+                self._row_keys[row] = key
+            self._entries[key] = {
+                "question": question,
+                "answer": answer,
+                "identifiers": tuple(sorted(extract_identifiers(question))),
+                "row": row,
+                "created_at": time.time()
+            }
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        # 항목과 그 벡터 행을 함께 제거
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry["row"] is not None:
+            self._alive[entry["row"]] = False
+            self._row_keys[entry["row"]] = None
+            self._free_rows.append(entry["row"])
+
+    def _clear(self):
+        for key in list(self._entries):
+            self._remove(key)
+
+    def _sync_version(self, version):
+        # 다른 곳에서 버전이 올라갔으면 이전 답변을 모두 버림
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._clear()
+            self._version = version
+
+    def _drop_expired(self, now):
+        expired = [key for key, entry in self._entries.items() if now - entry["created_at"] > self.ttl]
+        for key in expired:
+            self._remove(key)
+        self.evictions += len(expired)
+
+    def invalidate(self):
+        """
+        캐시된 답변을 모두 버립니다. (새 문서가 저장되어 답변이 달라질 수 있을 때)
+        다른 프로세스의 답변 캐시도 다음 조회 때 비워집니다.
+        """
+        version = get_collection_stats().bump_version(ANSWER_CACHE_VERSION)
+        with self._lock:
+            self._sync_version(version)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_ratio": (self.hits / total) if total else 0.0
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_answer_cache():
+    """
+    프로세스 전체에서 공유하는 답변 캐시를 반환합니다.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnswerCache()
+        return _cache
+
+def invalidate_answer_cache():
+    get_answer_cache().invalidate()
@@ -0,0 +1,192 @@
+"""
+Azure OpenAI 임베딩/챗 API를 흉내 내는 로컬 서버입니다. (벤치마크 전용)
+- 임베딩: 단어 해시 기반의 결정적 벡터 (같은 텍스트는 항상 같은 벡터, 단어가 겹치면 유사도가 높음)
+- 챗: 고정 답변을 일괄 또는 스트리밍(SSE)으로 반환
+- 요청별 지연 시간과 429(Too Many Requests) 응답 비율을 설정할 수 있음
+
+단독 실행: python benchmarks/fake_azure_server.py --port 8765 --embedding-latency 0.05 --rate-limit-ratio 0.05
+"""
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_DIMENSIONS = 1536
+HASHES_PER_TOKEN = 4
+
+FAKE_ANSWER = (
+    "유사한 과거 VOC 사례를 기준으로 안내드립니다. "
+    "해당 접수 건은 오더 상태값 불일치로 발생한 사례이며, "
+    "주문 마스터의 상태를 보정하는 쿼리로 처리되었습니다. "
+    "동일 증상이 반복되면 처리 이력을 함께 확인해 주세요."
+)
+
+def fake_embedding(text, dimensions=DEFAULT_DIMENSIONS):
+    """
+    텍스트의 단어를 해시하여 만든 단위 벡터를 반환합니다. (feature hashing)
+    """
+    vector = [0.0] * dimensions
+    for token in text.lower().split() or [""]:
+        digest = hashlib.md5(token.encode("utf-8")).digest()
+        for i in range(HASHES_PER_TOKEN):
+            index = int.from_bytes(digest[i * 4:i * 4 + 3], "little") % dimensions
+            vector[index] += 1.0 if digest[i * 4 + 3] & 1 else -1.0
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+class FakeAzureConfig:
+    def __init__(self, dimensions=DEFAULT_DIMENSIONS, embedding_latency=0.0, chat_latency=0.0,
+                 token_delay=0.0, rate_limit_ratio=0.0, retry_after=0.05, seed=0):
+        self.dimensions = dimensions
+        self.embedding_latency = embedding_latency  # 임베딩 요청 1건당 지연(초)
+        self.chat_latency = chat_latency  # 챗 요청의 첫 토큰까지 지연(초)
+        self.token_delay = token_delay  # 스트리밍 토큰 간 지연(초)
+        self.rate_limit_ratio = rate_limit_ratio  # 429로 거절할 요청 비율 (0~1)
+        self.retry_after = retry_after  # 429 응답의 retry-after(초)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = {"embedding_requests": 0, "embedding_inputs": 0, "chat_requests": 0, "rate_limited": 0}
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def should_rate_limit(self):
+        with self.lock:
+            return self.random.random() < self.rate_limit_ratio
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+class FakeAzureHandler(BaseHTTPRequestHandler):
+    config = None  # make_server에서 설정
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("content-length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        path = self.path.split("?")[0]
+
+        if self.config.should_rate_limit():
+            self.config.count("rate_limited")
+            self._send_json(429, {"error": {"code": "429", "message": "Rate limit is exceeded."}}, headers={
+                "retry-after": str(max(1, math.ceil(self.config.retry_after))),
+                "retry-after-ms": str(int(self.config.retry_after * 1000))
+            })
+            return
+
+        if path.endswith("/embeddings"):
+            self._handle_embeddings(body)
+        elif path.endswith("/chat/completions"):
+            self._handle_chat(body)
+        else:
+            self._send_json(404, {"error": {"code": "404", "message": f"unknown path {path}"}})
+
+    def _handle_embeddings(self, body):
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        self.config.count("embedding_requests")
+        self.config.count("embedding_inputs", len(inputs))
+        if self.config.embedding_latency:
+            time.sleep(self.config.embedding_latency)
+        self._send_json(200, {
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": i, "embedding": fake_embedding(text, self.config.dimensions)}
+                for i, text in enumerate(inputs)
+            ],
+            "model": body.get("model", "fake-embedding"),
+            "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)}
+        })
+
+    def _handle_chat(self, body):
+        self.config.count("chat_requests")
+        if self.config.chat_latency:
+            time.sleep(self.config.chat_latency)
+        model = body.get("model", "fake-chat")
+        if not body.get("stream"):
+            self._send_json(200, {
+                "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": FAKE_ANSWER}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+            })
+            return
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.end_headers()
+        for token in FAKE_ANSWER.split(" "):
+            chunk = {
+                "id": "fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "delta": {"content": token + " "}, "finish_reason": None}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            if self.config.token_delay:
+                time.sleep(self.config.token_delay)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+def make_server(port=0, config=None):
+    """
+    서버를 만듭니다. port=0이면 빈 포트를 사용합니다. (server.server_address[1]로 확인)
+    """
+    handler = type("ConfiguredFakeAzureHandler", (FakeAzureHandler,), {"config": config or FakeAzureConfig()})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    return server
+
+def start_server(port=0, config=None):
+    """
+    백그라운드 스레드에서 서버를 시작하고 (server, config)를 반환합니다.
+    """
+    config = config or FakeAzureConfig()
+    server = make_server(port, config)
+    threading.Thread(target=server.serve_forever, name="fake-azure", daemon=True).start()
+    return server, config
+
+def add_server_arguments(parser):
+    parser.add_argument("--dimensions", type=int, default=DEFAULT_DIMENSIONS, help="임베딩 차원")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="임베딩 요청당 지연(초)")
+    parser.add_argument("--chat-latency", type=float, default=0.0, help="챗 첫 토큰까지 지연(초)")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="스트리밍 토큰 간 지연(초)")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="429로 거절할 요청 비율(0~1)")
+    parser.add_argument("--retry-after", type=float, default=0.05, help="429 응답의 retry-after(초)")
+    parser.add_argument("--seed", type=int, default=0)
+
+def config_from_args(args):
+    return FakeAzureConfig(
+        dimensions=args.dimensions,
+        embedding_latency=args.embedding_latency,
+        chat_latency=args.chat_latency,
+        token_delay=args.token_delay,
+        rate_limit_ratio=args.rate_limit_ratio,
+        retry_after=args.retry_after,
+        seed=args.seed
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="로컬 가짜 Azure OpenAI 서버")
+    parser.add_argument("--port", type=int, default=8765)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    server = make_server(args.port, config_from_args(args))
+    print(f"가짜 Azure OpenAI 서버 실행 중: http://127.0.0.1:{server.server_address[1]}")
+    server.serve_forever()
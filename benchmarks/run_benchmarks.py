@@ -0,0 +1,221 @@
+"""
+Azure 없이 로컬에서 적재 처리량과 검색/답변 지연 시간을 측정하는 벤치마크입니다.
+
+가짜 Azure OpenAI 서버(fake_azure_server.py)를 띄우고, 크기별로 합성 VOC PDF와 대화 기록을 만든 뒤
+크기마다 별도 프로세스/임시 디렉터리(ChromaDB, 캐시, 색인 파일 분리)에서 다음을 측정합니다.
+- PDF 스트리밍 적재: chunks/sec
+- 대화 기록 저장: turns/sec
+- search_all_content: p50/p95/p99
+- 전체 턴(답변 캐시 확인 → 검색 → 프롬프트 구성 → 스트리밍 답변): 첫 토큰/전체 p50/p95/p99
+
+예: python benchmarks/run_benchmarks.py --sizes small,medium --queries 100 --embedding-latency 0.02 \
+        --chat-latency 0.3 --token-delay 0.01 --rate-limit-ratio 0.05 --output bench.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from fake_azure_server import start_server, add_server_arguments, config_from_args
+from synthetic_data import CORPUS_SIZES, make_voc_pdf, make_conversations, make_questions
+
+RESULT_PREFIX = "BENCHMARK_RESULT "
+
+def percentiles(values, points=(50, 95, 99)):
+    """
+    nearest-rank 방식의 백분위수를 {'p50': ..., 'p95': ..., 'p99': ...}로 반환합니다.
+    """
+    if not values:
+        return {f"p{p}": None for p in points}
+    ordered = sorted(values)
+    result = {}
+    for p in points:
+        rank = max(1, -(-p * len(ordered) // 100))  # ceil(p/100 * n)
+        result[f"p{p}"] = ordered[rank - 1]
+    return result
+
+def fake_azure_env(port):
+    endpoint = f"http://127.0.0.1:{port}"
+    env = dict(os.environ)
+    env.pop("WEBSITE_SITE_NAME", None)  # Azure 경로 대신 작업 디렉터리 사용
+    env.update({
+        "OPENAI_API_KEY": "benchmark",
+        "AZURE_ENDPOINT": endpoint,
+        "OPENAI_API_VERSION": "2024-02-01",
+        "DEPLOYMENT_NAME": "benchmark-chat",
+        "TEXT_EMBEDDING_AZURE_OPENAI_API_KEY": "benchmark",
+        "TEXT_EMBEDDING_AZURE_OPENAI_ENDPOINT": endpoint,
+        "TEXT_EMBEDDING_AZURE_OPENAI_API_VERSION": "2024-02-01",
+        "TEXT_EMBEDDING_DEPLOYMENT_NAME": "benchmark-embedding",
+        "PYTHONPATH": os.pathsep.join(filter(None, [REPO_DIR, BENCHMARK_DIR, os.environ.get("PYTHONPATH")]))
+    })
+    return env
+
+def run_single(args):
+    """
+    현재 디렉터리(임시 작업 디렉터리)에서 한 가지 크기의 벤치마크를 실행합니다. (자식 프로세스)
+    """
+    sys.path.insert(0, REPO_DIR)
+    from pdf_pipeline import ingest_pdf_streaming
+    from conversation_embedder import save_conversations_to_chroma
+    from chat_core import search_all_content, find_cached_answer, store_cached_answer, stream_openai_response
+    from history_manager import build_prompt_messages, fold_history_in_background, new_history_state
+    from conversation_writer import get_conversation_writer
+
+    pages = CORPUS_SIZES[args.size]
+    result = {"size": args.size, "pages": pages}
+
+    # 1. PDF 적재
+    pdf_path = os.path.join(os.getcwd(), f"voc_{args.size}.pdf")
+    records = make_voc_pdf(pdf_path, pages, seed=args.seed)
+    started = time.perf_counter()
+    ingest = ingest_pdf_streaming(pdf_path)
+    ingest_seconds = time.perf_counter() - started
+    result["records"] = len(records)
+    result["chunks"] = ingest["chunks"]
+    result["ingest_seconds"] = ingest_seconds
+    result["chunks_per_sec"] = ingest["chunks"] / ingest_seconds if ingest_seconds > 0 else None
+
+    # 2. 대화 기록 저장 (대화 백그라운드 저장기와 같은 배치 크기)
+    turns = make_conversations(records, args.conversation_turns, seed=args.seed)
+    started = time.perf_counter()
+    for i in range(0, len(turns), 32):
+        save_conversations_to_chroma(turns[i:i + 32])
+    conversation_seconds = time.perf_counter() - started
+    result["conversation_turns"] = len(turns)
+    result["conversation_turns_per_sec"] = len(turns) / conversation_seconds if conversation_seconds > 0 else None
+
+    # 3. 검색 지연 시간
+    search_latencies = []
+    for question in make_questions(records, args.queries, seed=args.seed + 1, repeat_ratio=0.0):
+        started = time.perf_counter()
+        search_all_content(question, pdf_top_k=4, conversation_top_k=5)
+        search_latencies.append(time.perf_counter() - started)
+    result["search"] = percentiles(search_latencies)
+
+    # 4. 전체 턴 지연 시간 (chat_interface와 같은 순서)
+    messages = [{"role": "assistant", "content": "안녕하세요!"}]
+    history_state = new_history_state()
+    turn_latencies, ttfts, cache_hits = [], [], 0
+    for question in make_questions(records, args.queries, seed=args.seed + 2, repeat_ratio=args.repeat_ratio):
+        started = time.perf_counter()
+        messages = [m for m in messages if m["role"] != "system"]
+        cached = find_cached_answer(question)
+        if cached:
+            cache_hits += 1
+            messages.extend([{"role": "user", "content": question}, {"role": "assistant", "content": cached["answer"]}])
+            ttfts.append(time.perf_counter() - started)
+            turn_latencies.append(time.perf_counter() - started)
+            continue
+        search_result = search_all_content(question, pdf_top_k=4, conversation_top_k=5)
+        if search_result["context_text"]:
+            messages.append({"role": "system", "content": search_result["context_text"]})
+        messages.append({"role": "user", "content": question})
+        answer, first_token = "", None
+        for token in stream_openai_response(build_prompt_messages(messages, history_state)):
+            if first_token is None:
+                first_token = time.perf_counter() - started
+            answer += token
+        messages.append({"role": "assistant", "content": answer})
+        store_cached_answer(question, answer)
+        fold_history_in_background(messages, history_state)
+        get_conversation_writer().enqueue(question, answer)
+        ttfts.append(first_token if first_token is not None else time.perf_counter() - started)
+        turn_latencies.append(time.perf_counter() - started)
+    get_conversation_writer().flush(60)
+    result["turn"] = percentiles(turn_latencies)
+    result["turn_ttft"] = percentiles(ttfts)
+    result["answer_cache_hits"] = cache_hits
+    result["queries"] = args.queries
+    print(RESULT_PREFIX + json.dumps(result))
+
+def format_ms(value):
+    return "-" if value is None else f"{value * 1000:.0f}"
+
+def print_report(results):
+    header = (
+        f"{'size':<7}{'pages':>6}{'chunks':>8}{'chunks/s':>10}{'turns/s':>9}"
+        f"{'search p50/p95/p99(ms)':>26}{'turn p50/p95/p99(ms)':>24}{'ttft p50(ms)':>14}{'cache':>7}{'429':>6}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        search = "/".join(format_ms(r["search"][p]) for p in ("p50", "p95", "p99"))
+        turn = "/".join(format_ms(r["turn"][p]) for p in ("p50", "p95", "p99"))
+        print(
+            f"{r['size']:<7}{r['pages']:>6}{r['chunks']:>8}{r['chunks_per_sec'] or 0:>10.1f}"
+            f"{r['conversation_turns_per_sec'] or 0:>9.1f}{search:>26}{turn:>24}"
+            f"{format_ms(r['turn_ttft']['p50']):>14}{r['answer_cache_hits']:>7}{r['server']['rate_limited']:>6}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="오프라인 적재/검색/답변 벤치마크")
+    parser.add_argument("--sizes", default="small,medium", help=f"쉼표로 구분한 크기 ({', '.join(CORPUS_SIZES)})")
+    parser.add_argument("--queries", type=int, default=50, help="크기별 검색/턴 측정 횟수")
+    parser.add_argument("--conversation-turns", type=int, default=200, help="크기별 저장할 대화 턴 수")
+    parser.add_argument("--repeat-ratio", type=float, default=0.2, help="전체 턴 측정에서 반복 질문 비율")
+    parser.add_argument("--output", help="결과 JSON 저장 경로")
+    parser.add_argument("--keep-workdir", action="store_true", help="임시 작업 디렉터리를 지우지 않음")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--size", help=argparse.SUPPRESS)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    if args.child:
+        run_single(args)
+        return
+
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+    unknown = [size for size in sizes if size not in CORPUS_SIZES]
+    if unknown:
+        parser.error(f"알 수 없는 크기: {', '.join(unknown)}")
+
+    server, config = start_server(0, config_from_args(args))
+    port = server.server_address[1]
+    print(f"가짜 Azure OpenAI 서버: http://127.0.0.1:{port}")
+    env = fake_azure_env(port)
+
+    child_args = [
+        "--queries", str(args.queries), "--conversation-turns", str(args.conversation_turns),
+        "--repeat-ratio", str(args.repeat_ratio), "--seed", str(args.seed)
+    ]
+    results = []
+    for size in sizes:
+        workdir = tempfile.mkdtemp(prefix=f"voc_bench_{size}_")
+        print(f"[{size}] 실행 중... (작업 디렉터리: {workdir})")
+        before = config.snapshot()
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--child", "--size", size] + child_args,
+            cwd=workdir, env=env, capture_output=True, text=True
+        )
+        after = config.snapshot()
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+        lines = [line for line in completed.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+        if completed.returncode != 0 or not lines:
+            print(f"[{size}] 실패 (종료 코드 {completed.returncode})")
+            print(completed.stdout[-2000:])
+            print(completed.stderr[-2000:])
+            continue
+        result = json.loads(lines[-1][len(RESULT_PREFIX):])
+        result["server"] = {name: after[name] - before[name] for name in after}
+        results.append(result)
+
+    server.shutdown()
+    print()
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n결과 저장: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+벤치마크용 합성 VOC 데이터를 만듭니다.
+- SRM/VOC 레코드가 담긴 PDF (표준 Helvetica 글꼴만 쓰므로 본문은 영문/숫자)
+- SRM 번호를 언급하는 상담 대화 기록
+
+단독 실행: python benchmarks/synthetic_data.py --pages 50 --output /tmp/voc_50.pdf
+"""
+import random
+import argparse
+
+# 벤치마크 크기별 PDF 페이지 수
+CORPUS_SIZES = {"small": 10, "medium": 50, "large": 200}
+
+RECORDS_PER_PAGE = 12
+SYSTEMS = ["KICIS", "NeOSS", "ICIS-ORDER", "SWING", "KOS", "CRM"]
+SYMPTOMS = [
+    "order status mismatch after cancel",
+    "duplicate order line created",
+    "billing start date missing",
+    "installation schedule not synced",
+    "customer address update failed",
+    "service suspension not released",
+]
+QUERIES = [
+    "update ord_mst set ord_stat_cd = 'CP' where ord_no = '{no}';",
+    "delete from ord_dtl where ord_no = '{no}' and seq > 1;",
+    "update bill_mst set bill_strt_dt = sysdate where ord_no = '{no}';",
+    "select * from ord_hist where ord_no = '{no}' order by chg_dt desc;",
+]
+QUESTIONS = [
+    "{srm}에 대해 알아?",
+    "{system} 시스템에서 {symptom} 증상이면 어떻게 처리해?",
+    "{srm} 처리할때 사용한 쿼리 있으면 알려줘",
+    "유사한 내용 SRM 번호 목록 뽑아줘 ({symptom})",
+]
+
+def make_srm(rng):
+    return f"SRM25{rng.randint(10 ** 9, 10 ** 10 - 1)}"
+
+def make_records(count, seed=0):
+    """
+    VOC 레코드 목록을 만듭니다. 각 레코드는 PDF에서 3~4줄을 차지합니다.
+    반환값: [{'srm', 'system', 'symptom', 'lines'}, ...]
+    """
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        srm = make_srm(rng)
+        system = rng.choice(SYSTEMS)
+        symptom = rng.choice(SYMPTOMS)
+        order_no = rng.randint(1, 10 ** 8)
+        lines = [
+            f"{srm} [{system}] VOC {i + 1}: {symptom}",
+            f"Cause: {symptom} on order {order_no} (reported by branch {rng.randint(100, 999)})",
+            "Resolution query: " + rng.choice(QUERIES).format(no=order_no),
+        ]
+        if rng.random() < 0.3:
+            lines.append(f"Note: same issue as {make_srm(rng)}, handled by ops team {rng.randint(1, 9)}")
+        records.append({"srm": srm, "system": system, "symptom": symptom, "lines": lines})
+    return records
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def write_pdf(path, pages):
+    """
+    줄 목록의 목록(페이지별)을 최소 구성의 PDF 파일로 씁니다. (외부 라이브러리 없음)
+    """
+    objects = []  # 1번부터 순서대로
+
+    def add(content):
+        objects.append(content)
+        return len(objects)
+
+    catalog = add(None)
+    page_tree = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    for lines in pages:
+        ops = ["BT", "/F1 9 Tf", "11 TL", "40 800 Td"]
+        ops.extend(f"({_pdf_escape(line)}) Tj T*" for line in lines)
+        ops.append("ET")
+        stream = "\n".join(ops).encode("latin-1", "replace")
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (page_tree, font, content)
+        ))
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % page_tree
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids).encode("ascii")
+    objects[page_tree - 1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, content in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + content + b"\nendobj\n"
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    with open(path, "wb") as f:
+        f.write(output)
+
+def make_voc_pdf(path, pages, seed=0):
+    """
+    pages쪽 분량의 합성 VOC PDF를 만들고 레코드 목록을 반환합니다.
+    """
+    records = make_records(pages * RECORDS_PER_PAGE, seed=seed)
+    page_lines = []
+    for p in range(pages):
+        lines = []
+        for record in records[p * RECORDS_PER_PAGE:(p + 1) * RECORDS_PER_PAGE]:
+            lines.extend(record["lines"])
+            lines.append("")
+        page_lines.append(lines)
+    write_pdf(path, page_lines)
+    return records
+
+def make_questions(records, count, seed=0, repeat_ratio=0.2):
+    """
+    레코드를 참고한 상담 질문 목록을 만듭니다. repeat_ratio 비율은 앞서 나온 질문을 반복합니다.
+    """
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(count):
+        if questions and rng.random() < repeat_ratio:
+            questions.append(rng.choice(questions))
+            continue
+        record = rng.choice(records)
+        questions.append(rng.choice(QUESTIONS).format(**record))
+    return questions
+
+def make_conversations(records, turns, seed=0):
+    """
+    save_conversations_to_chroma에 넘길 수 있는 합성 대화 턴 목록을 만듭니다.
+    """
+    rng = random.Random(seed)
+    conversations = []
+    base_ts = 1750000000
+    for i, question in enumerate(make_questions(records, turns, seed=seed, repeat_ratio=0.0)):
+        record = rng.choice(records)
+        answer = (
+            f"{record['srm']} 건은 {record['system']} 시스템의 '{record['symptom']}' 사례입니다. "
+            f"처리 내용: {record['lines'][2]}"
+        )
+        conversations.append({
+            "user": question,
+            "assistant": answer,
+            "timestamp": base_ts + i * 60,
+            "turn_id": f"bench{seed}_{i}"
+        })
+    return conversations
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="합성 VOC PDF 생성")
+    parser.add_argument("--pages", type=int, default=CORPUS_SIZES["small"])
+    parser.add_argument("--output", default="synthetic_voc.pdf")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    records = make_voc_pdf(args.output, args.pages, seed=args.seed)
+    print(f"{args.output}: {args.pages}페이지, 레코드 {len(records)}개")
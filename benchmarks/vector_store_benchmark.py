@@ -0,0 +1,199 @@
+"""
+벡터 저장소 비교 벤치마크: ChromaDB(HNSW) vs NumPy 메모리 매핑 전수 검색(float32 / int8 + 재계산)
+
+크기마다 저장소별로 별도 프로세스/임시 디렉터리에서 다음을 측정합니다.
+- 적재 시간(초)과 다시 열기 시간(초, 프로세스 재시작 후 첫 조회까지)
+- 검색 지연 시간 p50/p95/p99 (ms)
+- recall@k (정확한 전수 검색 결과 대비)
+- 디스크 사용량(MB)과 적재+검색 후 늘어난 메모리(RSS, MB)
+
+벡터는 SRM/VOC 레코드처럼 비슷한 사례끼리 모이도록 군집 중심 + 잡음으로 만들고,
+질의는 저장된 벡터에 잡음을 더해 만듭니다.
+
+예: python benchmarks/vector_store_benchmark.py --sizes 1000,10000,50000 --queries 200 --output vs.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+from run_benchmarks import percentiles, RESULT_PREFIX
+
+BACKENDS = ("chroma-hnsw", "numpy-f32", "numpy-int8")
+
+def make_vectors(size, dimensions, queries, top_k, seed=0):
+    """
+    (저장할 벡터, 질의 벡터, 질의별 정답 top_k 행 번호)를 반환합니다. 벡터는 단위 벡터입니다.
+    """
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, size // 20), dimensions)).astype(np.float32)
+    vectors = centers[rng.integers(0, len(centers), size)] + 0.6 * rng.normal(size=(size, dimensions)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query_vectors = vectors[rng.integers(0, size, queries)] + 0.3 * rng.normal(size=(queries, dimensions)).astype(np.float32)
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    truth = []
+    for query in query_vectors:
+        distances = ((vectors - query) ** 2).sum(axis=1)
+        truth.append(set(np.argsort(distances)[:top_k].tolist()))
+    return vectors, query_vectors, truth
+
+def current_rss_mb():
+    # 현재 RSS (리눅스 /proc 기준, 없으면 최대 RSS)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def directory_size_mb(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total / (1024 * 1024)
+
+def open_collection(backend, path):
+    if backend == "chroma-hnsw":
+        from chromadb import PersistentClient
+        return PersistentClient(path=path).get_or_create_collection("benchmark")
+    from numpy_vector_store import NumpyCollection
+    return NumpyCollection("benchmark", path, quantize=(backend == "numpy-int8"))
+
+def run_single(args):
+    """
+    한 가지 저장소/크기 조합을 측정합니다. (자식 프로세스, 현재 디렉터리가 임시 작업 디렉터리)
+    """
+    sys.path.insert(0, REPO_DIR)
+    vectors, query_vectors, truth = make_vectors(args.size, args.dimensions, args.queries, args.top_k, seed=args.seed)
+    path = os.path.join(os.getcwd(), "store")
+    result = {"backend": args.backend, "size": args.size, "dimensions": args.dimensions}
+
+    # import와 데이터 생성 이후부터 메모리 증가량을 잼
+    open_collection(args.backend, os.path.join(os.getcwd(), "warmup"))
+    rss_before = current_rss_mb()
+
+    # 1. 적재 (앱과 같은 5000행 단위 upsert)
+    collection = open_collection(args.backend, path)
+    ids = [f"doc_{i}" for i in range(args.size)]
+    started = time.perf_counter()
+    for i in range(0, args.size, 5000):
+        collection.upsert(
+            ids=ids[i:i + 5000],
+            embeddings=vectors[i:i + 5000].tolist(),
+            documents=[f"SRM 사례 {j}" for j in range(i, min(args.size, i + 5000))],
+            metadatas=[{"type": "pdf", "row": j} for j in range(i, min(args.size, i + 5000))]
+        )
+    result["build_seconds"] = time.perf_counter() - started
+
+    # 2. 검색 지연 시간 / recall
+    latencies, recalls = [], []
+    for query, expected in zip(query_vectors, truth):
+        started = time.perf_counter()
+        found = collection.query(query_embeddings=[query.tolist()], n_results=args.top_k, include=["documents"])
+        latencies.append(time.perf_counter() - started)
+        recalls.append(len(expected & {int(id_.split("_")[1]) for id_ in found["ids"][0]}) / args.top_k)
+    result["query"] = percentiles(latencies)
+    result["recall"] = sum(recalls) / len(recalls)
+    result["rss_mb"] = current_rss_mb() - rss_before
+    result["disk_mb"] = directory_size_mb(path)
+    print(RESULT_PREFIX + json.dumps(result))
+
+def run_reopen(args):
+    # 새 프로세스에서 저장소를 열고 첫 검색까지 걸리는 시간 (앱 재시작/콜드 스타트)
+    sys.path.insert(0, REPO_DIR)
+    started = time.perf_counter()
+    collection = open_collection(args.backend, os.path.join(os.getcwd(), "store"))
+    collection.query(query_embeddings=[[0.0] * args.dimensions], n_results=args.top_k, include=[])
+    print(RESULT_PREFIX + json.dumps({"reopen_seconds": time.perf_counter() - started}))
+
+def run_child(mode, backend, size, args, workdir):
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", mode, "--backend", backend, "--size", str(size),
+         "--dimensions", str(args.dimensions), "--queries", str(args.queries), "--top-k", str(args.top_k),
+         "--seed", str(args.seed)],
+        cwd=workdir, capture_output=True, text=True,
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get("PYTHONPATH")])))
+    )
+    lines = [line for line in completed.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+    if completed.returncode != 0 or not lines:
+        print(f"[{backend}/{size}] 실패 (종료 코드 {completed.returncode})")
+        print(completed.stdout[-2000:])
+        print(completed.stderr[-2000:])
+        return None
+    return json.loads(lines[-1][len(RESULT_PREFIX):])
+
+def print_report(results):
+    header = (
+        f"{'backend':<13}{'size':>8}{'build(s)':>10}{'reopen(s)':>11}"
+        f"{'query p50/p95/p99(ms)':>24}{'recall':>8}{'disk(MB)':>10}{'rss(MB)':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        query = "/".join(f"{r['query'][p] * 1000:.1f}" for p in ("p50", "p95", "p99"))
+        reopen = "-" if r.get("reopen_seconds") is None else f"{r['reopen_seconds']:.2f}"
+        print(
+            f"{r['backend']:<13}{r['size']:>8}{r['build_seconds']:>10.2f}{reopen:>11}"
+            f"{query:>24}{r['recall']:>8.3f}{r['disk_mb']:>10.1f}{r['rss_mb']:>9.1f}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="ChromaDB(HNSW) / NumPy 전수 검색 저장소 비교")
+    parser.add_argument("--sizes", default="1000,10000", help="쉼표로 구분한 벡터 개수")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help=f"쉼표로 구분한 저장소 ({', '.join(BACKENDS)})")
+    parser.add_argument("--dimensions", type=int, default=1536, help="임베딩 차원")
+    parser.add_argument("--queries", type=int, default=100, help="크기별 검색 횟수")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="결과 JSON 저장 경로")
+    parser.add_argument("--child", choices=["build", "reopen"], help=argparse.SUPPRESS)
+    parser.add_argument("--backend", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child == "build":
+        run_single(args)
+        return
+    if args.child == "reopen":
+        run_reopen(args)
+        return
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    backends = [backend.strip() for backend in args.backends.split(",") if backend.strip()]
+    unknown = [backend for backend in backends if backend not in BACKENDS]
+    if unknown:
+        parser.error(f"알 수 없는 저장소: {', '.join(unknown)}")
+
+    results = []
+    for size in sizes:
+        for backend in backends:
+            workdir = tempfile.mkdtemp(prefix=f"voc_vs_{backend}_{size}_")
+            print(f"[{backend}/{size}] 실행 중...")
+            try:
+                result = run_child("build", backend, size, args, workdir)
+                if result is None:
+                    continue
+                reopen = run_child("reopen", backend, size, args, workdir)
+                result["reopen_seconds"] = reopen["reopen_seconds"] if reopen else None
+                results.append(result)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    print()
+    print_report(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n결과 저장: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,26 @@
 import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from openai import AzureOpenAI
-from openai import AzureOpenAI as EmbeddingOpenAI
-from chromadb import PersistentClient
-from pdf_to_vectordb import extract_text_from_pdf, split_text, get_azure_embeddings, save_to_chroma
-from conversation_embedder import search_conversation_history
+from resources import get_chroma_db_path, get_collection, get_chat_client, get_embedding_client, PDF_COLLECTION
+from pdf_to_vectordb import extract_text_from_pdf, split_text, get_azure_embeddings, save_to_chroma, get_stored_embeddings
+from conversation_embedder import search_conversation_history, search_conversation_hits
+from embedding_cache import get_cached_embeddings
+from lexical_index import get_lexical_index, extract_identifiers, reciprocal_rank_fusion
+from answer_cache import get_answer_cache
+from query_cache import cached_query
+from context_packer import pack_context
+from tracing import get_logger, span, record_duration, increment, bind_context
+from quota_scheduler import get_quota_scheduler, estimate_chat_tokens, EMBEDDING_QUOTA, CHAT_QUOTA
+from chunker import count_tokens
 
 load_dotenv()
 
-# OpenAI 챗 클라이언트
-client = AzureOpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    azure_endpoint=os.getenv("AZURE_ENDPOINT"),
-    api_version=os.getenv("OPENAI_API_VERSION")
-)
+logger = get_logger("chat_core")
+
+# OpenAI 챗 클라이언트 (프로세스 공유)
+client = get_chat_client()
 DEPLOYMENT_NAME = os.getenv("DEPLOYMENT_NAME")
 
 # 임베딩 클라이언트
@@ -22,111 +29,227 @@ AZURE_EMBEDDING_ENDPOINT = os.getenv("TEXT_EMBEDDING_AZURE_OPENAI_ENDPOINT")
 AZURE_EMBEDDING_API_VERSION = os.getenv("TEXT_EMBEDDING_AZURE_OPENAI_API_VERSION")
 EMBEDDING_DEPLOYMENT_NAME = os.getenv("TEXT_EMBEDDING_DEPLOYMENT_NAME")
 
-# ChromaDB 저장 경로 (Azure Web App 호환)
-def get_chroma_db_path():
-    """
-    Azure Web App 환경에 맞는 ChromaDB 경로를 반환합니다.
-    Azure에서는 /home/site/wwwroot가 영구 저장소입니다.
-    """
-    # Azure Web App 환경 감지
-    if os.getenv("WEBSITE_SITE_NAME"):  
-        base_path = "/home/site/wwwroot/chroma_db"
-        print(f"Azure Web App 환경 감지: {base_path}")
-        return base_path
-    else:
-        # 로컬 개발 환경
-        base_path = os.path.join(os.getcwd(), "chroma_db")
-        print(f"로컬 개발 환경: {base_path}")
-        return base_path
-
 PERSIST_DIR = get_chroma_db_path()
 
+# 최근 답변 생성 지표 (첫 토큰까지 시간, 전체 생성 시간)
+GENERATION_METRICS = deque(maxlen=200)
+
+def record_generation_metrics(ttft, total, chars, stream):
+    metrics = {
+        "timestamp": time.time(),
+        "ttft": ttft,
+        "total": total,
+        "chars": chars,
+        "stream": stream
+    }
+    GENERATION_METRICS.append(metrics)
+    if ttft is not None:
+        record_duration("llm.ttft", ttft, stream=stream)
+    record_duration("llm.generation", total, chars=chars, stream=stream)
+    ttft_text = f"{ttft:.2f}초" if ttft is not None else "-"
+    logger.info(f"답변 생성: 첫 토큰 {ttft_text}, 전체 {total:.2f}초, {chars}자 ({'스트리밍' if stream else '일괄'})")
+    return metrics
+
 # OpenAI 챗 함수
-def get_openai_client(messages):
+def get_openai_client(messages, stream=False):
+    """
+    챗 답변을 생성합니다.
+    stream=True이면 토큰이 도착하는 대로 내보내는 제너레이터를 반환합니다.
+    """
+    if stream:
+        return stream_openai_response(messages)
+    started = time.perf_counter()
     try:
-        response = client.chat.completions.create(
-            model=DEPLOYMENT_NAME,
-            messages=messages,
-            temperature=0.4
+        response = get_quota_scheduler(CHAT_QUOTA).call(
+            lambda: client.chat.completions.create(
+                model=DEPLOYMENT_NAME,
+                messages=messages,
+                temperature=0.4
+            ),
+            tokens=estimate_chat_tokens(messages)
         )
-        return response.choices[0].message.content
+        content = response.choices[0].message.content
+        elapsed = time.perf_counter() - started
+        # 일괄 모드에서는 첫 토큰이 전체 답변과 함께 도착
+        record_generation_metrics(elapsed, elapsed, len(content or ""), stream=False)
+        return content
     except Exception as e:
         return f"Error: {e}"
 
-# 임베딩 생성 함수
+def stream_openai_response(messages, metrics=None):
+    """
+    스트리밍 모드로 답변을 생성하며 토큰(텍스트 조각)을 도착하는 대로 yield합니다.
+    metrics에 dict를 넘기면 종료 시 첫 토큰까지 시간(ttft), 전체 시간(total), 오류 여부(error)를 채워 줍니다.
+    """
+    started = time.perf_counter()
+    ttft = None
+    chars = 0
+    failed = False
+    try:
+        # 할당량이 모자라거나 429를 받으면 기다렸다가 요청 (대화형 요청이 대량 작업보다 먼저 나감)
+        response = get_quota_scheduler(CHAT_QUOTA).call(
+            lambda: client.chat.completions.create(
+                model=DEPLOYMENT_NAME,
+                messages=messages,
+                temperature=0.4,
+                stream=True
+            ),
+            tokens=estimate_chat_tokens(messages)
+        )
+        for chunk in response:
+            # Azure는 콘텐츠 필터 결과만 담긴(choices가 빈) 청크를 보내기도 함
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content
+            if not token:
+                continue
+            if ttft is None:
+                ttft = time.perf_counter() - started
+            chars += len(token)
+            yield token
+    except Exception as e:
+        failed = True
+        yield f"Error: {e}"
+    finally:
+        recorded = record_generation_metrics(ttft, time.perf_counter() - started, chars, stream=True)
+        if metrics is not None:
+            metrics.update(recorded, error=failed)
+
+# 임베딩 생성 함수 (같은 질문은 임베딩 캐시에서 바로 반환)
 def get_query_embedding(query):
-    embedding_client = EmbeddingOpenAI(
-        api_key=AZURE_EMBEDDING_API_KEY,
-        azure_endpoint=AZURE_EMBEDDING_ENDPOINT,
-        api_version=AZURE_EMBEDDING_API_VERSION
-    )
-    response = embedding_client.embeddings.create(
-        input=query,
-        model=EMBEDDING_DEPLOYMENT_NAME
-    )
-    return response.data[0].embedding
+    def request_embeddings(texts):
+        response = get_quota_scheduler(EMBEDDING_QUOTA).call(
+            lambda: get_embedding_client().embeddings.create(
+                input=texts,
+                model=EMBEDDING_DEPLOYMENT_NAME
+            ),
+            tokens=sum(count_tokens(text) for text in texts)
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+    return get_cached_embeddings(EMBEDDING_DEPLOYMENT_NAME, [query], request_embeddings)[0]
+
+def _answer_cache_embedding(query):
+    # SRM 번호 질의는 번호 일치로 찾으므로 임베딩하지 않음
+    return None if extract_identifiers(query) else get_query_embedding(query)
+
+def find_cached_answer(query):
+    """
+    같거나 매우 비슷한 질문에 대한 캐시된 답변을 찾습니다. 없으면 None입니다.
+    적중하면 검색(search_all_content)과 답변 생성을 모두 건너뛸 수 있습니다.
+    (질문 임베딩은 임베딩 캐시에 남으므로 이어지는 검색에서 다시 요청하지 않음)
+    """
+    with span("answer_cache.lookup") as s:
+        try:
+            cached = get_answer_cache().get(query, query_embedding=_answer_cache_embedding(query))
+        except Exception as e:
+            logger.warning(f"답변 캐시 조회 중 오류: {e}")
+            return None
+        s.set(hit=bool(cached))
+    increment("answer_cache.hits" if cached else "answer_cache.misses")
+    if cached:
+        logger.info(f"답변 캐시 적중: 유사도 {cached['similarity']:.3f}, {cached['age']:.0f}초 전 답변")
+    return cached
+
+def store_cached_answer(query, answer):
+    """
+    생성한 답변을 답변 캐시에 저장합니다. 오류 응답이나 빈 답변은 저장하지 않습니다.
+    """
+    if not answer or answer.startswith("Error:"):
+        return
+    try:
+        get_answer_cache().put(query, answer, query_embedding=_answer_cache_embedding(query))
+    except Exception as e:
+        logger.warning(f"답변 캐시 저장 중 오류: {e}")
 
 # ChromaDB 검색 함수 (저장 경로 고정: ./chroma_db)
-def search_chroma(query, top_k=10):
+def search_chroma(query, top_k=10, query_embedding=None):
     """
-    ChromaDB에서 PDF 문서만 검색합니다.
-    더 많은 PDF 내용을 검색하여 포괄적인 답변이 가능합니다.
+    ChromaDB의 PDF 전용 컬렉션에서 검색합니다.
     Azure Web App 환경에서도 안정적으로 작동합니다.
+    query_embedding을 넘기면 쿼리 임베딩을 다시 계산하지 않습니다.
+
+    질문에 SRM 번호 같은 정확한 식별자가 있으면 임베딩 없이 키워드 색인에서 바로 찾고,
+    그 외에는 벡터 검색 결과와 키워드(BM25) 검색 결과를 RRF로 합칩니다.
     """
-    persist_dir = get_chroma_db_path()  # 동적 경로 사용
-    
-    # 디렉토리가 없으면 생성
+    return [hit["document"] for hit in search_pdf_hits(query, top_k=top_k, query_embedding=query_embedding)]
+
+def search_pdf_hits(query, top_k=10, query_embedding=None):
+    """
+    search_chroma와 같은 방식으로 검색하되 [{'id', 'document', 'embedding'}, ...]를 반환합니다.
+    키워드 색인에서만 찾은 문서는 컬렉션에 저장된 임베딩을 채워 넣습니다. (컨텍스트 중복 제거용)
+    """
+    lexical_index = get_lexical_index()
+
+    # 1. 정확한 식별자 검색 (임베딩 호출 없음)
+    if extract_identifiers(query):
+        try:
+            with span("lexical.search", scope="pdf", exact_only=True):
+                exact_hits = lexical_index.search("pdf", query, top_k=top_k, exact_only=True)
+            if exact_hits:
+                return _with_stored_embeddings(exact_hits)
+        except Exception as e:
+            logger.warning(f"식별자 검색 중 오류: {e}")
+
+    # 2. 벡터 검색 + 키워드 검색 융합
+    vector_hits = _vector_search_pdf(query, top_k, query_embedding)
     try:
-        os.makedirs(persist_dir, exist_ok=True)
+        with span("lexical.search", scope="pdf"):
+            lexical_hits = lexical_index.search("pdf", query, top_k=top_k)
     except Exception as e:
-        print(f"ChromaDB 디렉토리 생성 실패: {e}")
-    
-    try:
-        client = PersistentClient(path=persist_dir)
-        collection = client.get_or_create_collection("pdf_collection")
-        query_emb = get_query_embedding(query)
-        
+        logger.warning(f"키워드 검색 중 오류: {e}")
+        lexical_hits = []
+    if not lexical_hits:
+        return vector_hits
+
+    hits = {hit["id"]: {"id": hit["id"], "document": hit["document"], "embedding": None} for hit in lexical_hits}
+    hits.update({hit["id"]: hit for hit in vector_hits})
+    fused_ids = reciprocal_rank_fusion(
+        [[hit["id"] for hit in vector_hits], [hit["id"] for hit in lexical_hits]],
+        top_k=top_k
+    )
+    return _with_stored_embeddings([hits[id_] for id_ in fused_ids])
+
+def _with_stored_embeddings(hits):
+    # 임베딩이 없는 검색 결과에 저장된 임베딩을 채움 (실패해도 검색 결과는 그대로 사용)
+    hits = [dict(hit, embedding=hit.get("embedding")) for hit in hits]
+    missing = [hit["id"] for hit in hits if hit["embedding"] is None]
+    if missing:
         try:
-            # PDF 문서를 더 많이 검색 (top_k * 3으로 확장)
-            results = collection.query(
-                query_embeddings=[query_emb],
-                n_results=min(top_k * 3, 50),  # 최대 50개까지 검색
-                include=["documents", "metadatas"],
-                where={"type": "pdf"}  # PDF 문서만 검색
-            )
-            
-            if results["documents"] and results["documents"][0]:
-                # PDF 문서만 필터링하여 반환
-                pdf_docs = []
-                for doc, meta in zip(results["documents"][0], results["metadatas"][0]):
-                    if meta.get("type") == "pdf":
-                        pdf_docs.append(doc)
-                    if len(pdf_docs) >= top_k:
-                        break
-                return pdf_docs
-            else:
-                return []
+            stored = get_stored_embeddings(get_collection(PDF_COLLECTION), missing)
+            for hit in hits:
+                if hit["embedding"] is None:
+                    hit["embedding"] = stored.get(hit["id"])
         except Exception as e:
-            print(f"PDF 검색 중 오류: {e}")
-            # 메타데이터 필터링이 실패하면 기존 방식으로 fallback
-            try:
-                results = collection.query(
-                    query_embeddings=[query_emb],
-                    n_results=min(top_k * 2, 30),  # fallback에서도 더 많이 검색
-                    include=["documents"]
-                )
-                return results["documents"][0][:top_k] if results["documents"] else []
-            except Exception as e2:
-                print(f"Fallback 검색 중 오류: {e2}")
-                return []
-                
+            logger.warning(f"검색 결과 임베딩 조회 중 오류: {e}")
+    return hits
+
+def _vector_search_pdf(query, top_k, query_embedding=None):
+    """
+    PDF 청크 벡터 검색 결과를 [{'id', 'document', 'embedding'}, ...]로 반환합니다.
+    PDF 전용 컬렉션이므로 메타데이터 필터나 과다 검색 없이 top_k개만 조회합니다.
+    같은 질의 벡터/top_k의 결과는 저장이 없는 동안 검색 결과 캐시에서 바로 반환합니다.
+    """
+    try:
+        collection = get_collection(PDF_COLLECTION)  # 공유 클라이언트/컬렉션
+        query_emb = query_embedding if query_embedding is not None else get_query_embedding(query)
+        results = cached_query(PDF_COLLECTION, collection, query_emb, top_k, include=["documents", "embeddings"])
+        if results["documents"] and results["documents"][0]:
+            return [
+                {"id": id_, "document": doc, "embedding": list(emb)}
+                for id_, doc, emb in zip(results["ids"][0], results["documents"][0], results["embeddings"][0])
+            ]
+        return []
     except Exception as e:
-        print(f"ChromaDB 초기화 중 오류: {e}")
+        logger.warning(f"PDF 검색 중 오류: {e}")
         return []
 
 # PDF 관련 함수는 pdf_to_vectordb.py에서 import하여 그대로 사용
 # extract_text_from_pdf, split_text, get_azure_embeddings, save_to_chroma
 
+# 검색 병렬 실행용 스레드 풀 (PDF 검색 + 대화 기록 검색)
+_retrieval_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval")
+
 # 통합 검색 함수 (PDF + 대화 기록)
 def search_all_content(query, pdf_top_k=10, conversation_top_k=3):
     """
@@ -137,25 +260,76 @@ def search_all_content(query, pdf_top_k=10, conversation_top_k=3):
         pdf_top_k: PDF에서 검색할 최대 결과 수 (기본값: 10개로 증가)
         conversation_top_k: 대화 기록에서 검색할 최대 결과 수 (기본값: 3개로 증가)
     
+    쿼리 임베딩은 한 번만 생성하고, PDF 검색과 대화 기록 검색은 병렬로 실행합니다.
+    검색 결과는 토큰 예산(CONTEXT_MAX_TOKENS) 안에서 중복을 빼고 다양하게(MMR) 골라 컨텍스트에 넣습니다.
+    
     Returns:
-        dict: {'pdf_chunks': [], 'conversation_history': [], 'context_text': str}
+        dict: {'pdf_chunks': [], 'conversation_history': [], 'context_text': str, 'timings': dict, 'context_stats': dict}
+        pdf_chunks/conversation_history는 컨텍스트에 실제로 들어간 내용입니다.
+        timings에는 단계별 소요 시간(초), context_stats에는 컨텍스트 토큰 수와 줄인 토큰 수가 들어갑니다.
     """
     result = {
         'pdf_chunks': [],
         'conversation_history': [],
-        'context_text': ''
+        'context_text': '',
+        'timings': {},
+        'context_stats': {}
     }
+    timings = result['timings']
+    started = time.perf_counter()
     
     try:
-        # 1. PDF 내용 검색
-        pdf_chunks = search_chroma(query, top_k=pdf_top_k)
-        result['pdf_chunks'] = pdf_chunks
+        # 1. 쿼리 임베딩은 한 번만 생성하여 두 검색에 공유
+        #    (SRM 번호 등 식별자 질의는 키워드 색인에서 바로 찾으므로 미리 임베딩하지 않음)
+        t = time.perf_counter()
+        with span("query_embedding"):
+            query_embedding = None if extract_identifiers(query) else get_query_embedding(query)
+        timings['embedding'] = time.perf_counter() - t
         
-        # 2. 대화 기록 검색
-        conversation_history = search_conversation_history(query, top_k=conversation_top_k)
+        # 2. PDF 내용 검색과 대화 기록 검색을 동시에 실행
+        def timed(name, fn, *args, **kwargs):
+            t = time.perf_counter()
+            try:
+                with span(name):
+                    return fn(*args, **kwargs)
+            finally:
+                timings[name] = time.perf_counter() - t
+        
+        t = time.perf_counter()
+        pdf_future = _retrieval_executor.submit(
+            bind_context(timed), 'pdf_search', search_pdf_hits, query, top_k=pdf_top_k, query_embedding=query_embedding
+        )
+        conversation_future = _retrieval_executor.submit(
+            bind_context(timed), 'conversation_search', search_conversation_hits, query,
+            top_k=conversation_top_k, query_embedding=query_embedding
+        )
+        pdf_hits = pdf_future.result()
+        conversation_hits = conversation_future.result()
+        timings['retrieval'] = time.perf_counter() - t
+        
+        # 3. 토큰 예산 안에서 중복을 빼고 관련도/다양성 순으로 검색 결과 선택
+        t = time.perf_counter()
+        with span("context_pack") as s:
+            packed = pack_context(
+                [dict(hit, source='pdf') for hit in pdf_hits] +
+                [dict(hit, source='conversation') for hit in conversation_hits],
+                query_embedding=query_embedding
+            )
+            s.set(**{key: value for key, value in packed.items() if key != 'selected'})
+        pdf_chunks = [item['document'] for item in packed['selected'] if item['source'] == 'pdf']
+        conversation_history = [item['document'] for item in packed['selected'] if item['source'] == 'conversation']
+        result['pdf_chunks'] = pdf_chunks
         result['conversation_history'] = conversation_history
+        result['context_stats'] = {key: value for key, value in packed.items() if key != 'selected'}
+        timings['context_pack'] = time.perf_counter() - t
+        logger.info(
+            f"컨텍스트 구성: {len(packed['selected'])}/{len(pdf_hits) + len(conversation_hits)}개 사용, "
+            f"{packed['tokens_used']}토큰 (절약 {packed['tokens_saved']}토큰, "
+            f"중복 {packed['duplicates']}개, 예산 초과 {packed['over_budget']}개 제외)"
+        )
         
-        # 3. 통합 컨텍스트 구성 (더 상세하고 체계적으로)
+        # 4. 통합 컨텍스트 구성 (더 상세하고 체계적으로)
+        t = time.perf_counter()
         context_parts = []
         
         if pdf_chunks:
@@ -184,9 +358,14 @@ def search_all_content(query, pdf_top_k=10, conversation_top_k=3):
 아래 정보를 모두 검토하여 종합적이고 정확한 답변을 제공해주세요:
 """
             result['context_text'] = instruction + "\n".join(context_parts)
+        timings['context_build'] = time.perf_counter() - t
+        timings['total'] = time.perf_counter() - started
+        record_duration('search_all_content', timings['total'], pdf_chunks=len(pdf_chunks),
+                        conversation_history=len(conversation_history))
         
         return result
         
     except Exception as e:
-        print(f"통합 검색 중 오류: {e}")
+        logger.warning(f"통합 검색 중 오류: {e}")
+        timings['total'] = time.perf_counter() - started
         return result
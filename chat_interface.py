@@ -1,11 +1,107 @@
+import time
+from collections import deque
 import streamlit as st
-from chat_core import get_openai_client, search_all_content
-from pdf_to_vectordb import extract_text_from_pdf, split_text, get_azure_embeddings, save_to_chroma
-from conversation_embedder import save_conversation_to_chroma, get_conversation_stats
+from chat_core import stream_openai_response, search_all_content, find_cached_answer, store_cached_answer
+from answer_cache import get_answer_cache
+from embedding_cache import get_embedding_cache
+from query_cache import get_query_cache
+from quota_scheduler import get_quota_scheduler, EMBEDDING_QUOTA, CHAT_QUOTA
+from pdf_pipeline import ingest_pdf_streaming
+from conversation_embedder import get_conversation_stats, migrate_conversations_to_own_collection
+from conversation_writer import save_conversation_async, get_conversation_writer
+from lexical_index import ensure_lexical_index
+from history_manager import build_prompt_messages, fold_history_in_background, new_history_state
+from resources import warm_up
+from transcript_renderer import build_transcript_html, render_streaming_html, TRANSCRIPT_WINDOW, TRANSCRIPT_PAGE_SIZE
+from tracing import get_logger, span, get_latency_summary, get_counters
+
+logger = get_logger("chat_interface")
+
+TURN_METRICS_MAX = 20  # 세션에 보관할 최근 턴 측정값 수 (사이드바에는 직전 턴만 표시)
+
+def record_turn_metrics(metrics):
+    # 세션이 길어져도 측정값이 계속 쌓이지 않도록 최근 것만 보관
+    turn_metrics = st.session_state.get('turn_metrics')
+    if not isinstance(turn_metrics, deque):
+        turn_metrics = st.session_state['turn_metrics'] = deque(turn_metrics or [], maxlen=TURN_METRICS_MAX)
+    turn_metrics.append(metrics)
+
+# 프로세스당 한 번만 ChromaDB/HTTP 연결을 준비 (rerun 시에는 캐시된 결과 사용)
+@st.cache_resource(show_spinner=False)
+def warm_up_resources():
+    # 예전 방식으로 PDF 컬렉션에 섞여 저장된 대화 기록을 대화 전용 컬렉션으로 이동
+    try:
+        migrate_conversations_to_own_collection()
+    except Exception as e:
+        logger.warning(f"대화 기록 마이그레이션 중 오류: {e}")
+    # 키워드 색인 도입 전에 저장된 데이터가 있으면 한 번 색인 (SRM 번호 검색용)
+    try:
+        ensure_lexical_index()
+    except Exception as e:
+        logger.warning(f"키워드 색인 재구축 중 오류: {e}")
+    # 대화 백그라운드 저장 스레드 시작 (이전 실행에서 저장하지 못한 턴이 있으면 이어서 저장)
+    get_conversation_writer()
+    return warm_up()
+
+# 스트리밍 답변 화면 갱신 간격(초)
+STREAM_RENDER_INTERVAL = 0.05
+
+def render_streaming_bubble(placeholder, chat_html, text):
+    # 기존 대화 + 생성 중인 답변 버블을 채팅 영역에 그림
+    placeholder.markdown(render_streaming_html(chat_html, text), unsafe_allow_html=True)
+
+def render_diagnostics_panel():
+    # 단계별 지연 시간 백분위수(ms)와 캐시/저장기 상태 (자세한 기록은 추적 파일 traces.jsonl 참고)
+    with st.sidebar.expander("🔎 진단", expanded=False):
+        latency = get_latency_summary()
+        if latency:
+            st.table([
+                {
+                    "단계": name,
+                    "횟수": summary["count"],
+                    "p50": f"{summary['p50'] * 1000:.0f}",
+                    "p95": f"{summary['p95'] * 1000:.0f}",
+                    "p99": f"{summary['p99'] * 1000:.0f}",
+                    "최대": f"{summary['max'] * 1000:.0f}"
+                }
+                for name, summary in latency.items()
+            ])
+        else:
+            st.caption("아직 기록된 단계가 없습니다.")
+        embedding_stats = get_embedding_cache().stats()
+        st.caption(f"임베딩 캐시: 적중률 {embedding_stats['hit_ratio']:.0%} "
+                   f"({embedding_stats['hits']}/{embedding_stats['hits'] + embedding_stats['misses']}), "
+                   f"{embedding_stats['entries']}개 저장")
+        answer_stats = get_answer_cache().stats()
+        st.caption(f"답변 캐시: 적중률 {answer_stats['hit_ratio']:.0%} "
+                   f"({answer_stats['hits']}/{answer_stats['hits'] + answer_stats['misses']}), "
+                   f"{answer_stats['entries']}개 저장")
+        query_stats = get_query_cache().stats()
+        st.caption(f"검색 결과 캐시: 적중률 {query_stats['hit_ratio']:.0%} "
+                   f"({query_stats['hits']}/{query_stats['hits'] + query_stats['misses']}), "
+                   f"{query_stats['entries']}/{query_stats['max_entries']}개 저장, 버전 변경으로 버림 {query_stats['stale']}개")
+        writer_stats = get_conversation_writer().stats()
+        st.caption(f"대화 저장 대기열: {writer_stats['pending']}턴 "
+                   f"(저장 완료 {writer_stats['written_turns']}턴, 실패 배치 {writer_stats['failed_batches']}개, "
+                   f"저장 불가 {writer_stats['dead_lettered']}턴)")
+        maintenance = writer_stats["last_maintenance"]
+        if maintenance:
+            st.caption(f"대화 기록 정리 ({time.strftime('%H:%M', time.localtime(maintenance['finished_at']))}): "
+                       f"보존 기간 초과 {maintenance['expired']}턴, 개수 초과 {maintenance['overflow']}턴, "
+                       f"유사 대화 통합 {maintenance['removed']}턴 삭제")
+        for quota in (EMBEDDING_QUOTA, CHAT_QUOTA):
+            quota_stats = get_quota_scheduler(quota).stats()
+            st.caption(f"Azure {quota} 할당량: 429 {quota_stats['rate_limited']}회, 재시도 {quota_stats['retries']}회, "
+                       f"대기 중 상담 {quota_stats['waiting']['interactive']}건/적재 {quota_stats['waiting']['bulk']}건, "
+                       f"누적 대기 상담 {quota_stats['wait_seconds']['interactive']:.1f}초/적재 {quota_stats['wait_seconds']['bulk']:.1f}초")
+        counters = get_counters()
+        if counters:
+            st.caption(", ".join(f"{name} {value:g}" for name, value in counters.items()))
 
 def main():
     # Streamlit UI 설정
     st.set_page_config(layout="centered")
+    warm_up_timings = warm_up_resources()
     st.markdown("""
     <style>
         body, .block-container {
@@ -138,13 +234,34 @@ def main():
                     "</div>", unsafe_allow_html=True)
     with reset_col:
         pass  # 상단에서 초기화 버튼 제거
+    # 직전 답변의 첫 토큰까지 시간 / 전체 생성 시간
+    if st.session_state.get('turn_metrics'):
+        last = st.session_state['turn_metrics'][-1]
+        ttft = f"{last['ttft']:.2f}초" if last.get('ttft') is not None else "-"
+        if last.get('cached'):
+            st.sidebar.caption(f"⏱️ 직전 답변: 캐시 응답 (유사도 {last['similarity']:.3f})")
+        else:
+            st.sidebar.caption(f"⏱️ 직전 답변: 첫 토큰 {ttft}, 전체 {last.get('total', 0):.2f}초")
+    # 직전 답변 프롬프트 크기 (누적 요약 + 최근 턴)
+    if st.session_state.get('history_state', {}).get('last_prompt_tokens'):
+        history_state = st.session_state['history_state']
+        st.sidebar.caption(f"📝 직전 프롬프트: {history_state['last_prompt_tokens']}토큰 "
+                           f"(요약된 메시지 {history_state['summarized']}개)")
+    # 직전 질문의 검색 컨텍스트 토큰 수 / 중복 제거·예산으로 줄인 토큰 수
+    if st.session_state.get('context_stats'):
+        context_stats = st.session_state['context_stats']
+        st.sidebar.caption(f"🧩 직전 컨텍스트: {context_stats['tokens_used']}토큰 "
+                           f"(절약 {context_stats['tokens_saved']}토큰, 중복 {context_stats['duplicates']}개 제외)")
+    st.sidebar.caption(f"⚙️ 리소스 워밍업: {warm_up_timings['total']:.2f}초 "
+                       f"(ChromaDB {warm_up_timings['chroma']:.2f}초, 임베딩 연결 {warm_up_timings['embedding_http']:.2f}초)")
+    render_diagnostics_panel()
 
     col1, col2 = st.columns([1, 4], gap="small")
 
     # 세션 상태 초기화 (항상 보장)
     if 'messages' not in st.session_state:
         st.session_state['messages'] = [
-            {"role": "assistant", "content": "안녕하세요! K-ICIS 오더 VOC 전문 상담 챗봇입니다. <br>궁금한 점을 입력해 주세요."}
+            {"role": "assistant", "content": "안녕하세요! K-ICIS 오더 VOC 전문 상담 챗봇입니다.\n궁금한 점을 입력해 주세요."}
         ]
 
     with col1:
@@ -152,6 +269,8 @@ def main():
         with st.container():
             if st.button('초기화', key='reset_chat_col1', use_container_width=True):
                 st.session_state['messages'] = []
+                st.session_state['history_state'] = new_history_state()
+                st.session_state['transcript_visible'] = TRANSCRIPT_WINDOW
                 st.session_state['pdf_applied'] = False
                 # 통합 컬렉션 통계 표시
                 stats = get_conversation_stats()
@@ -182,11 +301,8 @@ def main():
                         with open(temp_path, "wb") as f:
                             f.write(uploaded_pdf.getbuffer())
                         try:
-                            text = extract_text_from_pdf(temp_path)
-                            chunks = split_text(text)
-                            embeddings = get_azure_embeddings(chunks)
-                            # ChromaDB에 저장 (경로 고정: ./chroma_db)
-                            save_to_chroma(chunks, embeddings, pdf_path=temp_path)
+                            # 페이지 추출 → 청크 분할 → 임베딩 → ChromaDB 저장을 스트리밍으로 처리
+                            ingest_pdf_streaming(temp_path)
                             st.session_state['pdf_applied'] = True
                             st.success("PDF가 벡터 DB(ChromaDB)에 성공적으로 적용되었습니다!")
                         except Exception as e:
@@ -196,23 +312,36 @@ def main():
 
     with col2:
         # 채팅 메시지 영역 (고정 높이, 스크롤, 가로폭 900px)
-        chat_html = '''
-        <div id="chat-area">
-        '''
-        for message in st.session_state.get('messages', []):
-            if message["role"] == "user":
-                chat_html += f"<div style='text-align:right; margin:8px 0;'><span class='chat-bubble-user'>{message['content']}</span></div>"
-            elif message["role"] == "assistant":
-                chat_html += f"<div style='text-align:left; margin:8px 0;'><span class='chat-bubble-assistant'>{message['content']}</span></div>"
-        chat_html += "</div>"
-        st.markdown(chat_html, unsafe_allow_html=True)
+        # 최근 메시지만 그리고(메시지별 HTML은 캐시), 이전 대화는 버튼을 눌렀을 때만 더 불러옴
+        visible_count = st.session_state.setdefault('transcript_visible', TRANSCRIPT_WINDOW)
+        chat_html, hidden_count = build_transcript_html(st.session_state.get('messages', []), visible_count)
+        if hidden_count > 0:
+            if st.button(f"이전 대화 더 보기 ({hidden_count}개)", key="load_older_messages"):
+                st.session_state['transcript_visible'] = visible_count + TRANSCRIPT_PAGE_SIZE
+                st.rerun()
+        # 스트리밍 중에는 같은 자리에 답변 버블을 덧붙여 다시 그림
+        chat_placeholder = st.empty()
+        chat_placeholder.markdown(chat_html + "</div>", unsafe_allow_html=True)
 
         user_input = st.chat_input("메시지를 입력하세요:")
         if user_input:
             st.session_state.messages = [m for m in st.session_state.messages if m["role"] != "system"]
             
-            # 통합 검색 (PDF + 대화 기록) - 대화 기록 검색 범위 확대
-            search_result = search_all_content(user_input, pdf_top_k=8, conversation_top_k=5)
+            # 같은(비슷한) 질문에 대한 답변이 캐시에 있으면 검색과 답변 생성 없이 바로 표시
+            with span("turn.retrieval") as turn_span:
+                cached = find_cached_answer(user_input)
+                turn_span.set(answer_cache_hit=bool(cached))
+                if not cached:
+                    # 통합 검색 (PDF + 대화 기록) - PDF 청크는 레코드 단위라 적은 수로도 충분
+                    search_result = search_all_content(user_input, pdf_top_k=4, conversation_top_k=5)
+                    turn_span.set(context_tokens=search_result['context_stats'].get('tokens_used', 0))
+            if cached:
+                st.session_state.messages.append({"role": "user", "content": user_input})
+                st.session_state.messages.append({"role": "assistant", "content": cached['answer']})
+                record_turn_metrics({"cached": True, "similarity": cached['similarity'], "ttft": 0.0, "total": 0.0})
+                st.rerun()
+            
+            st.session_state['context_stats'] = search_result['context_stats']
             
             # 컨텍스트가 있으면 시스템 프롬프트로 추가
             if search_result['context_text']:
@@ -221,19 +350,38 @@ def main():
             st.session_state.messages.append({"role": "user", "content": user_input})
             st.rerun()
 
-        # 답변 생성
+        # 답변 생성 (토큰이 도착하는 대로 채팅 버블에 표시)
         if st.session_state.messages and st.session_state.messages[-1]["role"] == "user":
-            with st.spinner("응답 생성 중..."):
-                response = get_openai_client(st.session_state.messages)
+            metrics = {}
+            response = ""
+            last_render = 0.0
+            # 이전 대화는 누적 요약으로, 그 뒤 대화는 원문으로 보냄 (요약은 답변 뒤 백그라운드에서 갱신)
+            history_state = st.session_state.setdefault('history_state', new_history_state())
+            with span("turn.generation") as turn_span:
+                prompt_messages = build_prompt_messages(st.session_state.messages, history_state)
+                turn_span.set(prompt_tokens=history_state['last_prompt_tokens'])
+                for token in stream_openai_response(prompt_messages, metrics=metrics):
+                    response += token
+                    # 토큰마다 다시 그리면 부담이 크므로 일정 간격으로만 갱신
+                    if time.perf_counter() - last_render >= STREAM_RENDER_INTERVAL:
+                        render_streaming_bubble(chat_placeholder, chat_html, response + " ▌")
+                        last_render = time.perf_counter()
+                turn_span.set(chars=len(response), error=bool(metrics.get('error')))
+            render_streaming_bubble(chat_placeholder, chat_html, response)
+            record_turn_metrics(metrics)
             st.session_state.messages.append({"role": "assistant", "content": response})
+            if not metrics.get('error'):
+                store_cached_answer(st.session_state.messages[-2]["content"], response)
+            # 오래된 턴 요약은 답변을 보낸 뒤 다음 턴을 위해 백그라운드에서 실행 (첫 토큰 지연에 포함되지 않음)
+            fold_history_in_background(st.session_state.messages, history_state)
             
-            # 대화 내용을 ChromaDB에 저장 (최근 사용자 메시지와 AI 답변)
+            # 대화 내용을 ChromaDB에 저장 (백그라운드 대기열에 넣고 바로 다음 화면으로 진행)
             try:
                 user_message = st.session_state.messages[-2]["content"]  # 사용자 메시지
                 assistant_message = response  # AI 답변
-                save_conversation_to_chroma(user_message, assistant_message)
+                save_conversation_async(user_message, assistant_message)
             except Exception as e:
-                print(f"대화 저장 중 오류: {e}")
+                logger.warning(f"대화 저장 중 오류: {e}")
             
             st.rerun()
 
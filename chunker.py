@@ -0,0 +1,195 @@
+import os
+import re
+from functools import lru_cache
+from dotenv import load_dotenv
+from tracing import get_logger
+
+# 환경변수 로드
+load_dotenv()
+
+logger = get_logger("chunker")
+
+EMBEDDING_DEPLOYMENT_NAME = os.getenv("TEXT_EMBEDDING_DEPLOYMENT_NAME")
+
+# 청크 설정 (임베딩 모델 토크나이저 기준 토큰 수)
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "64"))
+
+# VOC/SRM 레코드 시작 줄 패턴 (줄 앞부분에 SRM 접수번호나 접수번호/VOC번호 항목이 오는 경우)
+CHUNK_RECORD_PATTERN = os.getenv(
+    "CHUNK_RECORD_PATTERN",
+    r"^[ \t]*(?:\d+[.)][ \t]*)?(?:\[?[ \t]*SRM\d{8,}|접수[ \t]*번호|VOC[ \t]*번호)"
+)
+RECORD_START = re.compile(CHUNK_RECORD_PATTERN, re.MULTILINE)
+
+# 문장 경계 (마침표/물음표/느낌표 뒤 공백) - 줄 단위로 나눈 뒤에도 너무 길 때 사용
+SENTENCE_END = re.compile(r"(?<=[.!?。])\s+")
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    """
+    임베딩 모델의 토크나이저를 반환합니다. tiktoken이 없거나 로드에 실패하면 None입니다.
+    Azure 배포명은 모델명과 다를 수 있으므로 찾지 못하면 cl100k_base(text-embedding-3/ada-002)를 사용합니다.
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        logger.info("tiktoken이 설치되어 있지 않아 토큰 수를 추정값으로 계산합니다.")
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(EMBEDDING_DEPLOYMENT_NAME or "")
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # 인코딩 파일을 내려받을 수 없는 환경(외부 네트워크 차단 등)에서는 추정값 사용
+        logger.warning(f"토크나이저 로드 실패, 토큰 수를 추정값으로 계산합니다: {e}")
+        return None
+
+def count_tokens(text):
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        # 한글은 글자당 약 1토큰, 영문은 3~4글자당 1토큰
+        return len(text.encode("utf-8")) // 3 + 1
+    return len(tokenizer.encode(text, disallowed_special=()))
+
+def split_records(text):
+    """
+    VOC/SRM 레코드 시작 줄을 기준으로 텍스트를 레코드 단위로 나눕니다.
+    첫 레코드 앞의 텍스트(표지, 목차 등)는 별도 레코드로 취급합니다.
+    """
+    starts = [m.start() for m in RECORD_START.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    starts.append(len(text))
+    records = [text[a:b].strip() for a, b in zip(starts, starts[1:])]
+    return [r for r in records if r]
+
+def _split_units(record):
+    # 레코드를 줄(표 행 포함) 단위로, 줄이 너무 길면 문장 단위로 나눔
+    units = []
+    for line in record.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        units.extend(s for s in SENTENCE_END.split(line) if s)
+    return units
+
+def _hard_split(text, max_tokens):
+    # 문장 하나가 최대 토큰보다 길면 토큰 단위로 자름
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        size = max(1, max_tokens)
+        return [text[i:i + size] for i in range(0, len(text), size)]
+    tokens = tokenizer.encode(text, disallowed_special=())
+    return [tokenizer.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+
+def _split_long_record(record, max_tokens, overlap_tokens):
+    """
+    최대 토큰을 넘는 레코드를 줄/문장 경계에서 나눕니다.
+    나뉜 조각에는 레코드 첫 줄(SRM 번호 등 헤더)을 붙이고, 앞 조각의 끝 부분을 overlap만큼 겹칩니다.
+    """
+    lines = record.splitlines()
+    header = lines[0].strip() if lines and RECORD_START.match(record) else ""
+    header_tokens = count_tokens(header) if header else 0
+    budget = max(1, max_tokens - header_tokens)
+
+    units = []
+    for unit in _split_units(record):
+        if count_tokens(unit) > budget:
+            units.extend(_hard_split(unit, budget))
+        else:
+            units.append(unit)
+
+    pieces = []
+    current, current_tokens = [], 0
+    for unit in units:
+        unit_tokens = count_tokens(unit)
+        if current and current_tokens + unit_tokens > budget:
+            pieces.append(current)
+            # 앞 조각의 마지막 문장들을 overlap 토큰만큼 다음 조각으로 이어 붙임
+            overlap, overlap_size = [], 0
+            for prev in reversed(current):
+                prev_tokens = count_tokens(prev)
+                if overlap_size + prev_tokens > overlap_tokens:
+                    break
+                overlap.insert(0, prev)
+                overlap_size += prev_tokens
+            current, current_tokens = overlap, overlap_size
+        current.append(unit)
+        current_tokens += unit_tokens
+    if current:
+        pieces.append(current)
+
+    chunks = []
+    for i, piece in enumerate(pieces):
+        body = "\n".join(piece)
+        if i > 0 and header and not body.startswith(header):
+            body = f"{header}\n{body}"
+        chunks.append(body)
+    return chunks
+
+def pack_records(records, max_tokens=None, overlap_tokens=None):
+    """
+    레코드를 최대 토큰 안에서 가능한 한 많이 묶어 청크를 만듭니다.
+    레코드는 중간에서 자르지 않으며, 혼자서 최대 토큰을 넘는 레코드만 나눕니다.
+    """
+    max_tokens = max_tokens or CHUNK_MAX_TOKENS
+    overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    chunks = []
+    current, current_tokens = [], 0
+    for record in records:
+        record_tokens = count_tokens(record)
+        if record_tokens > max_tokens:
+            if current:
+                chunks.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            chunks.extend(_split_long_record(record, max_tokens, overlap_tokens))
+            continue
+        if current and current_tokens + record_tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(record)
+        current_tokens += record_tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+def split_into_chunks(text, max_tokens=None, overlap_tokens=None):
+    """
+    텍스트를 VOC/SRM 레코드 경계에 맞춰 토큰 크기 기준 청크로 나눕니다.
+    """
+    return pack_records(split_records(text), max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+
+def iter_record_chunks(pages, max_tokens=None, overlap_tokens=None):
+    """
+    (페이지 번호, 텍스트)를 받아 레코드 경계 기준 청크를 (시작 페이지 번호, 청크)로 내보냅니다.
+    페이지 끝에서 끝나지 않은 레코드는 다음 페이지와 이어 붙인 뒤에 청크로 만듭니다.
+    """
+    max_tokens = max_tokens or CHUNK_MAX_TOKENS
+    buffer, buffer_page = "", None
+    for page_no, page_text in pages:
+        if not buffer:
+            buffer_page = page_no
+        buffer += page_text + "\n"
+        records = split_records(buffer)
+        if len(records) > 1:
+            # 마지막 레코드는 다음 페이지로 이어질 수 있으므로 남겨 둠
+            buffer = records[-1] + "\n"
+            for chunk in pack_records(records[:-1], max_tokens, overlap_tokens):
+                yield buffer_page, chunk
+            buffer_page = page_no
+        elif count_tokens(buffer) > max_tokens * 4:
+            # 레코드 경계가 없는 긴 본문은 메모리가 무한히 늘지 않도록 바로 내보냄
+            for chunk in pack_records(records, max_tokens, overlap_tokens):
+                yield buffer_page, chunk
+            buffer = ""
+    if buffer.strip():
+        for chunk in pack_records(split_records(buffer), max_tokens, overlap_tokens):
+            yield buffer_page, chunk
+
+if __name__ == "__main__":
+    import sys
+    from pdf_to_vectordb import extract_text_from_pdf
+    chunks = split_into_chunks(extract_text_from_pdf(sys.argv[1]))
+    print(f"청크 {len(chunks)}개, 총 {sum(count_tokens(c) for c in chunks)} 토큰")
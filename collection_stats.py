@@ -0,0 +1,317 @@
+import os
+import sqlite3
+import threading
+from dotenv import load_dotenv
+from resources import get_data_file_path
+from tracing import get_logger
+
+# 환경변수 로드
+load_dotenv()
+
+logger = get_logger("collection_stats")
+
+# 관리하는 카운터 (PDF 청크 수, 역할별 대화 메시지 수)
+COUNTER_NAMES = ("pdf_chunks", "conversation_user", "conversation_assistant")
+
+def get_collection_stats_path():
+    return os.getenv("COLLECTION_STATS_PATH") or get_data_file_path("collection_stats.sqlite3")
+
+class CollectionStats:
+    """
+    컬렉션별 문서 수를 저장 시점에 갱신하는 카운터입니다.
+    통계 조회 시 ChromaDB 전체를 훑지 않고 카운터 값만 읽습니다.
+    최근 저장 항목 조회용으로 문서 ID별 저장 시각(timestamp)도 함께 기록합니다.
+    (ChromaDB는 메타데이터 기준 정렬을 지원하지 않음)
+    카운터가 어긋났다고 의심되면 recount_from_chroma()로 다시 셉니다.
+    컬렉션 색인/답변 캐시의 버전도 여기에 두어, 다른 프로세스(CLI 적재, 대화 정리 등)의 저장/삭제를
+    앱 프로세스의 캐시가 알 수 있게 합니다.
+    주기 작업(유사 대화 통합)이 다음 실행 때 처리할 ID도 pending_items에 모아 둡니다.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_collection_stats_path()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS counters ("
+            " name TEXT PRIMARY KEY,"
+            " value INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS recent_items ("
+            " scope TEXT NOT NULL,"
+            " id TEXT NOT NULL,"
+            " timestamp INTEGER NOT NULL,"
+            " position INTEGER NOT NULL,"
+            " PRIMARY KEY (scope, id))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_recent_items_order ON recent_items(scope, timestamp DESC, position DESC)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pending_items ("
+            " scope TEXT NOT NULL,"
+            " id TEXT NOT NULL,"
+            " PRIMARY KEY (scope, id))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS versions ("
+            " name TEXT PRIMARY KEY,"
+            " value INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+
+    def adjust(self, deltas):
+        """
+        여러 카운터를 한 트랜잭션으로 증감합니다. 예: adjust({'conversation_user': 1, 'conversation_assistant': 1})
+        아직 집계 전이면 아무것도 하지 않습니다. (첫 조회 때 재집계하면서 반영됨)
+        """
+        deltas = {name: delta for name, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "UPDATE counters SET value = MAX(0, value + ?) WHERE name = ?",
+                    [(delta, name) for name, delta in deltas.items()]
+                )
+
+    def add_items(self, scope, ids, timestamps, positions):
+        """
+        저장한 문서의 ID와 저장 시각을 기록합니다. (같은 시각이면 position이 큰 항목이 더 최근)
+        """
+        if not ids:
+            return
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO recent_items (scope, id, timestamp, position) VALUES (?, ?, ?, ?)",
+                    [(scope, id_, int(ts), int(pos)) for id_, ts, pos in zip(ids, timestamps, positions)]
+                )
+
+    def delete_items(self, scope, ids):
+        if not ids:
+            return
+        with self._lock:
+            with self._conn:
+                for i in range(0, len(ids), 500):
+                    part = list(ids[i:i + 500])
+                    placeholders = ",".join("?" * len(part))
+                    self._conn.execute(
+                        f"DELETE FROM recent_items WHERE scope = ? AND id IN ({placeholders})", [scope] + part
+                    )
+
+    def recent_items(self, scope, limit=5, offset=0):
+        """
+        저장 시각 최신순으로 [(id, timestamp), ...]를 반환합니다.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, timestamp FROM recent_items WHERE scope = ?"
+                " ORDER BY timestamp DESC, position DESC LIMIT ? OFFSET ?",
+                (scope, limit, offset)
+            ).fetchall()
+
+    def items_before(self, scope, timestamp, limit=1000):
+        """
+        저장 시각이 timestamp보다 이른 항목을 오래된 순으로 [(id, timestamp), ...] 반환합니다.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, timestamp FROM recent_items WHERE scope = ? AND timestamp < ?"
+                " ORDER BY timestamp, position LIMIT ?",
+                (scope, int(timestamp), limit)
+            ).fetchall()
+
+    def add_pending(self, scope, ids):
+        """
+        다음 주기 작업에서 처리할 ID를 기록합니다. (이미 있으면 그대로)
+        """
+        if not ids:
+            return
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO pending_items (scope, id) VALUES (?, ?)", [(scope, id_) for id_ in ids]
+                )
+
+    def pending_items(self, scope, limit=1000):
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT id FROM pending_items WHERE scope = ? ORDER BY id LIMIT ?", (scope, limit)
+            ).fetchall()]
+
+    def remove_pending(self, scope, ids):
+        if not ids:
+            return
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "DELETE FROM pending_items WHERE scope = ? AND id = ?", [(scope, id_) for id_ in ids]
+                )
+
+    def delete_scope(self, scope):
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM recent_items WHERE scope = ?", (scope,))
+
+    def set_all(self, counts):
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM counters")
+                self._conn.executemany(
+                    "INSERT INTO counters (name, value) VALUES (?, ?)",
+                    [(name, int(counts.get(name, 0))) for name in COUNTER_NAMES]
+                )
+
+    def set(self, counts):
+        """
+        주어진 카운터만 값을 바꿉니다. (나머지 카운터는 그대로)
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)",
+                    [(name, int(value)) for name, value in counts.items()]
+                )
+
+    def bump_version(self, name):
+        """
+        버전을 1 올리고 새 버전을 반환합니다.
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT INTO versions (name, value) VALUES (?, 1)"
+                    " ON CONFLICT(name) DO UPDATE SET value = value + 1",
+                    (name,)
+                )
+                return self._conn.execute("SELECT value FROM versions WHERE name = ?", (name,)).fetchone()[0]
+
+    def get_version(self, name):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM versions WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def is_initialized(self):
+        # 한 번도 집계하지 않은 상태(카운터 도입 전 데이터)인지 확인
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM counters").fetchone()[0] > 0
+
+    def get(self):
+        with self._lock:
+            rows = dict(self._conn.execute("SELECT name, value FROM counters").fetchall())
+        return {name: rows.get(name, 0) for name in COUNTER_NAMES}
+
+_stats = None
+_stats_lock = threading.Lock()
+
+def get_collection_stats():
+    """
+    프로세스 전체에서 공유하는 컬렉션 카운터를 반환합니다.
+    """
+    global _stats
+    with _stats_lock:
+        if _stats is None:
+            _stats = CollectionStats()
+        return _stats
+
+def _count_ids(collection, where, page_size=5000):
+    # 조건에 맞는 문서 수를 ID만 페이지 단위로 조회하여 셈 (문서/메타데이터/임베딩은 가져오지 않음)
+    count = 0
+    offset = 0
+    while True:
+        ids = collection.get(where=where, include=[], limit=page_size, offset=offset)["ids"]
+        count += len(ids)
+        if len(ids) < page_size:
+            return count
+        offset += page_size
+
+def _rebuild_recent_items(stats, scope, collection, page_size=5000):
+    # 컬렉션의 timestamp 메타데이터로 최근 항목 색인을 다시 만듦 (메타데이터만 조회)
+    stats.delete_scope(scope)
+    offset = 0
+    while True:
+        data = collection.get(include=["metadatas"], limit=page_size, offset=offset)
+        metadatas = [metadata or {} for metadata in data["metadatas"]]
+        stats.add_items(
+            scope,
+            data["ids"],
+            [metadata.get("timestamp", 0) for metadata in metadatas],
+            [metadata.get("chunk_index", 1 if metadata.get("role") == "assistant" else 0) for metadata in metadatas]
+        )
+        if len(data["ids"]) < page_size:
+            return
+        offset += page_size
+
+def recount_from_chroma():
+    """
+    ChromaDB를 직접 세어 카운터와 최근 항목 색인을 처음부터 다시 만듭니다. (복구용)
+    """
+    from resources import get_collection, PDF_COLLECTION, CONVERSATION_COLLECTION
+    pdf_collection = get_collection(PDF_COLLECTION)
+    conversation_collection = get_collection(CONVERSATION_COLLECTION)
+    stats = get_collection_stats()
+    counts = {
+        # 마이그레이션 전 PDF 컬렉션에 남아 있는 대화 기록은 PDF 청크에서 제외
+        "pdf_chunks": pdf_collection.count() - _count_ids(pdf_collection, {"type": "conversation"}),
+        "conversation_user": _count_ids(conversation_collection, {"role": "user"}),
+        "conversation_assistant": _count_ids(conversation_collection, {"role": "assistant"})
+    }
+    _rebuild_recent_items(stats, "pdf", pdf_collection)
+    _rebuild_recent_items(stats, "conversation", conversation_collection)
+    stats.set_all(counts)
+    logger.info(
+        f"컬렉션 통계 재집계 완료: PDF 청크 {counts['pdf_chunks']}개, "
+        f"대화 사용자 {counts['conversation_user']}개, AI {counts['conversation_assistant']}개"
+    )
+    return counts
+
+def reconcile_conversation_counts():
+    """
+    대화 카운터 합계가 대화 컬렉션의 실제 문서 수와 다르면 역할별로 다시 셉니다.
+    (저장 전 기존 ID 확인과 upsert가 원자적이지 않아 동시 저장 시 카운터가 어긋날 수 있음)
+    다시 셌으면 새 카운터를, 맞으면 None을 반환합니다.
+    """
+    from resources import get_collection, CONVERSATION_COLLECTION
+    stats = get_collection_stats()
+    if not stats.is_initialized():
+        return None
+    collection = get_collection(CONVERSATION_COLLECTION)
+    current = stats.get()
+    total = collection.count()
+    if current["conversation_user"] + current["conversation_assistant"] == total:
+        return None
+    counts = {
+        "conversation_user": _count_ids(collection, {"role": "user"}),
+        "conversation_assistant": _count_ids(collection, {"role": "assistant"})
+    }
+    stats.set(counts)
+    logger.warning(
+        f"대화 카운터 보정: 사용자 {current['conversation_user']}→{counts['conversation_user']}개, "
+        f"AI {current['conversation_assistant']}→{counts['conversation_assistant']}개 (컬렉션 {total}개)"
+    )
+    return counts
+
+def read_collection_stats():
+    """
+    카운터 값을 반환합니다. 카운터가 아직 없으면 한 번 재집계합니다.
+    """
+    stats = get_collection_stats()
+    if not stats.is_initialized():
+        return recount_from_chroma()
+    return stats.get()
+
+def get_recent_item_ids(scope, limit=5, offset=0):
+    """
+    저장 시각 최신순으로 [(id, timestamp), ...]를 반환합니다. 색인이 아직 없으면 한 번 재집계합니다.
+    """
+    stats = get_collection_stats()
+    if not stats.is_initialized():
+        recount_from_chroma()
+    return stats.recent_items(scope, limit=limit, offset=offset)
+
+if __name__ == "__main__":
+    recount_from_chroma()
@@ -0,0 +1,109 @@
+import os
+import math
+from dotenv import load_dotenv
+from chunker import count_tokens
+
+# 환경변수 로드
+load_dotenv()
+
+# 컨텍스트 구성 설정
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))  # 검색 결과에 쓸 최대 토큰 수
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))  # 1에 가까울수록 관련도, 0에 가까울수록 다양성 우선
+CONTEXT_DUPLICATE_SIMILARITY = float(os.getenv("CONTEXT_DUPLICATE_SIMILARITY", "0.95"))  # 이 이상 비슷하면 중복으로 제거
+
+def _unit_vector(embedding):
+    if embedding is None:
+        return None
+    embedding = [float(x) for x in embedding]
+    norm = math.sqrt(sum(x * x for x in embedding))
+    if not norm:
+        return None
+    return [x / norm for x in embedding]
+
+def _cosine(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+def _normalize_text(text):
+    return " ".join(text.split())
+
+def pack_context(candidates, query_embedding=None, max_tokens=None, mmr_lambda=None, duplicate_similarity=None):
+    """
+    검색 결과를 토큰 예산 안에서 중복 없이, 관련도와 다양성을 함께 고려해(MMR) 고릅니다.
+
+    candidates: [{'source': 'pdf' | 'conversation', 'document': str, 'embedding': list | None}, ...]
+                (검색 순위대로 정렬되어 있어야 함)
+    query_embedding이 없으면(SRM 번호 질의 등) 검색 순위를 관련도로 사용합니다.
+
+    반환값: {
+        'selected': 고른 후보 목록 (선택 순서),
+        'tokens_before': 모든 후보를 넣었을 때의 토큰 수,
+        'tokens_used': 고른 후보의 토큰 수,
+        'tokens_saved': 줄인 토큰 수,
+        'duplicates': 중복으로 뺀 개수,
+        'over_budget': 예산 초과로 뺀 개수
+    }
+    """
+    max_tokens = max_tokens or CONTEXT_MAX_TOKENS
+    mmr_lambda = mmr_lambda if mmr_lambda is not None else CONTEXT_MMR_LAMBDA
+    if duplicate_similarity is None:
+        duplicate_similarity = CONTEXT_DUPLICATE_SIMILARITY
+    query_vector = _unit_vector(query_embedding)
+
+    items = []
+    for rank, candidate in enumerate(candidates):
+        text = (candidate.get("document") or "").strip()
+        if not text:
+            continue
+        vector = _unit_vector(candidate.get("embedding"))
+        if query_vector is not None and vector is not None:
+            relevance = _cosine(query_vector, vector)
+        else:
+            relevance = 1.0 / (1 + rank)
+        items.append({
+            "candidate": candidate,
+            "text": text,
+            "key": _normalize_text(text),
+            "vector": vector,
+            "tokens": count_tokens(text),
+            "relevance": relevance
+        })
+    tokens_before = sum(item["tokens"] for item in items)
+
+    selected, duplicates, over_budget = [], 0, 0
+    seen_keys = set()
+    tokens_used = 0
+    remaining = items
+    while remaining:
+        # MMR: 관련도 - 이미 고른 결과와의 최대 유사도
+        best, best_score = None, None
+        for item in remaining:
+            similarities = [
+                _cosine(item["vector"], chosen["vector"]) for chosen in selected
+                if item["vector"] is not None and chosen["vector"] is not None
+            ]
+            # 비교할 결과가 없으면 중복이 아님 (duplicate_similarity=0이어도 첫 결과는 남김)
+            item["redundancy"] = max(similarities) if similarities else None
+            redundancy = max(item["redundancy"] or 0.0, 0.0)
+            score = mmr_lambda * item["relevance"] - (1 - mmr_lambda) * redundancy
+            if best_score is None or score > best_score:
+                best, best_score = item, score
+        remaining = [item for item in remaining if item is not best]
+
+        if best["key"] in seen_keys or (best["redundancy"] is not None and best["redundancy"] >= duplicate_similarity):
+            duplicates += 1
+            continue
+        if tokens_used + best["tokens"] > max_tokens:
+            over_budget += 1
+            continue
+        seen_keys.add(best["key"])
+        selected.append(best)
+        tokens_used += best["tokens"]
+
+    return {
+        "selected": [dict(item["candidate"], document=item["text"]) for item in selected],
+        "tokens_before": tokens_before,
+        "tokens_used": tokens_used,
+        "tokens_saved": tokens_before - tokens_used,
+        "duplicates": duplicates,
+        "over_budget": over_budget
+    }
@@ -1,269 +1,294 @@
 import os
 import time
 from dotenv import load_dotenv
-from openai import AzureOpenAI
-from chromadb import PersistentClient
+from resources import get_chroma_db_path, get_collection, get_embedding_client, PDF_COLLECTION, CONVERSATION_COLLECTION
+from embedding_cache import get_cached_embeddings
+from lexical_index import get_lexical_index, extract_identifiers
+from pdf_to_vectordb import get_stored_embeddings, find_existing_ids
+from collection_stats import get_collection_stats, read_collection_stats
+from conversation_retention import merge_duplicate_turns, queue_for_consolidation
+from query_cache import cached_query, bump_index_version
+from tracing import get_logger, span
+from quota_scheduler import get_quota_scheduler, EMBEDDING_QUOTA
+from chunker import count_tokens
 
 # 환경변수 로드
 load_dotenv()
 
+logger = get_logger("conversation_embedder")
+
 # Azure OpenAI 임베딩 환경변수
 AZURE_EMBEDDING_API_KEY = os.getenv("TEXT_EMBEDDING_AZURE_OPENAI_API_KEY")
 AZURE_EMBEDDING_ENDPOINT = os.getenv("TEXT_EMBEDDING_AZURE_OPENAI_ENDPOINT")
 AZURE_EMBEDDING_API_VERSION = os.getenv("TEXT_EMBEDDING_AZURE_OPENAI_API_VERSION")
 EMBEDDING_DEPLOYMENT_NAME = os.getenv("TEXT_EMBEDDING_DEPLOYMENT_NAME")
 
-# ChromaDB 저장 경로 (Azure Web App 호환)
-def get_chroma_db_path():
-    """
-    Azure Web App 환경에 맞는 ChromaDB 경로를 반환합니다.
-    Azure에서는 /home/site/wwwroot가 영구 저장소입니다.
-    """
-    # Azure Web App 환경 감지
-    if os.getenv("WEBSITE_SITE_NAME"):  
-        base_path = "/home/site/wwwroot/chroma_db"
-        print(f"Azure Web App 환경 감지: {base_path}")
-        return base_path
-    else:
-        # 로컬 개발 환경
-        base_path = os.path.join(os.getcwd(), "chroma_db")
-        print(f"로컬 개발 환경: {base_path}")
-        return base_path
-
 PERSIST_DIR = get_chroma_db_path()
 
-# 대화 임베딩 생성 함수
-def get_conversation_embedding(text):
-    client = AzureOpenAI(
-        api_key=AZURE_EMBEDDING_API_KEY,
-        azure_endpoint=AZURE_EMBEDDING_ENDPOINT,
-        api_version=AZURE_EMBEDDING_API_VERSION
-    )
-    
-    response = client.embeddings.create(
-        input=text,
-        model=EMBEDDING_DEPLOYMENT_NAME
+# 대화 임베딩 요청 (여러 텍스트를 한 번의 요청으로 임베딩)
+def _request_conversation_embeddings(texts):
+    response = get_quota_scheduler(EMBEDDING_QUOTA).call(
+        lambda: get_embedding_client().embeddings.create(
+            input=texts,
+            model=EMBEDDING_DEPLOYMENT_NAME
+        ),
+        tokens=sum(count_tokens(text) for text in texts)
     )
-    return response.data[0].embedding
+    return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+# 대화 임베딩 생성 함수 (이미 임베딩한 질문/답변은 임베딩 캐시에서 바로 반환)
+def get_conversation_embedding(text):
+    return get_cached_embeddings(EMBEDDING_DEPLOYMENT_NAME, [text], _request_conversation_embeddings)[0]
+
+def get_conversation_embeddings(texts):
+    """
+    여러 대화 텍스트를 캐시에 없는 것만 모아 한 번의 요청으로 임베딩합니다.
+    """
+    return get_cached_embeddings(EMBEDDING_DEPLOYMENT_NAME, texts, _request_conversation_embeddings)
 
 # 대화 내용을 ChromaDB에 저장하는 함수
 def save_conversation_to_chroma(user_message, assistant_message):
     """
     사용자 메시지와 AI 답변을 ChromaDB에 저장합니다.
-    PDF와 같은 컬렉션(pdf_collection)에 저장됩니다.
+    PDF와 분리된 대화 전용 컬렉션(conversation_collection)에 저장됩니다.
     Azure Web App 환경에서도 안정적으로 작동합니다.
     """
-    persist_dir = get_chroma_db_path()  # 동적 경로 사용
-    
-    # 디렉토리가 없으면 생성
-    try:
-        os.makedirs(persist_dir, exist_ok=True)
-        print(f"ChromaDB 저장 경로 확인/생성: {persist_dir}")
-    except Exception as e:
-        print(f"ChromaDB 디렉토리 생성 실패: {e}")
-        # 실패해도 계속 진행 (이미 존재할 수 있음)
-    
+    save_conversations_to_chroma([{"user": user_message, "assistant": assistant_message}])
+
+def save_conversations_to_chroma(turns):
+    """
+    여러 대화 턴을 한 번에 저장합니다. 모든 질문/답변을 한 번의 임베딩 요청과 한 번의 upsert로 처리합니다.
+    turns: [{'user': str, 'assistant': str, 'timestamp': int(선택), 'turn_id': str(선택)}, ...]
+    turn_id를 주면 ID가 고정되어 같은 턴을 다시 저장해도 중복되지 않습니다.
+    이미 저장된 턴과 질문/답변이 거의 같으면 새로 추가하지 않고 기존 턴을 덮어씁니다. (conversation_retention.py)
+    """
+    if not turns:
+        return
     try:
-        client = PersistentClient(path=persist_dir)
-        
-        # PDF와 같은 컬렉션 사용
-        collection = client.get_or_create_collection("pdf_collection")
+        # 대화 전용 컬렉션 사용 (공유 클라이언트/컬렉션)
+        collection = get_collection(CONVERSATION_COLLECTION)
         
-        # 타임스탬프 생성
-        ts = int(time.time())
-        
-        # 사용자 메시지 저장
-        user_embedding = get_conversation_embedding(user_message)
-        user_id = f"conversation_user_{ts}_{hash(user_message) % 10000}"
+        ids, documents, metadatas = [], [], []
+        for turn in turns:
+            # 타임스탬프 생성
+            ts = int(turn.get("timestamp") or time.time())
+            user_message, assistant_message = turn["user"], turn["assistant"]
+            turn_id = turn.get("turn_id")
+            user_id = f"conversation_user_{ts}_{turn_id or hash(user_message) % 10000}"
+            assistant_id = f"conversation_assistant_{ts}_{turn_id or hash(assistant_message) % 10000}"
+            if user_id in ids:
+                continue  # 같은 턴이 한 번에 두 번 들어온 경우 한 번만 저장
+            
+            ids.extend([user_id, assistant_id])
+            documents.extend([user_message, assistant_message])
+            metadatas.extend([
+                {
+                    "type": "conversation",
+                    "role": "user",
+                    "timestamp": ts,
+                    "source": "chat_history"
+                },
+                {
+                    "type": "conversation",
+                    "role": "assistant",
+                    "timestamp": ts,
+                    "source": "chat_history",
+                    "related_user_id": user_id
+                }
+            ])
         
-        collection.add(
-            documents=[user_message],
-            embeddings=[user_embedding],
-            ids=[user_id],
-            metadatas=[{
-                "type": "conversation",
-                "role": "user",
-                "timestamp": ts,
-                "source": "chat_history"
-            }]
+        embeddings = get_conversation_embeddings(documents)
+        # 거의 같은 질문/답변 쌍은 기존 턴의 ID로 저장 (반복 질문/인사말이 계속 쌓이지 않도록)
+        ids, documents, embeddings, metadatas, merged = merge_duplicate_turns(
+            collection, ids, documents, embeddings, metadatas
         )
+        # 통계 카운터에는 새로 생긴 메시지만 더함 (같은 턴을 다시 저장하면 덮어쓰기)
+        existing_ids = find_existing_ids(collection, ids)
+        with span("chroma.write", collection=CONVERSATION_COLLECTION, rows=len(ids)):
+            collection.upsert(
+                documents=documents,
+                embeddings=embeddings,
+                ids=ids,
+                metadatas=metadatas
+            )
+        bump_index_version(CONVERSATION_COLLECTION)
         
-        # AI 답변 저장
-        assistant_embedding = get_conversation_embedding(assistant_message)
-        assistant_id = f"conversation_assistant_{ts}_{hash(assistant_message) % 10000}"
-        
-        collection.add(
-            documents=[assistant_message],
-            embeddings=[assistant_embedding],
-            ids=[assistant_id],
-            metadatas=[{
-                "type": "conversation",
-                "role": "assistant",
-                "timestamp": ts,
-                "source": "chat_history",
-                "related_user_id": user_id
-            }]
+        # 키워드 색인에도 추가 (SRM 번호 질의를 임베딩 없이 찾기 위함)
+        get_lexical_index().add("conversation", ids, documents)
+        new_roles = [metadata["role"] for id_, metadata in zip(ids, metadatas) if id_ not in existing_ids]
+        get_collection_stats().adjust({
+            "conversation_user": new_roles.count("user"),
+            "conversation_assistant": new_roles.count("assistant")
+        })
+        get_collection_stats().add_items(
+            "conversation", ids,
+            [metadata["timestamp"] for metadata in metadatas],
+            [1 if metadata["role"] == "assistant" else 0 for metadata in metadatas]
         )
+        # 다음 유사 대화 통합은 새로 저장된 턴만 확인
+        queue_for_consolidation(ids, metadatas)
         
-        print(f"대화 내용 저장 완료! (사용자: {user_id}, AI: {assistant_id})")
+        logger.info(f"대화 내용 저장 완료! ({len(turns)}턴, {len(ids)}개 메시지, 기존 턴과 병합 {merged}턴)")
         
     except Exception as e:
-        print(f"대화 내용 저장 중 오류: {e}")
+        logger.warning(f"대화 내용 저장 중 오류: {e}")
         raise
 
 # 대화 내용에서 유사한 내용 검색하는 함수
-def search_conversation_history(query, top_k=3):
+def search_conversation_history(query, top_k=3, query_embedding=None):
     """
-    PDF와 같은 컬렉션에서 대화 기록만 검색합니다.
+    대화 전용 컬렉션에서 대화 기록을 검색합니다.
     Azure Web App 환경에서도 안정적으로 작동합니다.
+    query_embedding을 넘기면 쿼리 임베딩을 다시 계산하지 않습니다.
+    질문에 SRM 번호가 있으면 임베딩 없이 키워드 색인에서 해당 번호가 나온 대화만 찾습니다.
+    (그 번호를 다룬 대화가 없으면 의미가 비슷한 다른 대화는 참고가 되지 않으므로 빈 목록)
     """
-    persist_dir = get_chroma_db_path()  # 동적 경로 사용
-    
-    # 디렉토리가 없으면 생성
-    try:
-        os.makedirs(persist_dir, exist_ok=True)
-    except Exception as e:
-        print(f"ChromaDB 디렉토리 생성 실패: {e}")
-    
+    return [hit["document"] for hit in search_conversation_hits(query, top_k=top_k, query_embedding=query_embedding)]
+
+def search_conversation_hits(query, top_k=3, query_embedding=None):
+    """
+    search_conversation_history와 같은 방식으로 검색하되 [{'id', 'document', 'embedding'}, ...]를 반환합니다.
+    """
+    if extract_identifiers(query):
+        try:
+            with span("lexical.search", scope="conversation", exact_only=True):
+                exact_hits = get_lexical_index().search("conversation", query, top_k=top_k, exact_only=True)
+            if not exact_hits:
+                return []
+            # 컨텍스트 중복 제거에 쓸 임베딩은 컬렉션에 저장된 값을 사용
+            stored = {}
+            try:
+                stored = get_stored_embeddings(get_collection(CONVERSATION_COLLECTION), [hit["id"] for hit in exact_hits])
+            except Exception as e:
+                logger.warning(f"대화 기록 임베딩 조회 중 오류: {e}")
+            return [
+                {"id": hit["id"], "document": hit["document"], "embedding": stored.get(hit["id"])}
+                for hit in exact_hits
+            ]
+        except Exception as e:
+            logger.warning(f"대화 기록 식별자 검색 중 오류: {e}")
+
     try:
-        client = PersistentClient(path=persist_dir)
-        
-        collection = client.get_or_create_collection("pdf_collection")
+        collection = get_collection(CONVERSATION_COLLECTION)  # 공유 클라이언트/컬렉션
 
         # 컬렉션이 비어있는지 확인
         if collection.count() == 0:
             return []
         
-        query_embedding = get_conversation_embedding(query)
+        if query_embedding is None:
+            query_embedding = get_conversation_embedding(query)
         
-        try:
-            # 메타데이터 필터링으로 대화 기록만 검색 - 검색 범위 확대
-            results = collection.query(
-                query_embeddings=[query_embedding],
-                n_results=top_k * 6,  # 더 많이 가져와서 필터링 (3배 -> 6배)
-                include=["documents", "metadatas"],
-                where={"type": "conversation"}  # 대화 기록만 검색
-            )
-        except Exception as filter_error:
-            print(f"메타데이터 필터링 실패, 전체 검색으로 fallback: {filter_error}")
-            # 메타데이터 필터링이 실패하면 전체 검색 후 필터링
-            results = collection.query(
-                query_embeddings=[query_embedding],
-                n_results=min(top_k * 10, 150),  # 더 많이 가져와서 수동 필터링 (6배 -> 10배)
-                include=["documents", "metadatas"]
-            )
+        # 대화 전용 컬렉션이므로 메타데이터 필터나 과다 검색 없이 top_k개만 조회 (저장이 없는 동안은 캐시된 결과 사용)
+        results = cached_query(
+            CONVERSATION_COLLECTION, collection, query_embedding, top_k, include=["documents", "embeddings"]
+        )
         
         if results["documents"] and results["documents"][0]:
-            # 대화 기록만 수동으로 필터링하여 반환
-            conversation_docs = []
-            docs = results["documents"][0]
-            metas = results["metadatas"][0] if results["metadatas"] and results["metadatas"][0] else [{}] * len(docs)
-            
-            for doc, meta in zip(docs, metas):
-                # 메타데이터가 None이거나 빈 딕셔너리일 경우 처리
-                if meta and isinstance(meta, dict) and meta.get("type") == "conversation":
-                    conversation_docs.append(doc)
-                elif not meta or not isinstance(meta, dict):
-                    # 메타데이터가 없는 경우, ID로 대화 기록인지 판단
-                    continue  # 대화 기록이 아니라고 가정
-                
-                if len(conversation_docs) >= top_k:
-                    break
-            
-            return conversation_docs
+            return [
+                {"id": id_, "document": doc, "embedding": list(emb)}
+                for id_, doc, emb in zip(results["ids"][0], results["documents"][0], results["embeddings"][0])
+            ]
         else:
             return []
             
     except Exception as e:
-        print(f"대화 기록 검색 중 오류: {e}")
+        logger.warning(f"대화 기록 검색 중 오류: {e}")
         return []
 
 # 대화 기록 통계 조회 함수
 def get_conversation_stats():
     """
-    PDF와 같은 컬렉션에서 대화 기록 통계를 조회합니다.
+    PDF 청크 수와 역할별 대화 메시지 수를 저장 시점에 갱신되는 카운터에서 읽어 반환합니다.
+    컬렉션을 조회하지 않으므로 데이터가 많아져도 바로 반환됩니다.
+    (카운터가 어긋나면 `python collection_stats.py`로 다시 집계)
     Azure Web App 환경에서도 안정적으로 작동합니다.
     """
-    persist_dir = get_chroma_db_path()  # 동적 경로 사용
-    
-    # 디렉토리가 없으면 생성
-    try:
-        os.makedirs(persist_dir, exist_ok=True)
-    except Exception as e:
-        print(f"ChromaDB 디렉토리 생성 실패: {e}")
-    
     try:
-        client = PersistentClient(path=persist_dir)
+        counts = read_collection_stats()
+        pdf_chunks = counts["pdf_chunks"]
+        user_messages = counts["conversation_user"]
+        assistant_messages = counts["conversation_assistant"]
+        conversation_total = user_messages + assistant_messages
+        total_count = pdf_chunks + conversation_total
         
-        collection = client.get_or_create_collection("pdf_collection")
-        total_count = collection.count()
+        logger.info(f"전체 컬렉션 통계:")
+        logger.info(f"- 총 문서: {total_count}개")
+        logger.info(f"- PDF 청크: {pdf_chunks}개")
+        logger.info(f"- 대화 기록: {conversation_total}개 (사용자: {user_messages}, AI: {assistant_messages})")
         
-        if total_count > 0:
-            # 전체 데이터 조회 (오류 처리 강화)
-            try:
-                all_data = collection.get(include=["metadatas"])
-            except Exception as get_error:
-                print(f"데이터 조회 중 오류: {get_error}")
-                # 메타데이터 없이 기본 정보만 반환
-                return {
-                    "total": total_count,
-                    "pdf_chunks": total_count,  # 정확하지 않지만 대략적인 값
-                    "conversation_total": 0,
-                    "user_messages": 0,
-                    "assistant_messages": 0
-                }
-            
-            # 메타데이터 안전하게 처리
-            metadatas = all_data.get("metadatas", [])
-            if not metadatas:
-                print("메타데이터가 없습니다.")
-                return {
-                    "total": total_count,
-                    "pdf_chunks": total_count,
-                    "conversation_total": 0,
-                    "user_messages": 0,
-                    "assistant_messages": 0
-                }
-            
-            # 대화 기록만 필터링 (안전하게)
-            conversation_data = []
-            pdf_data = []
-            
-            for meta in metadatas:
-                if meta and isinstance(meta, dict):
-                    if meta.get("type") == "conversation":
-                        conversation_data.append(meta)
-                    else:
-                        pdf_data.append(meta)
-                else:
-                    # 메타데이터가 None이거나 dict가 아닌 경우
-                    pdf_data.append({})  # PDF 데이터로 가정
-            
-            user_messages = sum(1 for meta in conversation_data if meta.get("role") == "user")
-            assistant_messages = sum(1 for meta in conversation_data if meta.get("role") == "assistant")
-            pdf_chunks = len(pdf_data)
-            
-            print(f"전체 컬렉션 통계:")
-            print(f"- 총 문서: {total_count}개")
-            print(f"- PDF 청크: {pdf_chunks}개")
-            print(f"- 대화 기록: {len(conversation_data)}개 (사용자: {user_messages}, AI: {assistant_messages})")
-            
-            return {
-                "total": total_count,
-                "pdf_chunks": pdf_chunks,
-                "conversation_total": len(conversation_data),
-                "user_messages": user_messages,
-                "assistant_messages": assistant_messages
-            }
-        else:
-            print("저장된 데이터가 없습니다.")
-            return {"total": 0, "pdf_chunks": 0, "conversation_total": 0, "user_messages": 0, "assistant_messages": 0}
+        return {
+            "total": total_count,
+            "pdf_chunks": pdf_chunks,
+            "conversation_total": conversation_total,
+            "user_messages": user_messages,
+            "assistant_messages": assistant_messages
+        }
             
     except Exception as e:
-        print(f"통계 조회 중 오류: {e}")
+        logger.warning(f"통계 조회 중 오류: {e}")
         return {"total": 0, "pdf_chunks": 0, "conversation_total": 0, "user_messages": 0, "assistant_messages": 0}
 
+# 기존 데이터 마이그레이션 함수
+def migrate_conversations_to_own_collection(batch_size=500):
+    """
+    예전 방식으로 pdf_collection에 함께 저장된 대화 기록(type=conversation)을
+    conversation_collection으로 옮깁니다. 임베딩을 그대로 복사하므로 Azure 호출은 없습니다.
+    여러 번 실행해도 안전하며(옮길 데이터가 없으면 바로 종료), 옮긴 개수를 반환합니다.
+    """
+    source = get_collection(PDF_COLLECTION)
+    target = get_collection(CONVERSATION_COLLECTION)
+    moved = 0
+    while True:
+        data = source.get(
+            where={"type": "conversation"},
+            include=["documents", "embeddings", "metadatas"],
+            limit=batch_size
+        )
+        if not data["ids"]:
+            break
+        # 대상에 먼저 쓰고 원본에서 삭제 (중간에 실패해도 데이터가 사라지지 않음)
+        existing_ids = find_existing_ids(target, data["ids"])
+        target.upsert(
+            ids=data["ids"],
+            documents=data["documents"],
+            embeddings=data["embeddings"],
+            metadatas=data["metadatas"]
+        )
+        source.delete(ids=data["ids"])
+        bump_index_version(CONVERSATION_COLLECTION)
+        bump_index_version(PDF_COLLECTION)
+        # 키워드 색인도 옮김 (SRM 번호 질의는 키워드 색인에서만 대화를 찾으므로 빠지면 검색되지 않음)
+        get_lexical_index().delete("pdf", data["ids"])
+        get_lexical_index().add("conversation", data["ids"], [document or "" for document in data["documents"]])
+        # PDF 청크 카운터에는 원래 대화 기록이 포함되지 않으므로 대화 카운터만 갱신
+        new_roles = [
+            (metadata or {}).get("role") for id_, metadata in zip(data["ids"], data["metadatas"])
+            if id_ not in existing_ids
+        ]
+        get_collection_stats().adjust({
+            "conversation_user": new_roles.count("user"),
+            "conversation_assistant": new_roles.count("assistant")
+        })
+        metadatas = [metadata or {} for metadata in data["metadatas"]]
+        get_collection_stats().delete_items("pdf", data["ids"])
+        get_collection_stats().add_items(
+            "conversation", data["ids"],
+            [metadata.get("timestamp", 0) for metadata in metadatas],
+            [1 if metadata.get("role") == "assistant" else 0 for metadata in metadatas]
+        )
+        queue_for_consolidation(data["ids"], metadatas)
+        moved += len(data["ids"])
+    if moved:
+        logger.info(f"대화 기록 {moved}개를 {PDF_COLLECTION}에서 {CONVERSATION_COLLECTION}로 옮겼습니다.")
+    return moved
+
 if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        migrate_conversations_to_own_collection()
+        get_conversation_stats()
+        sys.exit(0)
+
     test_user_msg = "주문 취소는 어떻게 하나요?"
     test_assistant_msg = "주문 취소는 주문 상세 페이지에서 '주문 취소' 버튼을 클릭하시면 됩니다."
     
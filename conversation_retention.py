@@ -0,0 +1,369 @@
+import os
+import time
+import numpy as np
+from dotenv import load_dotenv
+from resources import get_collection, CONVERSATION_COLLECTION
+from lexical_index import get_lexical_index, extract_identifiers
+from collection_stats import get_collection_stats, get_recent_item_ids, reconcile_conversation_counts
+from pdf_to_vectordb import find_existing_ids, get_max_batch_size
+from query_cache import bump_index_version
+from tracing import get_logger, span, increment
+
+# 환경변수 로드
+load_dotenv()
+
+logger = get_logger("conversation_retention")
+
+# 대화 턴마다 질문/답변 벡터 2개가 대화 컬렉션에 쌓이므로 저장 시 병합, 보존 정책, 유사 대화 통합으로 크기를 제한
+# 보존 정책 (0이면 해당 제한 없음)
+CONVERSATION_RETENTION_DAYS = float(os.getenv("CONVERSATION_RETENTION_DAYS", "180"))  # 마지막으로 나온 뒤 보존 기간(일)
+CONVERSATION_MAX_TURNS = int(os.getenv("CONVERSATION_MAX_TURNS", "20000"))  # 최근 순으로 남길 최대 턴 수
+# 저장 시 병합: 질문과 답변의 코사인 유사도가 모두 이 값 이상이면 같은 턴으로 봄 (0이면 병합 안 함)
+CONVERSATION_DEDUP_SIMILARITY = float(os.getenv("CONVERSATION_DEDUP_SIMILARITY", "0.97"))
+# 주기 통합: 질문의 코사인 유사도가 이 값 이상인 턴을 하나로 합침 (0이면 통합 안 함)
+CONVERSATION_CONSOLIDATE_SIMILARITY = float(os.getenv("CONVERSATION_CONSOLIDATE_SIMILARITY", "0.93"))
+CONVERSATION_CONSOLIDATE_NEIGHBORS = int(os.getenv("CONVERSATION_CONSOLIDATE_NEIGHBORS", "10"))  # 턴마다 비교할 이웃 수
+# 보존 정책/통합 실행 간격(초, 0이면 백그라운드 실행 안 함)
+CONVERSATION_MAINTENANCE_INTERVAL = float(os.getenv("CONVERSATION_MAINTENANCE_INTERVAL", "3600"))
+
+# 유사 대화 통합 대기 목록/실행 횟수를 컬렉션 통계 DB에 기록할 때 쓰는 이름
+CONSOLIDATE_SCOPE = "conversation_consolidate"
+
+def _unit(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def _identifiers(text):
+    # SRM 번호가 다른 질문은 임베딩이 거의 같아도 다른 대화로 취급하기 위한 비교 키
+    return tuple(sorted(extract_identifiers(text or "")))
+
+def _similarity_from_distance(collection, distance):
+    # 컬렉션 거리 → 코사인 유사도 (l2는 제곱 거리이며 Azure 임베딩은 단위 벡터이므로 1 - d/2)
+    space = ((getattr(collection, "configuration", None) or {}).get("hnsw") or {}).get("space", "l2")
+    if space in ("cosine", "ip"):
+        return 1.0 - distance
+    return 1.0 - distance / 2.0
+
+def _assistant_rows(collection, user_ids, include):
+    # 질문 ID별 답변 행 {user_id: (assistant_id, embedding, metadata)}
+    rows = {}
+    for i in range(0, len(user_ids), 500):
+        data = collection.get(where={"related_user_id": {"$in": list(user_ids[i:i + 500])}}, include=include)
+        embeddings = data.get("embeddings")
+        for j, (id_, metadata) in enumerate(zip(data["ids"], data["metadatas"])):
+            embedding = embeddings[j] if embeddings is not None and "embeddings" in include else None
+            rows[metadata["related_user_id"]] = (id_, embedding, metadata)
+    return rows
+
+def _merged_metadata(metadata, previous):
+    # 병합된 턴의 반복 횟수와 처음 나온 시각을 이어받음
+    merged = dict(metadata)
+    merged["repeat_count"] = previous.get("repeat_count", 1) + metadata.get("repeat_count", 1)
+    merged["first_timestamp"] = min(
+        previous.get("first_timestamp", previous.get("timestamp", metadata["timestamp"])),
+        metadata.get("first_timestamp", metadata["timestamp"])
+    )
+    return merged
+
+def merge_duplicate_turns(collection, ids, documents, embeddings, metadatas, similarity=None):
+    """
+    저장할 턴(질문, 답변 순서로 번갈아 있는 목록) 중 이미 저장된 턴이나 같은 배치의 앞선 턴과
+    질문/답변이 모두 거의 같은 턴을 기존 턴의 ID로 바꿔 덮어쓰게 합니다.
+    병합한 턴은 repeat_count가 늘고 timestamp가 최근 시각으로 바뀌어 보존 기간이 다시 시작됩니다.
+    (ids, documents, embeddings, metadatas, 병합한 턴 수)를 반환합니다.
+    """
+    similarity = CONVERSATION_DEDUP_SIMILARITY if similarity is None else similarity
+    if similarity <= 0 or not ids:
+        return ids, documents, embeddings, metadatas, 0
+    turns = [
+        {
+            "ids": [ids[i], ids[i + 1]],
+            "documents": [documents[i], documents[i + 1]],
+            "embeddings": [embeddings[i], embeddings[i + 1]],
+            "metadatas": [dict(metadatas[i]), dict(metadatas[i + 1])],
+            "identifiers": _identifiers(documents[i]),
+            "key": ids[i],  # 최종 저장할 질문 ID (저장된 턴과 병합하면 그 턴의 ID)
+            "stored": None  # 병합할 저장된 턴 ([질문 ID, 답변 ID], [질문 메타데이터, 답변 메타데이터])
+        }
+        for i in range(0, len(ids), 2)
+    ]
+    user_vectors = _unit([turn["embeddings"][0] for turn in turns])
+    assistant_vectors = _unit([turn["embeddings"][1] for turn in turns])
+
+    def similar(a, b):
+        return (turns[a]["identifiers"] == turns[b]["identifiers"]
+                and float(user_vectors[a] @ user_vectors[b]) >= similarity
+                and float(assistant_vectors[a] @ assistant_vectors[b]) >= similarity)
+
+    # 1. 저장된 턴 중 질문이 가장 비슷한 후보를 한 번의 검색으로 찾고, 후보의 답변도 비교
+    stored_count = collection.count()
+    if stored_count:
+        results = collection.query(
+            query_embeddings=[turn["embeddings"][0] for turn in turns],
+            n_results=min(3, stored_count),
+            where={"role": "user"},
+            include=["embeddings", "metadatas", "documents"]
+        )
+        candidate_ids = sorted({id_ for row in results["ids"] for id_ in row})
+        answers = _assistant_rows(collection, candidate_ids, ["embeddings", "metadatas"])
+        for t, turn in enumerate(turns):
+            for id_, embedding, metadata, document in zip(
+                results["ids"][t], results["embeddings"][t], results["metadatas"][t], results["documents"][t]
+            ):
+                if id_ == turn["ids"][0]:
+                    break  # 같은 턴을 다시 저장하는 경우 (재시도)
+                answer = answers.get(id_)
+                if answer is None or _identifiers(document) != turn["identifiers"]:
+                    continue
+                if (float(_unit(embedding) @ user_vectors[t]) >= similarity
+                        and float(_unit(answer[1]) @ assistant_vectors[t]) >= similarity):
+                    turn["key"] = id_
+                    turn["stored"] = ([id_, answer[0]], [metadata, answer[2]])
+                    break
+
+    # 2. 같은 저장된 턴을 고른 턴끼리, 또는 배치 안에서 서로 비슷한 턴끼리 한 묶음으로 모음
+    #    (서로는 덜 비슷해도 같은 저장된 턴과 병합되는 턴은 반드시 같은 묶음이어야 ID가 겹치지 않음)
+    groups = []
+    for t, turn in enumerate(turns):
+        group = next((group for group in groups if group["key"] == turn["key"]), None)
+        if group is None:
+            group = next(
+                (group for group in groups
+                 if (group["stored"] is None or turn["stored"] is None) and similar(group["members"][-1], t)),
+                None
+            )
+            if group is not None and turn["stored"] is not None:
+                group["key"], group["stored"] = turn["key"], turn["stored"]
+        if group is None:
+            groups.append({"key": turn["key"], "stored": turn["stored"], "members": [t]})
+        else:
+            group["members"].append(t)
+
+    # 3. 묶음마다 가장 뒤쪽(최근) 턴의 내용으로 한 번만 저장하고 반복 횟수/처음 시각을 합산
+    merged = 0
+    rows = {}
+    for group in groups:
+        members = [turns[t] for t in group["members"]]
+        latest = members[-1]
+        turn_metadatas = latest["metadatas"]
+        for member in members[:-1]:
+            turn_metadatas = [_merged_metadata(m, p) for m, p in zip(turn_metadatas, member["metadatas"])]
+        turn_ids = members[0]["ids"]
+        if group["stored"] is not None:
+            turn_ids = group["stored"][0]
+            turn_metadatas = [_merged_metadata(m, p) for m, p in zip(turn_metadatas, group["stored"][1])]
+            merged += len(members)
+        else:
+            merged += len(members) - 1
+        turn_metadatas[1]["related_user_id"] = turn_ids[0]
+        for i in range(2):
+            rows.pop(turn_ids[i], None)  # 같은 ID가 두 번 upsert되지 않도록 (뒤쪽 내용 사용)
+            rows[turn_ids[i]] = (latest["documents"][i], latest["embeddings"][i], turn_metadatas[i])
+
+    return (
+        list(rows),
+        [row[0] for row in rows.values()],
+        [row[1] for row in rows.values()],
+        [row[2] for row in rows.values()],
+        merged
+    )
+
+def delete_conversation_turns(collection, ids):
+    """
+    대화 메시지 ID(질문 또는 답변)가 속한 턴 전체를 삭제하고 키워드 색인/통계 카운터/최근 항목 색인에서도 뺍니다.
+    삭제한 턴 수를 반환합니다.
+    """
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return 0
+    user_ids, assistant_ids = set(), set()
+    batch_size = get_max_batch_size()
+    for i in range(0, len(ids), batch_size):
+        data = collection.get(ids=ids[i:i + batch_size], include=["metadatas"])
+        for id_, metadata in zip(data["ids"], data["metadatas"]):
+            metadata = metadata or {}
+            if metadata.get("role") == "assistant":
+                assistant_ids.add(id_)
+                if metadata.get("related_user_id"):
+                    user_ids.add(metadata["related_user_id"])
+            else:
+                user_ids.add(id_)
+    user_ids = sorted(find_existing_ids(collection, sorted(user_ids)))
+    assistant_ids.update(assistant_id for assistant_id, _, _ in _assistant_rows(collection, user_ids, ["metadatas"]).values())
+    delete_ids = user_ids + sorted(assistant_ids)
+    with span("chroma.delete", collection=CONVERSATION_COLLECTION, rows=len(delete_ids)):
+        for i in range(0, len(delete_ids), batch_size):
+            collection.delete(ids=delete_ids[i:i + batch_size])
+    bump_index_version(CONVERSATION_COLLECTION)
+    get_lexical_index().delete("conversation", delete_ids)
+    get_collection_stats().adjust({
+        "conversation_user": -len(user_ids),
+        "conversation_assistant": -len(assistant_ids)
+    })
+    # 컬렉션에 없던 ID도 최근 항목 색인에서는 지움 (색인만 남은 항목 정리)
+    get_collection_stats().delete_items("conversation", sorted(set(ids) | set(delete_ids)))
+    return len(user_ids)
+
+def enforce_retention(retention_days=None, max_turns=None, now=None):
+    """
+    보존 기간(CONVERSATION_RETENTION_DAYS)이 지난 턴과 최근 CONVERSATION_MAX_TURNS턴을 넘는 오래된 턴을 삭제합니다.
+    반환값: {'expired': 기간 초과로 삭제한 턴 수, 'overflow': 개수 초과로 삭제한 턴 수}
+    """
+    retention_days = CONVERSATION_RETENTION_DAYS if retention_days is None else retention_days
+    max_turns = CONVERSATION_MAX_TURNS if max_turns is None else max_turns
+    collection = get_collection(CONVERSATION_COLLECTION)
+    stats = get_collection_stats()
+    get_recent_item_ids("conversation", limit=1)  # 최근 항목 색인이 없으면 먼저 집계
+    result = {"expired": 0, "overflow": 0}
+    if retention_days > 0:
+        cutoff = (now or time.time()) - retention_days * 86400
+        while True:
+            page = stats.items_before("conversation", cutoff)
+            if not page:
+                break
+            result["expired"] += delete_conversation_turns(collection, [id_ for id_, _ in page])
+    if max_turns > 0:
+        # 질문/답변 2개가 한 턴 (최근 항목 색인은 시각 최신순)
+        while True:
+            page = stats.recent_items("conversation", limit=1000, offset=max_turns * 2)
+            if not page:
+                break
+            result["overflow"] += delete_conversation_turns(collection, [id_ for id_, _ in page])
+    return result
+
+def queue_for_consolidation(ids, metadatas):
+    """
+    새로 저장된(또는 병합으로 바뀐) 턴의 질문 ID를 다음 유사 대화 통합 대상으로 기록합니다.
+    """
+    user_ids = [id_ for id_, metadata in zip(ids, metadatas) if (metadata or {}).get("role") == "user"]
+    get_collection_stats().add_pending(CONSOLIDATE_SCOPE, user_ids)
+
+def _queue_all_user_turns(collection, page_size=5000):
+    # 통합 대기 목록 도입 전 데이터는 첫 실행 때 한 번 전체를 대상으로 넣음
+    offset = 0
+    while True:
+        ids = collection.get(where={"role": "user"}, include=[], limit=page_size, offset=offset)["ids"]
+        get_collection_stats().add_pending(CONSOLIDATE_SCOPE, ids)
+        if len(ids) < page_size:
+            return
+        offset += page_size
+
+def consolidate_conversations(similarity=None, neighbors=None, page_size=500):
+    """
+    지난 실행 이후 저장된 턴마다 질문이 비슷한 기존 턴을 찾아, 그 묶음을 가장 최근 턴 하나로 합칩니다.
+    나머지 턴은 삭제하고 반복 횟수(repeat_count)와 처음 나온 시각을 대표 턴에 합산합니다.
+    최근 턴부터 차례로 묶고, 이미 묶인 턴은 다시 묶지 않으며 이웃의 이웃까지 넓히지 않으므로
+    묶음이 점점 다른 주제로 번지지 않습니다.
+    반환값: {'clusters': 합친 묶음 수, 'removed': 삭제한 턴 수}
+    """
+    similarity = CONVERSATION_CONSOLIDATE_SIMILARITY if similarity is None else similarity
+    neighbors = neighbors or CONVERSATION_CONSOLIDATE_NEIGHBORS
+    collection = get_collection(CONVERSATION_COLLECTION)
+    stats = get_collection_stats()
+    result = {"clusters": 0, "removed": 0}
+    if similarity <= 0:
+        return result
+    if stats.get_version(CONSOLIDATE_SCOPE) == 0:
+        _queue_all_user_turns(collection)
+    stats.bump_version(CONSOLIDATE_SCOPE)
+
+    while True:
+        pending = stats.pending_items(CONSOLIDATE_SCOPE, limit=page_size)
+        if not pending:
+            return result
+        # 1. 새 질문마다 비슷한 이웃 질문 찾기 (이웃은 이전에 저장된 턴 포함)
+        data = collection.get(ids=pending, include=["embeddings", "metadatas", "documents"])
+        turns, edges = {}, {}
+        for id_, metadata, document in zip(data["ids"], data["metadatas"], data["documents"]):
+            turns[id_] = (metadata or {}, _identifiers(document))
+        if data["ids"]:
+            results = collection.query(
+                query_embeddings=[list(embedding) for embedding in data["embeddings"]],
+                n_results=neighbors + 1,
+                where={"role": "user"},
+                include=["distances", "documents", "metadatas"]
+            )
+            for id_, found_ids, distances, found_documents, found_metadatas in zip(
+                data["ids"], results["ids"], results["distances"], results["documents"], results["metadatas"]
+            ):
+                edges[id_] = []
+                for found_id, distance, found_document, found_metadata in zip(
+                    found_ids, distances, found_documents, found_metadatas
+                ):
+                    if (found_id != id_
+                            and _similarity_from_distance(collection, distance) >= similarity
+                            and _identifiers(found_document) == turns[id_][1]):
+                        edges[id_].append(found_id)
+                        turns.setdefault(found_id, (found_metadata or {}, _identifiers(found_document)))
+
+        # 2. 최근 턴부터 묶음 구성 (묶음에서 가장 최근 턴이 대표)
+        def timestamp(id_):
+            return turns[id_][0].get("timestamp", 0)
+
+        assigned = set()
+        clusters = []
+        for id_ in sorted(edges, key=timestamp, reverse=True):
+            if id_ in assigned:
+                continue
+            members = [id_] + [other for other in edges[id_] if other not in assigned]
+            assigned.update(members)
+            if len(members) > 1:
+                representative = max(members, key=timestamp)
+                clusters.append((representative, [member for member in members if member != representative]))
+
+        # 3. 대표 턴의 반복 횟수/처음 시각을 갱신하고 나머지 삭제
+        for representative, members in clusters:
+            rows = collection.get(
+                ids=[representative] + [assistant_id for assistant_id, _, _ in
+                                        _assistant_rows(collection, [representative], ["metadatas"]).values()],
+                include=["embeddings", "metadatas", "documents"]
+            )
+            metadatas = [dict(metadata or {}) for metadata in rows["metadatas"]]
+            for member in members:
+                previous = turns[member][0]
+                metadatas = [_merged_metadata(metadata, previous) for metadata in metadatas]
+            collection.upsert(
+                ids=rows["ids"],
+                embeddings=[list(embedding) for embedding in rows["embeddings"]],
+                documents=rows["documents"],
+                metadatas=metadatas
+            )
+            # 최근 항목 색인도 대표 턴의 저장 시각과 맞춤
+            stats.add_items(
+                "conversation", rows["ids"],
+                [metadata.get("timestamp", 0) for metadata in metadatas],
+                [1 if metadata.get("role") == "assistant" else 0 for metadata in metadatas]
+            )
+            result["removed"] += delete_conversation_turns(collection, members)
+            result["clusters"] += 1
+        # 이미 삭제된 턴의 ID도 함께 정리
+        stats.remove_pending(CONSOLIDATE_SCOPE, pending)
+
+def run_conversation_maintenance():
+    """
+    보존 정책과 유사 대화 통합을 차례로 실행하고, 대화 카운터가 컬렉션 문서 수와 어긋났으면 다시 센 뒤 결과를 반환합니다.
+    대화 백그라운드 저장기가 CONVERSATION_MAINTENANCE_INTERVAL마다 실행하며, 직접 실행할 수도 있습니다.
+    (python conversation_retention.py)
+    """
+    started = time.perf_counter()
+    with span("conversation.retention"):
+        retention = enforce_retention()
+    with span("conversation.consolidate"):
+        consolidation = consolidate_conversations()
+    with span("conversation.reconcile_counts"):
+        recounted = reconcile_conversation_counts() is not None
+    result = {
+        **retention, **consolidation, "recounted": recounted,
+        "elapsed": time.perf_counter() - started, "finished_at": time.time()
+    }
+    increment("conversation.evicted", retention["expired"] + retention["overflow"])
+    increment("conversation.consolidated", consolidation["removed"])
+    logger.info(
+        f"대화 기록 정리 완료: 기간 초과 {result['expired']}턴, 개수 초과 {result['overflow']}턴 삭제, "
+        f"유사 대화 {result['clusters']}묶음 통합({result['removed']}턴 삭제), {result['elapsed']:.2f}초"
+    )
+    return result
+
+if __name__ == "__main__":
+    run_conversation_maintenance()
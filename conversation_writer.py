@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import threading
+from dotenv import load_dotenv
+from resources import get_data_file_path
+from conversation_embedder import save_conversations_to_chroma
+from conversation_retention import run_conversation_maintenance, CONVERSATION_MAINTENANCE_INTERVAL
+from tracing import get_logger, span
+from quota_scheduler import use_lane, LANE_BULK, RETRYABLE_ERRORS
+
+# 환경변수 로드
+load_dotenv()
+
+logger = get_logger("conversation_writer")
+
+# 백그라운드 저장 설정
+CONVERSATION_WRITER_BATCH_SIZE = int(os.getenv("CONVERSATION_WRITER_BATCH_SIZE", "32"))  # 1회 저장 최대 턴 수
+CONVERSATION_WRITER_FLUSH_INTERVAL = float(os.getenv("CONVERSATION_WRITER_FLUSH_INTERVAL", "1.0"))  # 턴을 모으는 최대 대기(초)
+CONVERSATION_WRITER_RETRY_DELAY = float(os.getenv("CONVERSATION_WRITER_RETRY_DELAY", "5.0"))  # 저장 실패 시 재시도 간격(초)
+
+def get_spill_file_path():
+    return os.getenv("CONVERSATION_SPILL_PATH") or get_data_file_path("conversation_spill.jsonl")
+
+def get_dead_letter_file_path():
+    # 다시 시도해도 저장할 수 없는 턴을 옮겨 두는 파일 (원인 확인 후 수동 처리)
+    return os.getenv("CONVERSATION_DEAD_LETTER_PATH") or get_data_file_path("conversation_dead_letter.jsonl")
+
+class ConversationWriter:
+    """
+    대화 저장을 채팅 화면과 분리하여 백그라운드에서 처리하는 write-behind 큐입니다.
+    - enqueue한 턴은 먼저 로컬 spill 파일(JSONL)에 기록되어 프로세스가 재시작되어도 유실되지 않습니다.
+    - 백그라운드 스레드가 대기 중인 턴을 모아 한 번의 임베딩 요청과 한 번의 upsert로 저장합니다.
+    - 저장이 끝난 턴은 spill 파일에서 제거되고, 429/타임아웃/5xx 같은 일시적 오류로 실패하면 파일에 남겨 두었다가 다시 시도합니다.
+    - 그 밖의 오류(잘못된 요청 등)는 다시 시도해도 실패하므로 턴을 하나씩 저장해 보고,
+      그래도 실패하는 턴만 dead-letter 파일로 옮겨 뒤의 턴 저장을 막지 않습니다.
+    - CONVERSATION_MAINTENANCE_INTERVAL마다 저장을 마친 뒤 같은 스레드에서 보존 정책/유사 대화 통합을 실행합니다.
+      (저장과 삭제가 한 스레드에서만 일어나므로 서로 겹치지 않음)
+    """
+
+    def __init__(self, spill_path=None, batch_size=None, flush_interval=None):
+        self.spill_path = spill_path or get_spill_file_path()
+        self.batch_size = batch_size or CONVERSATION_WRITER_BATCH_SIZE
+        self.flush_interval = flush_interval or CONVERSATION_WRITER_FLUSH_INTERVAL
+        self.written_turns = 0
+        self.failed_batches = 0
+        self.dead_lettered = 0
+        self.dead_letter_path = get_dead_letter_file_path()
+        self.last_maintenance = None  # 마지막 보존 정책/통합 결과
+        self._maintenance_due = None  # 다음 정리 시각 (None이면 첫 저장 후 바로 실행)
+        self._pending = []  # 아직 저장되지 않은 턴 (spill 파일 내용과 동일)
+        self._in_flight = 0  # 현재 저장 중인 턴 수 (_pending 앞쪽)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._stopped = False
+        os.makedirs(os.path.dirname(os.path.abspath(self.spill_path)), exist_ok=True)
+        self._load_spill_file()
+        self._thread = threading.Thread(target=self._run, name="conversation-writer", daemon=True)
+        self._thread.start()
+
+    def _load_spill_file(self):
+        # 이전 프로세스가 저장하지 못하고 남긴 턴을 복구
+        if not os.path.exists(self.spill_path):
+            return
+        with open(self.spill_path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    self._pending.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f"손상된 대화 spill 항목을 건너뜁니다: {line[:80]}")
+        if self._pending:
+            logger.info(f"저장 대기 중이던 대화 {len(self._pending)}턴을 복구했습니다.")
+
+    def enqueue(self, user_message, assistant_message):
+        """
+        대화 턴을 저장 대기열에 넣고 바로 반환합니다.
+        """
+        turn = {
+            "turn_id": uuid.uuid4().hex[:12],
+            "user": user_message,
+            "assistant": assistant_message,
+            "timestamp": int(time.time())
+        }
+        with self._lock:
+            # 먼저 디스크에 기록 (재시작 대비)
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(turn, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._pending.append(turn)
+            self._wakeup.notify()
+        return turn["turn_id"]
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._pending and not self._stopped:
+                    self._wakeup.wait()
+                if self._stopped and not self._pending:
+                    return
+                # 짧게 기다리며 턴을 더 모음 (배치가 차면 바로 저장)
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._pending) < self.batch_size and not self._stopped:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._wakeup.wait(remaining)
+                batch = self._pending[:self.batch_size]
+                self._in_flight = len(batch)
+
+            try:
+                # 백그라운드 저장의 임베딩 요청은 대량 작업 우선순위로 보냄
+                with span("conversation.save", turns=len(batch)), use_lane(LANE_BULK):
+                    save_conversations_to_chroma(batch)
+                saved, dead = batch, []
+            except RETRYABLE_ERRORS as e:
+                logger.warning(f"대화 백그라운드 저장 실패, {CONVERSATION_WRITER_RETRY_DELAY:.0f}초 후 재시도: {e}")
+                saved, dead = [], []
+            except Exception as e:
+                logger.warning(f"대화 백그라운드 저장 실패, 턴을 하나씩 다시 저장합니다: {e}")
+                saved, dead = self._save_one_by_one(batch)
+
+            with self._lock:
+                self._in_flight = 0
+                finished = {turn["turn_id"] for turn in saved + dead}
+                if finished:
+                    self._pending = [turn for turn in self._pending if turn["turn_id"] not in finished]
+                    self.written_turns += len(saved)
+                    if dead:
+                        self._write_dead_letters(dead)
+                    self._rewrite_spill_file()
+                else:
+                    self.failed_batches += 1
+                self._idle.notify_all()
+                if not finished:
+                    if self._stopped:
+                        return
+                    self._wakeup.wait(CONVERSATION_WRITER_RETRY_DELAY)
+            if saved:
+                self._maybe_run_maintenance()
+
+    def _save_one_by_one(self, batch):
+        """
+        배치를 턴 하나씩 저장합니다. (저장한 턴, dead-letter로 보낼 턴)을 반환합니다.
+        일시적 오류로 실패한 턴은 어느 쪽에도 넣지 않아 대기열에 남습니다.
+        """
+        saved, dead = [], []
+        for turn in batch:
+            try:
+                with span("conversation.save", turns=1), use_lane(LANE_BULK):
+                    save_conversations_to_chroma([turn])
+                saved.append(turn)
+            except RETRYABLE_ERRORS as e:
+                logger.warning(f"대화 턴 {turn['turn_id']} 저장 실패, 나중에 다시 시도: {e}")
+            except Exception as e:
+                logger.error(f"대화 턴 {turn['turn_id']}을 저장할 수 없어 {self.dead_letter_path}로 옮깁니다: {e}")
+                dead.append(dict(turn, error=str(e), failed_at=int(time.time())))
+        return saved, dead
+
+    def _write_dead_letters(self, turns):
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            for turn in turns:
+                f.write(json.dumps(turn, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.dead_lettered += len(turns)
+
+    def _maybe_run_maintenance(self):
+        # 정리 간격이 지났으면 보존 정책/통합 실행 (실패해도 저장은 계속)
+        if CONVERSATION_MAINTENANCE_INTERVAL <= 0:
+            return
+        now = time.monotonic()
+        if self._maintenance_due is not None and now < self._maintenance_due:
+            return
+        self._maintenance_due = now + CONVERSATION_MAINTENANCE_INTERVAL
+        try:
+            with use_lane(LANE_BULK):
+                self.last_maintenance = run_conversation_maintenance()
+        except Exception as e:
+            logger.warning(f"대화 기록 정리 중 오류: {e}")
+
+    def _rewrite_spill_file(self):
+        # 남은 턴만 다시 기록 (임시 파일에 쓴 뒤 교체하여 중간에 끊겨도 파일이 깨지지 않음)
+        tmp_path = self.spill_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for turn in self._pending:
+                f.write(json.dumps(turn, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.spill_path)
+
+    def flush(self, timeout=30.0):
+        """
+        대기 중인 턴이 모두 저장될 때까지 기다립니다. 모두 저장되면 True를 반환합니다.
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            self._wakeup.notify()
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+            return True
+
+    def stop(self, timeout=10.0):
+        self.flush(timeout)
+        with self._lock:
+            self._stopped = True
+            self._wakeup.notify_all()
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "in_flight": self._in_flight,
+                "written_turns": self.written_turns,
+                "failed_batches": self.failed_batches,
+                "dead_lettered": self.dead_lettered,
+                "last_maintenance": self.last_maintenance
+            }
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_conversation_writer():
+    """
+    프로세스 전체에서 공유하는 대화 백그라운드 저장기를 반환합니다. (최초 호출 시 스레드 시작)
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ConversationWriter()
+            # 정상 종료 시 남은 턴을 최대한 저장 (못 한 턴은 spill 파일에 남아 다음 실행 때 저장)
+            atexit.register(_writer.stop)
+        return _writer
+
+def save_conversation_async(user_message, assistant_message):
+    """
+    대화 턴을 백그라운드 저장 대기열에 넣습니다. 화면은 저장을 기다리지 않습니다.
+    """
+    return get_conversation_writer().enqueue(user_message, assistant_message)
@@ -0,0 +1,172 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from dotenv import load_dotenv
+from resources import get_data_file_path
+from tracing import span
+
+# 환경변수 로드
+load_dotenv()
+
+# 임베딩 캐시 설정 (최대 보관 개수, 초과 시 오래 사용되지 않은 항목부터 제거)
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+EMBEDDING_CACHE_EVICT_RATIO = 0.9  # 초과 시 최대치의 90%까지 줄임
+
+def get_embedding_cache_path():
+    """
+    임베딩 캐시(SQLite) 파일 경로를 반환합니다.
+    Azure Web App에서는 ChromaDB와 같은 영구 저장소(/home/site/wwwroot)를 사용합니다.
+    """
+    return os.getenv("EMBEDDING_CACHE_PATH") or get_data_file_path("embedding_cache.sqlite3")
+
+def make_cache_key(model, text):
+    # 모델(배포명) + 텍스트 해시로 키 생성 - 모델이 바뀌면 다른 벡터로 취급
+    return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """
+    모델 배포명 + 텍스트 해시를 키로 하는 디스크 기반 임베딩 캐시입니다.
+    PDF 청크, 사용자 질문, 대화 내용 임베딩이 모두 같은 캐시를 공유합니다.
+    """
+
+    def __init__(self, path=None, max_entries=None):
+        self.path = path or get_embedding_cache_path()
+        self.max_entries = max_entries or EMBEDDING_CACHE_MAX_ENTRIES
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " embedding BLOB NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+        self._conn.commit()
+
+    def get_many(self, model, texts):
+        """
+        텍스트 목록의 캐시된 임베딩을 반환합니다. 없는 항목은 None입니다.
+        """
+        keys = [make_cache_key(model, text) for text in texts]
+        found = {}
+        with self._lock:
+            # SQLite 변수 개수 제한을 피하기 위해 나눠서 조회
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, embedding FROM embeddings WHERE key IN ({placeholders})", part
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+            results = [found.get(key) for key in keys]
+            hit_count = sum(1 for r in results if r is not None)
+            self.hits += hit_count
+            self.misses += len(results) - hit_count
+        return results
+
+    def put_many(self, model, texts, embeddings):
+        """
+        임베딩을 캐시에 저장하고, 최대 개수를 넘으면 오래 사용되지 않은 항목을 제거합니다.
+        """
+        if not texts:
+            return
+        now = time.time()
+        rows = [
+            (make_cache_key(model, text), model, array("f", embedding).tobytes(), now, now)
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, embedding, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+            self._evict_if_needed()
+
+    def _evict_if_needed(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        remove = count - int(self.max_entries * EMBEDDING_CACHE_EVICT_RATIO)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            " SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+            (remove,)
+        )
+        self._conn.commit()
+        self.evictions += remove
+
+    def stats(self):
+        """
+        캐시 적중/미스 통계를 반환합니다.
+        """
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits / total) if total else 0.0
+            }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_embedding_cache():
+    """
+    프로세스 전체에서 공유하는 임베딩 캐시를 반환합니다.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+        return _cache
+
+def get_cached_embeddings(model, texts, embed_fn):
+    """
+    캐시에 있는 임베딩은 그대로 사용하고, 없는 텍스트만 embed_fn으로 임베딩하여 저장합니다.
+    embed_fn은 텍스트 목록을 받아 같은 순서의 임베딩 목록을 반환해야 합니다.
+    반환되는 임베딩의 순서는 texts의 순서와 동일합니다.
+    """
+    with span("embedding", inputs=len(texts)) as s:
+        cache = get_embedding_cache()
+        embeddings = cache.get_many(model, texts)
+        # 같은 텍스트가 여러 번 나와도 한 번만 요청
+        missing = list(dict.fromkeys(text for text, emb in zip(texts, embeddings) if emb is None))
+        s.set(cache_hits=len(texts) - len(missing), requested=len(missing))
+        if missing:
+            new_embeddings = embed_fn(missing)
+            cache.put_many(model, missing, new_embeddings)
+            by_text = dict(zip(missing, new_embeddings))
+            embeddings = [emb if emb is not None else by_text[text] for text, emb in zip(texts, embeddings)]
+        return embeddings
+
+if __name__ == "__main__":
+    print(get_embedding_cache().stats())
@@ -0,0 +1,156 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+from resources import get_chat_client
+from chunker import count_tokens
+from tracing import get_logger, span, bind_context
+from quota_scheduler import get_quota_scheduler, estimate_chat_tokens, CHAT_QUOTA
+
+# 환경변수 로드
+load_dotenv()
+
+logger = get_logger("history_manager")
+
+DEPLOYMENT_NAME = os.getenv("DEPLOYMENT_NAME")
+
+# 대화 기록 압축 설정
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "6"))  # 원문 그대로 보낼 최근 턴 수 (사용자 질문 기준)
+HISTORY_FOLD_TURNS = int(os.getenv("HISTORY_FOLD_TURNS", "4"))  # 요약에 한 번에 합칠 턴 수 (요약 요청 빈도 조절)
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", "600"))  # 누적 요약 최대 길이
+
+SUMMARY_PROMPT = """당신은 K-ICIS 오더 VOC 상담 기록을 정리하는 도우미입니다.
+기존 요약과 이어지는 대화를 합쳐 하나의 요약으로 다시 작성하세요.
+- 접수번호(SRM), 시스템명, 날짜, 처리 방법/쿼리 등 구체적인 정보는 반드시 유지하세요.
+- 사용자가 확인한 결론과 아직 해결되지 않은 질문을 구분하세요.
+- 인사말 등 상담과 무관한 내용은 생략하고, 한국어 개조식으로 간결하게 작성하세요."""
+
+def new_history_state():
+    """
+    세션별 대화 압축 상태를 만듭니다. (st.session_state에 보관)
+    - summary: 지금까지 접은 대화의 누적 요약
+    - summarized: 요약에 반영된 대화 메시지 수 (system 메시지 제외, 앞에서부터)
+    - folding: 백그라운드 요약이 진행 중인지 여부
+    """
+    return {"summary": "", "summarized": 0, "summary_tokens": 0, "last_prompt_tokens": 0, "folding": False}
+
+def _format_messages(messages):
+    lines = []
+    for message in messages:
+        speaker = "사용자" if message["role"] == "user" else "상담봇"
+        lines.append(f"{speaker}: {message['content'].strip()}")
+    return "\n".join(lines)
+
+def summarize_history(previous_summary, messages):
+    """
+    기존 요약에 새로 접을 대화만 더해 요약을 갱신합니다. (전체 대화를 다시 요약하지 않음)
+    """
+    started = time.perf_counter()
+    content = f"[기존 요약]\n{previous_summary or '(없음)'}\n\n[이어지는 대화]\n{_format_messages(messages)}"
+    request_messages = [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": content}
+    ]
+    with span("history.summarize", messages=len(messages)) as s:
+        response = get_quota_scheduler(CHAT_QUOTA).call(
+            lambda: get_chat_client().chat.completions.create(
+                model=DEPLOYMENT_NAME,
+                messages=request_messages,
+                temperature=0.2,
+                max_tokens=HISTORY_SUMMARY_MAX_TOKENS
+            ),
+            tokens=estimate_chat_tokens(request_messages, max_tokens=HISTORY_SUMMARY_MAX_TOKENS)
+        )
+        summary = (response.choices[0].message.content or "").strip()
+        s.set(summary_tokens=count_tokens(summary))
+    logger.info(f"대화 요약 갱신: 메시지 {len(messages)}개 반영, {count_tokens(summary)}토큰, {time.perf_counter() - started:.2f}초")
+    return summary
+
+def _recent_start(dialog, keep_turns):
+    # 최근 keep_turns번째 사용자 질문이 시작되는 위치
+    user_positions = [i for i, message in enumerate(dialog) if message["role"] == "user"]
+    if len(user_positions) <= keep_turns:
+        return 0
+    return user_positions[-keep_turns]
+
+def _dialog(messages, state):
+    # 검색 컨텍스트(system)는 매 턴 새로 만들어지므로 요약 대상에서 제외
+    dialog = [message for message in messages if message["role"] != "system"]
+    if state["summarized"] > len(dialog):
+        # 대화가 초기화된 경우
+        state.update(new_history_state())
+    return dialog
+
+def fold_history(messages, state, keep_turns=None, fold_turns=None):
+    """
+    접히지 않은 오래된 턴이 fold_turns만큼 쌓였으면 그 부분만 누적 요약에 합칩니다.
+    요약에 성공하면 True를 반환합니다. 실패하면 상태를 그대로 두어 오래된 턴은 다음 요약 때까지 원문으로 보냅니다.
+    """
+    keep_turns = keep_turns or HISTORY_KEEP_TURNS
+    fold_turns = fold_turns or HISTORY_FOLD_TURNS
+    dialog = _dialog(messages, state)
+    start = state["summarized"]
+    cut = _recent_start(dialog, keep_turns)
+    unsummarized_turns = sum(1 for message in dialog[start:cut] if message["role"] == "user")
+    if unsummarized_turns < fold_turns:
+        return False
+    try:
+        summary = summarize_history(state["summary"], dialog[start:cut])
+    except Exception as e:
+        logger.warning(f"대화 요약 중 오류, 이전 대화를 원문으로 유지합니다: {e}")
+        return False
+    if state["summarized"] != start:
+        # 요약하는 동안 대화가 초기화된 경우
+        return False
+    state["summary"] = summary
+    state["summary_tokens"] = count_tokens(summary)
+    state["summarized"] = cut
+    return True
+
+def fold_history_in_background(messages, state, keep_turns=None, fold_turns=None):
+    """
+    답변을 보낸 뒤 다음 턴을 위해 백그라운드 스레드에서 fold_history를 실행합니다.
+    요약 요청이 다음 답변의 첫 토큰을 늦추지 않도록 답변 생성 전에는 요약하지 않습니다.
+    이미 요약 중이면 아무것도 하지 않습니다.
+    """
+    if state.get("folding"):
+        return None
+    state["folding"] = True
+    snapshot = list(messages)
+
+    def run():
+        try:
+            fold_history(snapshot, state, keep_turns=keep_turns, fold_turns=fold_turns)
+        finally:
+            state["folding"] = False
+
+    thread = threading.Thread(target=bind_context(run), name="history-fold", daemon=True)
+    thread.start()
+    return thread
+
+def build_prompt_messages(messages, state):
+    """
+    챗 모델에 보낼 메시지 목록을 만듭니다. (모델 호출 없음)
+    요약에 반영된 대화는 누적 요약 하나의 system 메시지로 대신하고, 그 뒤의 대화는 원문 그대로 보냅니다.
+    답변 뒤 fold_history_in_background로 오래된 턴을 접으므로,
+    세션이 길어져도 프롬프트는 대략 (요약 + keep_turns + fold_turns 턴) 크기를 넘지 않습니다.
+
+    messages: 화면에 표시하는 전체 메시지 (검색 컨텍스트 system 메시지 포함)
+    state: new_history_state()로 만든 세션별 상태 (갱신됨)
+    """
+    _dialog(messages, state)
+    start = state["summarized"]
+
+    prompt = []
+    if state["summary"]:
+        prompt.append({"role": "system", "content": f"이전 상담 내용 요약:\n{state['summary']}"})
+    position = 0
+    for message in messages:
+        if message["role"] == "system":
+            prompt.append(message)
+            continue
+        if position >= start:
+            prompt.append(message)
+        position += 1
+    state["last_prompt_tokens"] = sum(count_tokens(message["content"]) for message in prompt)
+    return prompt
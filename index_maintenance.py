@@ -0,0 +1,267 @@
+import os
+import time
+import shutil
+import random
+import sqlite3
+import argparse
+import numpy as np
+from resources import (
+    get_chroma_client, get_chroma_db_path, get_vector_store_path, get_hnsw_configuration, reset_collections,
+    VECTOR_STORE_BACKEND, PDF_COLLECTION, CONVERSATION_COLLECTION
+)
+from numpy_vector_store import NumpyCollection, copy_collection, lock_collection_directory
+from pdf_to_vectordb import get_max_batch_size
+from query_cache import bump_index_version
+from collection_stats import recount_from_chroma
+from tracing import get_logger
+
+logger = get_logger("index_maintenance")
+
+REBUILD_SUFFIX = "__rebuild"  # 재구성 중인 임시 컬렉션 이름 접미사
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+def get_segment_directory(collection):
+    """
+    컬렉션의 HNSW 색인 파일(header.bin, length.bin, link_lists.bin, data_level0.bin)이 있는 디렉터리를 반환합니다.
+    """
+    db_path = os.path.join(get_chroma_db_path(), "chroma.sqlite3")
+    with sqlite3.connect(f"file:{db_path}?mode=ro", uri=True) as conn:
+        row = conn.execute(
+            "SELECT id FROM segments WHERE collection = ? AND scope = 'VECTOR'", (str(collection.id),)
+        ).fetchone()
+    return os.path.join(get_chroma_db_path(), row[0]) if row else None
+
+def index_size(collection):
+    """
+    색인 파일별 크기(바이트)를 반환합니다. NumPy 저장소는 컬렉션 디렉터리의 파일 크기입니다.
+    """
+    if isinstance(collection, NumpyCollection):
+        directory = collection.directory
+    else:
+        directory = get_segment_directory(collection)
+    sizes = {}
+    if directory and os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                sizes[name] = os.path.getsize(path)
+    sizes["total"] = sum(sizes.values())
+    return sizes
+
+def _distances(vectors, query, space):
+    # ChromaDB와 같은 거리 정의 (l2는 제곱 L2)
+    if space == "cosine":
+        norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+        return 1.0 - vectors @ query / np.maximum(norms, 1e-12)
+    if space == "ip":
+        return 1.0 - vectors @ query
+    return ((vectors - query) ** 2).sum(axis=1)
+
+def make_queries(embeddings, count, seed=0):
+    """
+    저장된 임베딩 두 개를 섞어 검색 질의를 만듭니다. (저장된 벡터를 그대로 쓰면 자기 자신이 항상 1위)
+    """
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(min(count, len(embeddings))):
+        a, b = rng.randrange(len(embeddings)), rng.randrange(len(embeddings))
+        queries.append(0.7 * embeddings[a] + 0.3 * embeddings[b])
+    return queries
+
+def measure_queries(collection, queries, vectors, ids, top_k, space):
+    """
+    질의별 검색 지연 시간 p50/p95/p99(ms)와 전수 검색 대비 recall@k를 측정합니다.
+    """
+    top_k = min(top_k, len(ids))
+    latencies, recalls = [], []
+    for query in queries:
+        started = time.perf_counter()
+        found = collection.query(query_embeddings=[query.tolist()], n_results=top_k, include=["documents"])
+        latencies.append((time.perf_counter() - started) * 1000)
+        expected = {ids[i] for i in np.argsort(_distances(vectors, query, space))[:top_k]}
+        recalls.append(len(expected & set(found["ids"][0])) / top_k)
+    if not latencies:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "recall": None}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "recall": sum(recalls) / len(recalls)}
+
+def _read_embeddings(collection, batch_size):
+    ids, embeddings = [], []
+    offset = 0
+    while True:
+        data = collection.get(include=["embeddings"], limit=batch_size, offset=offset)
+        if not data["ids"]:
+            break
+        ids.extend(data["ids"])
+        embeddings.extend(np.asarray(embedding, dtype=np.float32) for embedding in data["embeddings"])
+        offset += len(data["ids"])
+    return ids, embeddings
+
+def _vacuum_chroma_db():
+    # 삭제된 행이 차지하던 SQLite 페이지 반환 (다른 프로세스가 DB를 열고 있으면 건너뜀)
+    db_path = os.path.join(get_chroma_db_path(), "chroma.sqlite3")
+    try:
+        conn = sqlite3.connect(db_path, timeout=5)
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.warning(f"chroma.sqlite3 VACUUM 생략: {e}")
+
+def _recover_chroma(client, name):
+    # 이전 재구성이 중간에 끊긴 경우 정리 (원본 삭제 전이면 임시 컬렉션 삭제, 삭제 후면 임시 컬렉션을 원래 이름으로)
+    names = {collection.name for collection in client.list_collections()}
+    temp_name = name + REBUILD_SUFFIX
+    if temp_name not in names:
+        return
+    if name in names:
+        client.delete_collection(temp_name)
+        logger.warning(f"끝나지 않은 재구성 임시 컬렉션 삭제: {temp_name}")
+    else:
+        client.get_collection(temp_name).modify(name=name)
+        logger.warning(f"끝나지 않은 재구성 이어서 완료: {temp_name} → {name}")
+
+def _rebuild_chroma(name, batch_size):
+    client = get_chroma_client()
+    source = client.get_collection(name)
+    temp_name = name + REBUILD_SUFFIX
+    # 예전 방식의 hnsw:* 메타데이터는 configuration과 함께 넘길 수 없으므로 제외
+    metadata = {key: value for key, value in (source.metadata or {}).items() if not key.startswith("hnsw:")}
+    target = client.create_collection(temp_name, configuration=get_hnsw_configuration(), metadata=metadata or None)
+    copied = copy_collection(source, target, batch_size=batch_size)
+    if target.count() != source.count():
+        client.delete_collection(temp_name)
+        raise RuntimeError(f"{name} 복사 행 수 불일치: 원본 {source.count()}, 복사 {target.count()}")
+    old_segment = get_segment_directory(source)
+    client.delete_collection(name)
+    target.modify(name=name)
+    # delete_collection은 HNSW 색인 디렉터리를 남겨 두므로 직접 삭제
+    if old_segment:
+        shutil.rmtree(old_segment, ignore_errors=True)
+    return copied
+
+def _rebuild_numpy(name, batch_size):
+    directory = os.path.join(get_vector_store_path(), name)
+    # 복사부터 교체까지 잠가 두어 앱/다른 CLI의 저장이 재구성 도중에 끼어들지 않게 함 (교체 후 앱은 다시 읽음)
+    with lock_collection_directory(directory):
+        temp_directory = directory + REBUILD_SUFFIX
+        if not os.path.isdir(directory) and os.path.isdir(temp_directory):
+            os.replace(temp_directory, directory)  # 이전 재구성이 교체 도중 끊긴 경우
+        shutil.rmtree(temp_directory, ignore_errors=True)
+        source = NumpyCollection(name, directory)
+        target = NumpyCollection(name, temp_directory)
+        copied = copy_collection(source, target, batch_size=batch_size)
+        target.flush()
+        if target.count() != source.count():
+            shutil.rmtree(temp_directory, ignore_errors=True)
+            raise RuntimeError(f"{name} 복사 행 수 불일치: 원본 {source.count()}, 복사 {target.count()}")
+        backup = directory + ".old"
+        os.replace(directory, backup)
+        os.replace(temp_directory, directory)
+        shutil.rmtree(backup, ignore_errors=True)
+        return copied
+
+def _open(name):
+    if VECTOR_STORE_BACKEND == "numpy":
+        return NumpyCollection(name, os.path.join(get_vector_store_path(), name))
+    return get_chroma_client().get_collection(name)
+
+def _snapshot(name, queries, vectors, ids, top_k, space):
+    collection = _open(name)
+    return {
+        "rows": collection.count(),
+        "index_bytes": index_size(collection),
+        "query": measure_queries(collection, queries, vectors, ids, top_k, space)
+    }
+
+def rebuild_collection(name, queries=50, top_k=10, batch_size=None, vacuum=True):
+    """
+    컬렉션 하나의 색인을 현재 설정으로 다시 만들고 전후 측정값을 반환합니다. (Azure 호출 없음)
+    청크 교체나 대화 저장/삭제가 쌓이면 HNSW 색인에 삭제 표시된 노드가 남아 length.bin/link_lists.bin이 커지고
+    검색이 느려지므로, 모든 행을 현재 HNSW 설정(resources.HNSW_*)의 새 컬렉션에 복사한 뒤 원래 이름으로 바꿉니다.
+    앱을 내린 상태에서 실행해야 합니다.
+
+    Returns:
+        dict: {'collection', 'backend', 'rows', 'configuration', 'before', 'after',
+               'store_bytes_before', 'store_bytes_after', 'elapsed'}
+    """
+    batch_size = batch_size or get_max_batch_size()
+    numpy_backend = VECTOR_STORE_BACKEND == "numpy"
+    store_path = get_vector_store_path() if numpy_backend else get_chroma_db_path()
+    space = "l2" if numpy_backend else get_hnsw_configuration()["hnsw"]["space"]
+    if not numpy_backend:
+        _recover_chroma(get_chroma_client(), name)
+
+    ids, embeddings = _read_embeddings(_open(name), batch_size)
+    vectors = np.vstack(embeddings) if embeddings else np.zeros((0, 0), dtype=np.float32)
+    sample = make_queries(embeddings, queries)
+    # 재구성 전에는 기존 거리 함수 기준으로 recall을 계산
+    before_space = "l2" if numpy_backend else ((_open(name).configuration or {}).get("hnsw") or {}).get("space", "l2")
+
+    store_bytes_before = directory_size(store_path)
+    before = _snapshot(name, sample, vectors, ids, top_k, before_space)
+    started = time.perf_counter()
+    rebuild = _rebuild_numpy if numpy_backend else _rebuild_chroma
+    copied = rebuild(name, batch_size)
+    if vacuum and not numpy_backend:
+        _vacuum_chroma_db()
+    elapsed = time.perf_counter() - started
+    reset_collections()
+    # 거리 함수 등이 바뀌면 검색 결과도 달라지므로 캐시된 결과를 무효화
+    bump_index_version(name)
+    # 컬렉션을 통째로 바꿨으므로 카운터와 최근 항목 색인도 새 컬렉션 기준으로 다시 만듦
+    recount_from_chroma()
+    after = _snapshot(name, sample, vectors, ids, top_k, space)
+    logger.info(f"{name} 색인 재구성 완료: {copied}행, {elapsed:.2f}초")
+    return {
+        "collection": name,
+        "backend": VECTOR_STORE_BACKEND,
+        "rows": copied,
+        "configuration": None if numpy_backend else get_hnsw_configuration()["hnsw"],
+        "before": before,
+        "after": after,
+        "store_bytes_before": store_bytes_before,
+        "store_bytes_after": directory_size(store_path),
+        "elapsed": elapsed
+    }
+
+def print_report(report):
+    def mb(value):
+        return f"{value / (1024 * 1024):.2f}MB"
+
+    def recall(value):
+        return "-" if value is None else f"{value:.3f}"
+
+    print(f"\n[{report['collection']}] {report['backend']}, {report['rows']}행, 재구성 {report['elapsed']:.2f}초")
+    if report["configuration"]:
+        print("  설정: " + ", ".join(f"{key}={value}" for key, value in report["configuration"].items()))
+    before, after = report["before"], report["after"]
+    files = [name for name in after["index_bytes"] if name != "total"]
+    for name in files + ["total"]:
+        print(f"  {name:<24}{mb(before['index_bytes'].get(name, 0)):>12} → {mb(after['index_bytes'].get(name, 0))}")
+    print(f"  {'저장소 전체':<19}{mb(report['store_bytes_before']):>12} → {mb(report['store_bytes_after'])}")
+    for key in ("p50", "p95", "p99"):
+        print(f"  {'query ' + key:<24}{before['query'][key]:>10.2f}ms → {after['query'][key]:.2f}ms")
+    print(f"  {'recall@k':<24}{recall(before['query']['recall']):>12} → {recall(after['query']['recall'])}")
+
+def main():
+    # 예: python index_maintenance.py --collections pdf_collection,conversation_collection --queries 100
+    parser = argparse.ArgumentParser(description="벡터 색인 압축/재구성 (앱을 내린 상태에서 실행)")
+    parser.add_argument("--collections", default=f"{PDF_COLLECTION},{CONVERSATION_COLLECTION}", help="쉼표로 구분한 컬렉션 이름")
+    parser.add_argument("--queries", type=int, default=50, help="전후 비교에 쓸 검색 횟수")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--no-vacuum", action="store_true", help="chroma.sqlite3 VACUUM 생략")
+    args = parser.parse_args()
+
+    for name in [name.strip() for name in args.collections.split(",") if name.strip()]:
+        report = rebuild_collection(name, queries=args.queries, top_k=args.top_k, vacuum=not args.no_vacuum)
+        print_report(report)
+
+if __name__ == "__main__":
+    main()
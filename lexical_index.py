@@ -0,0 +1,259 @@
+import os
+import re
+import math
+import sqlite3
+import threading
+from collections import Counter
+from dotenv import load_dotenv
+from resources import get_data_file_path
+from tracing import get_logger
+
+# 환경변수 로드
+load_dotenv()
+
+logger = get_logger("lexical_index")
+
+# BM25 파라미터
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# 벡터/키워드 결과 융합(RRF) 상수
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# 토큰 패턴: SRM 접수번호, 영문/숫자 단어(시스템명 등), 한글 연속 구간
+SRM_PATTERN = re.compile(r"SRM\d{8,}", re.IGNORECASE)
+WORD_PATTERN = re.compile(r"[A-Za-z][A-Za-z0-9_\-]*[A-Za-z0-9]|[A-Za-z]")
+HANGUL_PATTERN = re.compile(r"[가-힣]+")
+
+def get_lexical_index_path():
+    return os.getenv("LEXICAL_INDEX_PATH") or get_data_file_path("lexical_index.sqlite3")
+
+def extract_identifiers(text):
+    """
+    텍스트에 포함된 정확한 식별자(SRM 접수번호)를 대문자로 정규화하여 반환합니다.
+    """
+    return list(dict.fromkeys(m.upper() for m in SRM_PATTERN.findall(text)))
+
+def tokenize(text):
+    """
+    색인/검색용 토큰을 만듭니다.
+    - srm:SRM25061233806  (SRM 접수번호, 정확 일치)
+    - w:neoss             (영문/숫자 단어, 시스템명 등, 소문자)
+    - k:처리              (한글 2글자 n-gram, 1글자 단어는 그대로)
+    """
+    tokens = [f"srm:{srm}" for srm in (m.upper() for m in SRM_PATTERN.findall(text))]
+    without_srm = SRM_PATTERN.sub(" ", text)
+    tokens.extend(f"w:{word.lower()}" for word in WORD_PATTERN.findall(without_srm))
+    for run in HANGUL_PATTERN.findall(text):
+        if len(run) == 1:
+            tokens.append(f"k:{run}")
+        else:
+            tokens.extend(f"k:{run[i:i + 2]}" for i in range(len(run) - 1))
+    return tokens
+
+class LexicalIndex:
+    """
+    SRM 번호, 시스템명, 한글 n-gram에 대한 로컬 역색인(BM25)입니다.
+    PDF 청크와 대화 기록을 scope('pdf' / 'conversation')로 나눠 저장합니다.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_lexical_index_path()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " scope TEXT NOT NULL,"
+            " id TEXT NOT NULL,"
+            " document TEXT NOT NULL,"
+            " length INTEGER NOT NULL,"
+            " PRIMARY KEY (scope, id))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            " scope TEXT NOT NULL,"
+            " term TEXT NOT NULL,"
+            " doc_id TEXT NOT NULL,"
+            " tf INTEGER NOT NULL,"
+            " PRIMARY KEY (scope, term, doc_id)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings(scope, doc_id)")
+        self._conn.commit()
+
+    def add(self, scope, ids, documents):
+        """
+        문서를 색인합니다. 같은 ID가 있으면 새 내용으로 교체합니다.
+        """
+        if not ids:
+            return
+        with self._lock:
+            self._delete_locked(scope, ids)
+            doc_rows, posting_rows = [], []
+            for id_, document in zip(ids, documents):
+                terms = Counter(tokenize(document))
+                doc_rows.append((scope, id_, document, sum(terms.values())))
+                posting_rows.extend((scope, term, id_, tf) for term, tf in terms.items())
+            self._conn.executemany("INSERT INTO docs (scope, id, document, length) VALUES (?, ?, ?, ?)", doc_rows)
+            self._conn.executemany("INSERT INTO postings (scope, term, doc_id, tf) VALUES (?, ?, ?, ?)", posting_rows)
+            self._conn.commit()
+
+    def delete(self, scope, ids):
+        if not ids:
+            return
+        with self._lock:
+            self._delete_locked(scope, ids)
+            self._conn.commit()
+
+    def _delete_locked(self, scope, ids):
+        for i in range(0, len(ids), 500):
+            part = list(ids[i:i + 500])
+            placeholders = ",".join("?" * len(part))
+            self._conn.execute(f"DELETE FROM postings WHERE scope = ? AND doc_id IN ({placeholders})", [scope] + part)
+            self._conn.execute(f"DELETE FROM docs WHERE scope = ? AND id IN ({placeholders})", [scope] + part)
+
+    def clear(self, scope=None):
+        with self._lock:
+            if scope is None:
+                self._conn.execute("DELETE FROM postings")
+                self._conn.execute("DELETE FROM docs")
+            else:
+                self._conn.execute("DELETE FROM postings WHERE scope = ?", (scope,))
+                self._conn.execute("DELETE FROM docs WHERE scope = ?", (scope,))
+            self._conn.commit()
+
+    def count(self, scope):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs WHERE scope = ?", (scope,)).fetchone()[0]
+
+    def search(self, scope, query, top_k=10, exact_only=False):
+        """
+        BM25 점수 순으로 문서를 검색합니다.
+        exact_only=True이면 질의의 SRM 번호를 포함한 문서만 반환합니다.
+        반환값: [{'id', 'document', 'score'}, ...]
+        """
+        terms = Counter(tokenize(query))
+        if not terms:
+            return []
+        identifiers = [f"srm:{srm}" for srm in extract_identifiers(query)]
+        with self._lock:
+            n_docs, avg_length = self._conn.execute(
+                "SELECT COUNT(*), AVG(length) FROM docs WHERE scope = ?", (scope,)
+            ).fetchone()
+            if not n_docs:
+                return []
+            avg_length = avg_length or 1.0
+
+            candidates = None
+            if exact_only:
+                if not identifiers:
+                    return []
+                placeholders = ",".join("?" * len(identifiers))
+                candidates = {
+                    row[0] for row in self._conn.execute(
+                        f"SELECT doc_id FROM postings WHERE scope = ? AND term IN ({placeholders})",
+                        [scope] + identifiers
+                    )
+                }
+                if not candidates:
+                    return []
+
+            scores = {}
+            for term, query_tf in terms.items():
+                rows = self._conn.execute(
+                    "SELECT p.doc_id, p.tf, d.length FROM postings p"
+                    " JOIN docs d ON d.scope = p.scope AND d.id = p.doc_id"
+                    " WHERE p.scope = ? AND p.term = ?",
+                    (scope, term)
+                ).fetchall()
+                if not rows:
+                    continue
+                df = len(rows)
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                for doc_id, tf, length in rows:
+                    if candidates is not None and doc_id not in candidates:
+                        continue
+                    norm = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length))
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * norm * query_tf
+
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+            if not ranked:
+                return []
+            placeholders = ",".join("?" * len(ranked))
+            documents = dict(self._conn.execute(
+                f"SELECT id, document FROM docs WHERE scope = ? AND id IN ({placeholders})",
+                [scope] + [doc_id for doc_id, _ in ranked]
+            ).fetchall())
+        return [
+            {"id": doc_id, "document": documents.get(doc_id, ""), "score": score}
+            for doc_id, score in ranked
+        ]
+
+def reciprocal_rank_fusion(rankings, top_k=10, k=None):
+    """
+    여러 검색 결과 순위(ID 목록)를 RRF(1 / (k + 순위))로 합칩니다.
+    반환값: 점수 순 ID 목록
+    """
+    k = k or RRF_K
+    scores = {}
+    for ranking in rankings:
+        for rank, id_ in enumerate(ranking, 1):
+            scores[id_] = scores.get(id_, 0.0) + 1.0 / (k + rank)
+    return [id_ for id_, _ in sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]]
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_lexical_index():
+    """
+    프로세스 전체에서 공유하는 키워드 색인을 반환합니다.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = LexicalIndex()
+        return _index
+
+def _scope_collections():
+    from resources import PDF_COLLECTION, CONVERSATION_COLLECTION
+    return (("pdf", PDF_COLLECTION), ("conversation", CONVERSATION_COLLECTION))
+
+def rebuild_from_chroma(scopes=None):
+    """
+    ChromaDB에 저장된 PDF 청크/대화 기록으로 키워드 색인을 처음부터 다시 만듭니다.
+    (키워드 색인 도입 이전에 저장된 데이터를 색인할 때 사용, scopes를 주면 해당 scope만)
+    """
+    from resources import get_collection
+    index = get_lexical_index()
+    page_size = 1000
+    counts = Counter()
+    for scope, name in _scope_collections():
+        if scopes is not None and scope not in scopes:
+            continue
+        index.clear(scope)
+        collection = get_collection(name)
+        total = collection.count()
+        for offset in range(0, total, page_size):
+            data = collection.get(include=["documents"], limit=page_size, offset=offset)
+            index.add(scope, data["ids"], [document or "" for document in data["documents"]])
+            counts[scope] += len(data["ids"])
+    logger.info(f"키워드 색인 재구축 완료: PDF {counts['pdf']}개, 대화 {counts['conversation']}개")
+    return dict(counts)
+
+def ensure_lexical_index():
+    """
+    컬렉션에는 데이터가 있는데 키워드 색인이 비어 있는 scope를 한 번 다시 색인합니다.
+    (키워드 색인 도입 전부터 운영하던 환경에서 SRM 번호 검색이 바로 동작하도록 앱 시작 시 호출)
+    """
+    from resources import get_collection
+    index = get_lexical_index()
+    missing = [
+        scope for scope, name in _scope_collections()
+        if index.count(scope) == 0 and get_collection(name).count() > 0
+    ]
+    if missing:
+        return rebuild_from_chroma(scopes=missing)
+    return {}
+
+if __name__ == "__main__":
+    rebuild_from_chroma()
@@ -0,0 +1,520 @@
+import os
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+import numpy as np
+from dotenv import load_dotenv
+from tracing import get_logger
+
+# 환경변수 로드
+load_dotenv()
+
+logger = get_logger("numpy_vector_store")
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows에서는 프로세스 간 잠금 없이 동작
+
+# NumPy 벡터 저장소 설정
+# int8 양자화 사전 검색 사용 여부 (NumPy에는 int8 행렬 곱이 없어 CPU 시간은 늘지만, 검색 시 읽는 벡터 파일 크기가 1/4로 줄어
+# 벡터가 메모리에 다 올라가지 않는 경우에 유리)
+VECTOR_STORE_INT8 = os.getenv("VECTOR_STORE_INT8", "false").lower() in ("1", "true", "yes")
+VECTOR_STORE_RESCORE_FACTOR = int(os.getenv("VECTOR_STORE_RESCORE_FACTOR", "4"))  # int8 검색 후 원본 벡터로 다시 계산할 후보 배수
+VECTOR_STORE_INITIAL_CAPACITY = int(os.getenv("VECTOR_STORE_INITIAL_CAPACITY", "1024"))  # 처음 만들 때 확보할 행 수
+VECTOR_STORE_SCAN_BLOCK = int(os.getenv("VECTOR_STORE_SCAN_BLOCK", "8192"))  # 전수 검색 시 한 번에 계산할 행 수
+
+DEFAULT_GET_INCLUDE = ("documents", "metadatas")
+DEFAULT_QUERY_INCLUDE = ("documents", "metadatas", "distances")
+
+def _matches(metadata, where):
+    # ChromaDB where 필터 중 앱에서 쓰는 형태만 지원: {"key": value}, {"key": {"$eq"/"$ne"/"$in": ...}}, {"$and"/"$or": [...]}
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(_matches(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(_matches(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            for op, value in condition.items():
+                if op == "$eq" and metadata.get(key) != value:
+                    return False
+                if op == "$ne" and metadata.get(key) == value:
+                    return False
+                if op == "$in" and metadata.get(key) not in value:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+class _DirectoryLock:
+    # 프로세스 안에서는 스레드 RLock으로 중첩을 허용하고, 가장 바깥에서만 파일 잠금(flock)을 잡음
+    def __init__(self, path):
+        self.path = path
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.file = None
+
+_directory_locks = {}
+_directory_locks_guard = threading.Lock()
+
+@contextmanager
+def lock_collection_directory(directory):
+    """
+    컬렉션 디렉터리에 대한 프로세스 간 배타 잠금입니다. (디렉터리 옆 <디렉터리>.lock 파일)
+    앱과 CLI(pdf_pipeline, conversation_retention, index_maintenance 등)가 같은 저장소에 동시에 쓰지 않도록 합니다.
+    같은 프로세스 같은 스레드에서는 중첩해서 잡을 수 있습니다.
+    """
+    path = os.path.abspath(directory) + ".lock"
+    with _directory_locks_guard:
+        lock = _directory_locks.setdefault(path, _DirectoryLock(path))
+    with lock.thread_lock:
+        if lock.depth == 0 and fcntl is not None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            lock.file = open(path, "a")
+            fcntl.flock(lock.file.fileno(), fcntl.LOCK_EX)
+        lock.depth += 1
+        try:
+            yield
+        finally:
+            lock.depth -= 1
+            if lock.depth == 0 and lock.file is not None:
+                fcntl.flock(lock.file.fileno(), fcntl.LOCK_UN)
+                lock.file.close()
+                lock.file = None
+
+def quantize_int8(vectors):
+    """
+    행별 대칭 int8 양자화: 각 행을 최댓값 절대값/127로 나눠 반올림합니다. (codes, scales)를 반환합니다.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+class NumpyCollection:
+    """
+    ChromaDB 대신 쓸 수 있는 메모리 매핑 NumPy 벡터 컬렉션입니다. (VECTOR_STORE_BACKEND=numpy)
+    앱이 사용하는 ChromaDB Collection API(add/upsert/get/query/delete/count)와 같은 형태로 동작하므로
+    get_collection()이 반환하는 객체를 그대로 바꿔 쓸 수 있습니다.
+
+    - 벡터는 vectors.f32(float32, 행 × 차원) 파일을 np.memmap으로 열어 필요한 페이지만 읽습니다.
+      SQLite 파일을 열고 잠그는 과정이 없어 네트워크 공유 디렉터리에서도 컬렉션을 빨리 엽니다.
+    - 검색은 전체 행과의 거리를 블록 단위 행렬 곱으로 한 번에 계산하는 전수(brute-force) 검색입니다.
+      VECTOR_STORE_INT8이면 int8로 양자화한 vectors.i8에서 후보를 top_k × RESCORE_FACTOR개 고른 뒤
+      원본 float32 벡터로 정확한 거리를 다시 계산하여 순위를 정합니다.
+    - 거리는 ChromaDB 기본값과 같은 제곱 L2 거리입니다.
+    - 문서/메타데이터는 records.jsonl에 추가 기록(append)하고 시작할 때 다시 읽어 메모리에 둡니다.
+      삭제된 행은 다음 저장 때 재사용하고, 기록이 살아 있는 행보다 많이 쌓이면 파일을 새로 씁니다.
+    - 여러 프로세스가 같은 저장소를 열 수 있습니다. 쓰기는 lock_collection_directory로 잠근 뒤 진행하고,
+      쓸 때마다 meta.json의 generation을 새 값으로 바꿉니다. 읽기/쓰기 전에 generation이 마지막으로 읽은 값과
+      다르면(다른 프로세스가 저장/삭제/재구성한 경우) 파일을 다시 읽습니다.
+    """
+
+    def __init__(self, name, directory, quantize=None, rescore_factor=None):
+        self.name = name
+        self.directory = directory
+        self.quantize = VECTOR_STORE_INT8 if quantize is None else quantize
+        self.rescore_factor = rescore_factor or VECTOR_STORE_RESCORE_FACTOR
+        self._lock = threading.RLock()
+        self._reset_state()
+        os.makedirs(directory, exist_ok=True)
+        with lock_collection_directory(self.directory):
+            self._load()
+
+    def _reset_state(self):
+        self._dim = None
+        self._capacity = 0
+        self._generation = None  # 마지막으로 읽거나 쓴 meta.json의 generation
+        self._ids = []  # 행 번호 → ID (삭제된 행은 None)
+        self._documents = []
+        self._metadatas = []
+        self._row_of = {}  # ID → 행 번호
+        self._free = []  # 재사용할 삭제된 행
+        self._log_lines = 0
+        self._vectors = self._codes = self._scales = None
+        self._norms = np.zeros(0, dtype=np.float32)  # 행별 제곱 노름 (거리 계산용)
+        self._alive = np.zeros(0, dtype=bool)  # 행별 사용 여부 (검색 시 삭제된 행 제외)
+
+    # ---- 파일 ----
+    def _path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def _read_meta(self):
+        try:
+            with open(self._path("meta.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _refresh(self):
+        # 다른 프로세스가 저장소를 바꿨으면 처음부터 다시 읽음
+        meta = self._read_meta()
+        if (meta or {}).get("generation") == self._generation and (meta is None) == (self._dim is None):
+            return
+        with lock_collection_directory(self.directory):
+            self._reset_state()
+            self._load()
+
+    def _load(self):
+        meta = self._read_meta()
+        if meta is None:
+            return
+        started = time.perf_counter()
+        self._generation = meta.get("generation")
+        self._dim = meta["dim"]
+        self._open_arrays(meta["capacity"])
+        records_path = self._path("records.jsonl")
+        if os.path.exists(records_path):
+            with open(records_path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # 마지막 줄을 쓰다 중단된 경우
+                    self._apply(record)
+                    self._log_lines += 1
+        self._free = [row for row in range(len(self._ids) - 1, -1, -1) if self._ids[row] is None]
+        size = len(self._ids)
+        self._alive = np.array([id_ is not None for id_ in self._ids], dtype=bool)
+        self._norms = np.zeros(size, dtype=np.float32)
+        for start in range(0, size, VECTOR_STORE_SCAN_BLOCK):
+            vectors = self._vectors[start:min(size, start + VECTOR_STORE_SCAN_BLOCK)]
+            self._norms[start:start + len(vectors)] = np.einsum("ij,ij->i", vectors, vectors)
+        if meta.get("int8") != self.quantize:
+            # 양자화 설정이 바뀐 경우 (int8을 새로 켜면 기존 벡터로 int8 파일을 다시 만듦)
+            if self.quantize:
+                self._rebuild_codes()
+            self._write_meta()
+        logger.info(f"NumPy 벡터 컬렉션 '{self.name}' 열기: {len(self._row_of)}개, {time.perf_counter() - started:.2f}초")
+
+    def _apply(self, record):
+        # records.jsonl 한 줄을 메모리 상태에 반영
+        if record["op"] == "put":
+            row = record["row"]
+            while len(self._ids) <= row:
+                self._ids.append(None)
+                self._documents.append(None)
+                self._metadatas.append(None)
+            previous = self._ids[row]
+            if previous is not None and previous != record["id"]:
+                self._row_of.pop(previous, None)
+            self._ids[row] = record["id"]
+            self._documents[row] = record.get("document")
+            self._metadatas[row] = record.get("metadata")
+            self._row_of[record["id"]] = row
+        elif record["op"] == "delete":
+            for id_ in record["ids"]:
+                row = self._row_of.pop(id_, None)
+                if row is not None:
+                    self._ids[row] = None
+                    self._documents[row] = None
+                    self._metadatas[row] = None
+
+    def _open_arrays(self, capacity):
+        self._capacity = capacity
+        self._vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="r+", shape=(capacity, self._dim))
+        if self.quantize and os.path.exists(self._path("vectors.i8")):
+            self._codes = np.memmap(self._path("vectors.i8"), dtype=np.int8, mode="r+", shape=(capacity, self._dim))
+            self._scales = np.memmap(self._path("scales.f32"), dtype=np.float32, mode="r+", shape=(capacity,))
+
+    def _resize_files(self, capacity):
+        files = [("vectors.f32", self._dim * 4)]
+        if self.quantize:
+            files += [("vectors.i8", self._dim), ("scales.f32", 4)]
+        for filename, row_bytes in files:
+            with open(self._path(filename), "ab") as f:
+                f.truncate(capacity * row_bytes)
+
+    def _write_meta(self):
+        tmp_path = self._path("meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            # generation은 쓸 때마다 새 값으로 바꿔 다른 프로세스가 변경을 알 수 있게 함
+            self._generation = uuid.uuid4().hex
+            json.dump({
+                "dim": self._dim, "capacity": self._capacity, "metric": "l2", "int8": self.quantize,
+                "generation": self._generation
+            }, f)
+        os.replace(tmp_path, self._path("meta.json"))
+
+    def _ensure_capacity(self, rows, dim):
+        if self._dim is None:
+            self._dim = dim
+        elif dim != self._dim:
+            raise ValueError(f"임베딩 차원이 컬렉션({self._dim})과 다릅니다: {dim}")
+        if rows <= self._capacity and (self._codes is not None or not self.quantize):
+            return
+        capacity = max(rows, VECTOR_STORE_INITIAL_CAPACITY, self._capacity * 2)
+        self.flush()
+        self._vectors = self._codes = self._scales = None
+        self._resize_files(capacity)
+        self._open_arrays(capacity)
+        self._write_meta()
+
+    def _rebuild_codes(self):
+        self._resize_files(self._capacity)
+        self._open_arrays(self._capacity)
+        size = len(self._ids)
+        for start in range(0, size, VECTOR_STORE_SCAN_BLOCK):
+            end = min(size, start + VECTOR_STORE_SCAN_BLOCK)
+            self._codes[start:end], self._scales[start:end] = quantize_int8(self._vectors[start:end])
+        self.flush()
+
+    def _append_records(self, records):
+        with open(self._path("records.jsonl"), "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._log_lines += len(records)
+        # 덮어쓰기/삭제로 기록이 많이 쌓이면 살아 있는 행만 새로 씀
+        if self._log_lines > 2 * len(self._row_of) + 1000:
+            self._compact_records()
+
+    def _compact_records(self):
+        tmp_path = self._path("records.jsonl.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for row, id_ in enumerate(self._ids):
+                if id_ is not None:
+                    f.write(json.dumps({
+                        "op": "put", "row": row, "id": id_,
+                        "document": self._documents[row], "metadata": self._metadatas[row]
+                    }, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._path("records.jsonl"))
+        self._log_lines = len(self._row_of)
+
+    def flush(self):
+        for array in (self._vectors, self._codes, self._scales):
+            if array is not None:
+                array.flush()
+
+    # ---- 쓰기 ----
+    def upsert(self, ids, embeddings, documents=None, metadatas=None):
+        if len(set(ids)) != len(ids):
+            raise ValueError("upsert에 같은 ID가 두 번 이상 들어 있습니다.")
+        if not ids:
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        documents = documents if documents is not None else [None] * len(ids)
+        metadatas = metadatas if metadatas is not None else [None] * len(ids)
+        with self._lock, lock_collection_directory(self.directory):
+            self._refresh()
+            rows = []
+            next_row = len(self._ids)
+            free = list(self._free)
+            for id_ in ids:
+                if id_ in self._row_of:
+                    rows.append(self._row_of[id_])
+                elif free:
+                    rows.append(free.pop())
+                else:
+                    rows.append(next_row)
+                    next_row += 1
+            self._ensure_capacity(next_row, embeddings.shape[1])
+            self._free = free
+            rows_array = np.asarray(rows)
+            # 벡터를 먼저 쓰고 기록을 남김 (중간에 중단되면 기록 없는 행은 무시됨)
+            self._vectors[rows_array] = embeddings
+            if self.quantize:
+                self._codes[rows_array], self._scales[rows_array] = quantize_int8(embeddings)
+            self.flush()
+            if len(self._norms) < next_row:
+                grow = next_row - len(self._norms)
+                self._norms = np.concatenate([self._norms, np.zeros(grow, dtype=np.float32)])
+                self._alive = np.concatenate([self._alive, np.zeros(grow, dtype=bool)])
+            self._norms[rows_array] = np.einsum("ij,ij->i", embeddings, embeddings)
+            self._alive[rows_array] = True
+            records = [
+                {"op": "put", "row": row, "id": id_, "document": document, "metadata": metadata}
+                for row, id_, document, metadata in zip(rows, ids, documents, metadatas)
+            ]
+            for record in records:
+                self._apply(record)
+            self._append_records(records)
+            self._write_meta()
+
+    def add(self, ids, embeddings, documents=None, metadatas=None):
+        """
+        ChromaDB와 같이 이미 있는 ID는 건너뛰고 새 ID만 저장합니다.
+        """
+        with self._lock, lock_collection_directory(self.directory):
+            self._refresh()
+            keep = [i for i, id_ in enumerate(ids) if id_ not in self._row_of]
+            if not keep:
+                return
+            self.upsert(
+                [ids[i] for i in keep],
+                [embeddings[i] for i in keep],
+                [documents[i] for i in keep] if documents is not None else None,
+                [metadatas[i] for i in keep] if metadatas is not None else None
+            )
+
+    def delete(self, ids=None, where=None):
+        with self._lock, lock_collection_directory(self.directory):
+            self._refresh()
+            # 같은 ID가 두 번 들어와도 행은 한 번만 비움 (빈 행 목록에 중복으로 들어가면 두 ID가 한 행에 저장됨)
+            targets = {id_: None for id_ in (ids or []) if id_ in self._row_of}
+            if where:
+                targets.update(
+                    (id_, None) for row, id_ in enumerate(self._ids)
+                    if id_ is not None and id_ not in targets and _matches(self._metadatas[row], where)
+                )
+            targets = list(targets)
+            if not targets:
+                return
+            rows = [self._row_of[id_] for id_ in targets]
+            self._apply({"op": "delete", "ids": targets})
+            self._free.extend(sorted(rows, reverse=True))
+            self._alive[np.asarray(rows)] = False
+            self._append_records([{"op": "delete", "ids": targets}])
+            self._write_meta()
+
+    # ---- 읽기 ----
+    def count(self):
+        with self._lock:
+            self._refresh()
+            return len(self._row_of)
+
+    def _result(self, rows, include, nested=False):
+        wrap = (lambda values: [values]) if nested else (lambda values: values)
+        result = {"ids": wrap([self._ids[row] for row in rows])}
+        for key in ("documents", "metadatas", "embeddings"):
+            result[key] = None
+        if "documents" in include:
+            result["documents"] = wrap([self._documents[row] for row in rows])
+        if "metadatas" in include:
+            result["metadatas"] = wrap([self._metadatas[row] for row in rows])
+        if "embeddings" in include:
+            vectors = self._vectors[np.asarray(rows, dtype=np.int64)] if rows else np.zeros((0, self._dim or 0))
+            result["embeddings"] = wrap([vector.tolist() for vector in vectors])
+        return result
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=DEFAULT_GET_INCLUDE):
+        with self._lock:
+            self._refresh()
+            if ids is not None:
+                rows = [self._row_of[id_] for id_ in dict.fromkeys(ids) if id_ in self._row_of]
+            else:
+                rows = [row for row, id_ in enumerate(self._ids) if id_ is not None]
+            if where:
+                rows = [row for row in rows if _matches(self._metadatas[row], where)]
+            start = offset or 0
+            rows = rows[start:start + limit] if limit is not None else rows[start:]
+            return self._result(rows, include)
+
+    def _scan(self, array, query, size, scales=None):
+        # 블록 단위로 내적을 계산 (int8 행렬을 한꺼번에 float32로 바꾸지 않도록)
+        scores = np.empty(size, dtype=np.float32)
+        for start in range(0, size, VECTOR_STORE_SCAN_BLOCK):
+            end = min(size, start + VECTOR_STORE_SCAN_BLOCK)
+            block = array[start:end]
+            if block.dtype != np.float32:
+                block = block.astype(np.float32)
+            scores[start:end] = block @ query
+        if scales is not None:
+            scores *= scales[:size]
+        return scores
+
+    def query(self, query_embeddings, n_results=10, where=None, include=DEFAULT_QUERY_INCLUDE):
+        with self._lock:
+            self._refresh()
+            size = len(self._ids)
+            results = {"ids": [], "documents": None, "metadatas": None, "embeddings": None, "distances": None}
+            for key in ("documents", "metadatas", "embeddings", "distances"):
+                if key in include:
+                    results[key] = []
+            for query in query_embeddings:
+                query = np.asarray(query, dtype=np.float32)
+                alive = self._alive[:size].copy()
+                if where:
+                    alive &= np.array([
+                        id_ is not None and _matches(self._metadatas[row], where)
+                        for row, id_ in enumerate(self._ids)
+                    ], dtype=bool)
+                k = min(n_results, int(alive.sum()))
+                rows, distances = [], np.zeros(0, dtype=np.float32)
+                if k > 0:
+                    query_norm = float(query @ query)
+                    use_codes = self.quantize and self._codes is not None
+                    dots = self._scan(self._codes if use_codes else self._vectors, query, size,
+                                      self._scales if use_codes else None)
+                    approx = self._norms[:size] - 2 * dots + query_norm
+                    approx[~alive] = np.inf
+                    candidates = min(int(alive.sum()), k * self.rescore_factor if use_codes else k)
+                    top = np.argpartition(approx, candidates - 1)[:candidates]
+                    if use_codes:
+                        # 후보만 원본 float32 벡터로 정확한 거리를 다시 계산
+                        top = np.sort(top)
+                        exact = self._norms[top] - 2 * (self._vectors[top] @ query) + query_norm
+                    else:
+                        exact = approx[top]
+                    order = np.argsort(exact, kind="stable")[:k]
+                    rows = [int(row) for row in top[order]]
+                    distances = np.maximum(exact[order], 0.0)
+                item = self._result(rows, include)
+                results["ids"].append(item["ids"])
+                for key in ("documents", "metadatas", "embeddings"):
+                    if key in include:
+                        results[key].append(item[key])
+                if "distances" in include:
+                    results["distances"].append([float(d) for d in distances])
+            return results
+
+    def stats(self):
+        """
+        저장 행 수, 파일 크기(바이트), 양자화 여부를 반환합니다.
+        """
+        with self._lock:
+            self._refresh()
+            disk_bytes = sum(
+                os.path.getsize(self._path(filename))
+                for filename in ("vectors.f32", "vectors.i8", "scales.f32", "records.jsonl", "meta.json")
+                if os.path.exists(self._path(filename))
+            )
+            return {
+                "name": self.name,
+                "rows": len(self._row_of),
+                "capacity": self._capacity,
+                "dim": self._dim,
+                "quantized": self.quantize,
+                "disk_bytes": disk_bytes
+            }
+
+def copy_collection(source, target, batch_size=1000):
+    """
+    컬렉션의 모든 행(ID, 문서, 메타데이터, 임베딩)을 다른 컬렉션으로 복사합니다. 복사한 행 수를 반환합니다.
+    (ChromaDB → NumPy 저장소 전환 시 사용, Azure 호출 없음)
+    """
+    copied = 0
+    offset = 0
+    while True:
+        data = source.get(include=["documents", "metadatas", "embeddings"], limit=batch_size, offset=offset)
+        if not data["ids"]:
+            break
+        target.upsert(
+            ids=data["ids"],
+            embeddings=[list(embedding) for embedding in data["embeddings"]],
+            documents=data["documents"],
+            metadatas=data["metadatas"]
+        )
+        copied += len(data["ids"])
+        offset += len(data["ids"])
+    return copied
+
+if __name__ == "__main__":
+    # ChromaDB에 저장된 PDF/대화 컬렉션을 NumPy 저장소로 복사: python numpy_vector_store.py
+    from resources import get_chroma_client, get_vector_store_path, PDF_COLLECTION, CONVERSATION_COLLECTION
+    for collection_name in (PDF_COLLECTION, CONVERSATION_COLLECTION):
+        source = get_chroma_client().get_or_create_collection(collection_name)
+        target = NumpyCollection(collection_name, os.path.join(get_vector_store_path(), collection_name))
+        print(f"{collection_name}: {copy_collection(source, target)}개 복사 → {target.directory}")
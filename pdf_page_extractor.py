@@ -0,0 +1,19 @@
+import pdfplumber
+
+# PDF 페이지 추출 프로세스에서 실행하는 함수만 둡니다.
+# spawn 방식 자식 프로세스는 이 모듈만 import하므로 ChromaDB/OpenAI 등 무거운 모듈을 불러오지 않습니다.
+
+def extract_page_range(pdf_path, start, end):
+    """
+    PDF의 [start, end) 페이지 텍스트를 추출합니다. 프로세스 풀에서 실행됩니다.
+    반환값: [(페이지 번호(1부터), 텍스트), ...]
+    """
+    pages = []
+    with pdfplumber.open(pdf_path) as pdf:
+        for page_no in range(start, end):
+            page = pdf.pages[page_no]
+            page_text = page.extract_text()
+            if page_text:
+                pages.append((page_no + 1, page_text))
+            page.flush_cache()  # 페이지 객체 캐시 해제 (메모리 상한 유지)
+    return pages
@@ -0,0 +1,254 @@
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+import pdfplumber
+from dotenv import load_dotenv
+from resources import get_collection, PDF_COLLECTION
+from chunker import iter_record_chunks, count_tokens
+from pdf_page_extractor import extract_page_range
+from pdf_to_vectordb import (
+    get_azure_embeddings, save_to_chroma, show_chroma_db_status, rollback_chunks,
+    get_document_name, make_chunk_id, find_existing_ids, remove_stale_chunks,
+    EMBEDDING_BATCH_MAX_TOKENS, EMBEDDING_MAX_CONCURRENCY
+)
+from tracing import get_logger, record_duration, bind_context
+from quota_scheduler import use_lane, LANE_BULK
+
+# 환경변수 로드
+load_dotenv()
+
+logger = get_logger("pdf_pipeline")
+
+# 스트리밍 수집 설정
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))  # 페이지 추출 프로세스 수
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))  # 프로세스 작업 1건당 페이지 수
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))  # 단계 사이 큐에 쌓아 둘 최대 배치 수
+PIPELINE_BATCH_CHUNKS = int(os.getenv("PIPELINE_BATCH_CHUNKS", "64"))  # 임베딩/저장 1회당 최대 청크 수
+
+_DONE = object()  # 단계 종료 신호
+
+def iter_pdf_pages(pdf_path, max_workers=None, pages_per_task=None):
+    """
+    PDF 페이지를 순서대로 하나씩 내보내는 제너레이터입니다.
+    페이지 구간을 프로세스 풀에 나눠 추출하되, 동시에 진행 중인 구간 수를 제한하여
+    문서 전체를 메모리에 올리지 않습니다.
+    """
+    max_workers = max_workers or PDF_EXTRACT_WORKERS
+    pages_per_task = pages_per_task or PDF_PAGES_PER_TASK
+    with pdfplumber.open(pdf_path) as pdf:
+        page_count = len(pdf.pages)
+    ranges = [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+
+    # 작은 PDF는 프로세스 생성 비용이 더 크므로 현재 프로세스에서 처리
+    if max_workers <= 1 or len(ranges) <= 1:
+        for start, end in ranges:
+            yield from extract_page_range(pdf_path, start, end)
+        return
+
+    remaining = iter(ranges)
+    pending = deque()
+    # Streamlit 등 여러 스레드가 도는 프로세스에서 fork하면 다른 스레드가 잡고 있던 락이 자식에 복사되어
+    # 멈출 수 있으므로 spawn으로 새 프로세스를 시작 (자식은 가벼운 pdf_page_extractor만 import)
+    executor = ProcessPoolExecutor(
+        max_workers=min(max_workers, len(ranges)),
+        mp_context=multiprocessing.get_context("spawn")
+    )
+    with executor:
+        try:
+            for start, end in islice(remaining, max_workers * 2):
+                pending.append(executor.submit(extract_page_range, pdf_path, start, end))
+            while pending:
+                pages = pending.popleft().result()
+                next_range = next(remaining, None)
+                if next_range is not None:
+                    pending.append(executor.submit(extract_page_range, pdf_path, *next_range))
+                yield from pages
+        finally:
+            # 중간에 중단되면 아직 시작하지 않은 작업은 취소
+            for future in pending:
+                future.cancel()
+
+def iter_chunk_batches(chunks, max_items=None, max_tokens=None):
+    """
+    (페이지 번호, 청크)를 임베딩 요청에 맞는 크기의 배치로 묶습니다.
+    배치 하나는 여러 임베딩 요청으로 다시 나뉘어 동시에 처리됩니다.
+    """
+    max_items = max_items or PIPELINE_BATCH_CHUNKS
+    # 배치 하나가 동시 임베딩 요청 수만큼의 토큰 예산을 채우도록 함
+    max_tokens = max_tokens or EMBEDDING_BATCH_MAX_TOKENS * EMBEDDING_MAX_CONCURRENCY
+    batch, batch_tokens = [], 0
+    for item in chunks:
+        tokens = count_tokens(item[1])
+        if batch and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(item)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+def _put(q, item, stop):
+    # 큐가 가득 차면 기다리되, 다른 단계가 실패하면 즉시 중단
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.2)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.2)
+        except queue.Empty:
+            continue
+    return _DONE
+
+def ingest_pdf_streaming(pdf_path, max_tokens=None, overlap_tokens=None, queue_size=None, max_workers=None, replace=True):
+    """
+    PDF를 스트리밍 방식으로 벡터 DB에 적재합니다.
+    페이지 추출(프로세스 풀) → 레코드 단위 청크 분할 → 배치 임베딩 → ChromaDB 저장이 동시에 진행되며,
+    각 단계 사이에는 크기가 제한된 큐를 두어 메모리 사용량이 문서 크기에 비례하지 않습니다.
+    앞부분 페이지는 문서 전체 처리가 끝나기 전에도 검색할 수 있습니다.
+    어느 단계에서든 실패하면 이 문서에서 저장한 청크를 모두 롤백합니다.
+
+    청크 ID는 내용 해시이므로 같은 문서를 다시 적재하면 이미 저장된 청크는 임베딩하지 않고 건너뜁니다.
+    페이지 경계에 걸친 레코드는 다음 페이지와 이어 붙여 하나의 레코드로 청크를 만듭니다.
+    replace=True이면 적재가 끝난 뒤 새 버전에 없는 이전 청크를 삭제합니다.
+
+    Returns:
+        dict: {'pages', 'chunks', 'new_chunks', 'skipped_chunks', 'removed_chunks',
+               'elapsed', 'timestamp', 'rows_per_sec'}
+    """
+    queue_size = queue_size or PIPELINE_QUEUE_SIZE
+    chunk_queue = queue.Queue(maxsize=queue_size)
+    write_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    stats = {"pages": 0, "chunks": 0, "new": 0, "skipped": 0}
+    collection = get_collection(PDF_COLLECTION)
+    document_name = get_document_name(pdf_path)
+    seen_ids = set()  # 이번 버전 문서의 전체 청크 ID
+    written_ids = []  # 이번 적재에서 새로 저장한 청크 ID (롤백 대상)
+    write_seconds = 0.0
+    started = time.perf_counter()
+    ts = int(time.time())
+
+    def produce():
+        # 1단계: 페이지 추출 + 레코드 단위 청크 분할 + 배치 구성
+        try:
+            def counted_pages():
+                for page in iter_pdf_pages(pdf_path, max_workers=max_workers):
+                    stats["pages"] += 1
+                    yield page
+            chunks = iter_record_chunks(counted_pages(), max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+            for batch in iter_chunk_batches(chunks):
+                if not _put(chunk_queue, batch, stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(chunk_queue, _DONE, stop)
+
+    def embed():
+        # 2단계: 이미 저장된 청크는 건너뛰고 새 청크만 배치 임베딩
+        # (배치 내부는 get_azure_embeddings가 동시 요청으로 처리)
+        try:
+            while True:
+                batch = _get(chunk_queue, stop)
+                if batch is _DONE:
+                    return
+                stats["chunks"] += len(batch)
+                ids = [make_chunk_id(document_name, chunk) for _, chunk in batch]
+                existing = find_existing_ids(collection, [id_ for id_ in ids if id_ not in seen_ids])
+                new_items = []
+                for item, id_ in zip(batch, ids):
+                    if id_ not in seen_ids and id_ not in existing:
+                        new_items.append(item)
+                    seen_ids.add(id_)
+                stats["skipped"] += len(batch) - len(new_items)
+                if not new_items:
+                    continue
+                # 대량 적재는 낮은 우선순위로 요청 (상담 질의가 임베딩 할당량을 먼저 씀)
+                with use_lane(LANE_BULK):
+                    embeddings = get_azure_embeddings([chunk for _, chunk in new_items])
+                if not _put(write_queue, (new_items, embeddings), stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(write_queue, _DONE, stop)
+
+    threads = [
+        threading.Thread(target=bind_context(produce), name="pdf-extract", daemon=True),
+        threading.Thread(target=bind_context(embed), name="pdf-embed", daemon=True)
+    ]
+    for thread in threads:
+        thread.start()
+
+    # 3단계: ChromaDB 저장 (현재 스레드)
+    try:
+        while True:
+            item = _get(write_queue, stop)
+            if item is _DONE:
+                break
+            batch, embeddings = item
+            saved = save_to_chroma(
+                [chunk for _, chunk in batch],
+                embeddings,
+                pdf_path=pdf_path,
+                start_index=stats["new"],
+                timestamp=ts,
+                pages=[page_no for page_no, _ in batch],
+                show_status=False
+            )
+            stats["new"] += saved["rows"]
+            written_ids.extend(saved["ids"])
+            write_seconds += saved["elapsed"]
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        # 문서 단위 all-or-nothing: 어느 단계든 실패하면 이 문서에서 새로 저장한 청크를 모두 삭제
+        # (이전 버전 청크는 아직 지우지 않았으므로 그대로 남음)
+        rollback_chunks(collection, written_ids)
+        raise errors[0]
+
+    # 새 버전에 없는 이전 버전 청크 삭제
+    removed = remove_stale_chunks(collection, document_name, seen_ids) if replace else 0
+
+    elapsed = time.perf_counter() - started
+    record_duration("ingest_pdf", elapsed, pages=stats["pages"], chunks=stats["chunks"], new_chunks=stats["new"])
+    rows_per_sec = stats["new"] / write_seconds if write_seconds > 0 else 0.0
+    logger.info(
+        f"스트리밍 적재 완료: {stats['pages']}페이지, 청크 {stats['chunks']}개 "
+        f"(신규 {stats['new']}, 기존 {stats['skipped']}, 삭제 {removed}), {elapsed:.2f}초 (저장 {rows_per_sec:.1f} rows/sec)"
+    )
+    show_chroma_db_status()
+    return {
+        "pages": stats["pages"],
+        "chunks": stats["chunks"],
+        "new_chunks": stats["new"],
+        "skipped_chunks": stats["skipped"],
+        "removed_chunks": removed,
+        "elapsed": elapsed,
+        "timestamp": ts,
+        "rows_per_sec": rows_per_sec
+    }
+
+if __name__ == "__main__":
+    import sys
+    result = ingest_pdf_streaming(sys.argv[1])
+    print(result)
@@ -5,10 +5,20 @@ from chromadb import Client
 from chromadb.config import Settings
 from dotenv import load_dotenv
 import time
+import hashlib
+from chunker import split_into_chunks, count_tokens
+from lexical_index import get_lexical_index
+from tracing import get_logger, span, bind_context
+from answer_cache import invalidate_answer_cache
+from query_cache import bump_index_version
+from collection_stats import get_collection_stats, get_recent_item_ids, recount_from_chroma
+from resources import get_chroma_db_path, get_chroma_client, get_collection, get_embedding_client, PDF_COLLECTION, CONVERSATION_COLLECTION, VECTOR_STORE_BACKEND, get_vector_store_path
 
 # 환경변수 로드
 load_dotenv()
 
+logger = get_logger("pdf_to_vectordb")
+
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 # Azure OpenAI 환경변수
@@ -17,23 +27,6 @@ AZURE_OPENAI_ENDPOINT = os.getenv("TEXT_EMBEDDING_AZURE_OPENAI_ENDPOINT")
 AZURE_OPENAI_API_VERSION = os.getenv("TEXT_EMBEDDING_AZURE_OPENAI_API_VERSION")
 DEPLOYMENT_NAME = os.getenv("TEXT_EMBEDDING_DEPLOYMENT_NAME")
 
-# ChromaDB 저장 경로 (Azure Web App 호환)
-def get_chroma_db_path():
-    """
-    Azure Web App 환경에 맞는 ChromaDB 경로를 반환합니다.
-    Azure에서는 /home/site/wwwroot가 영구 저장소입니다.
-    """
-    # Azure Web App 환경 감지
-    if os.getenv("WEBSITE_SITE_NAME"):  
-        base_path = "/home/site/wwwroot/chroma_db"
-        print(f"Azure Web App 환경 감지: {base_path}")
-        return base_path
-    else:
-        # 로컬 개발 환경
-        base_path = os.path.join(os.getcwd(), "chroma_db")
-        print(f"로컬 개발 환경: {base_path}")
-        return base_path
-
 PERSIST_DIR = get_chroma_db_path()
 
 # PDF에서 텍스트 추출 함수
@@ -46,106 +39,331 @@ def extract_text_from_pdf(pdf_path):
                 text += page_text + "\n"
     return text
 
-# 텍스트를 chunk로 분할 (임베딩 길이 제한 대비)
-def split_text(text, chunk_size=500):
-    return [text[i:i+chunk_size] for i in range(0, len(text), chunk_size)]
+# 텍스트를 chunk로 분할 (VOC/SRM 레코드 경계 기준, 임베딩 모델 토큰 수 기준 크기)
+def split_text(text, max_tokens=None, overlap_tokens=None):
+    return split_into_chunks(text, max_tokens=max_tokens, overlap_tokens=overlap_tokens)
 
 # Azure OpenAI 임베딩 생성 함수
-from openai import AzureOpenAI
+from concurrent.futures import ThreadPoolExecutor
+from embedding_cache import get_cached_embeddings
+from quota_scheduler import get_quota_scheduler, EMBEDDING_QUOTA
 
-def get_azure_embeddings(text_list):
-    client = AzureOpenAI(
-        api_key=AZURE_OPENAI_API_KEY,
-        azure_endpoint=AZURE_OPENAI_ENDPOINT,
-        api_version=AZURE_OPENAI_API_VERSION
-    )
-    embeddings = []
-    for text in text_list:
-        response = client.embeddings.create(
-            input=text,
-            model=DEPLOYMENT_NAME
+# 임베딩 배치 설정 (요청 1건당 토큰 예산, 최대 입력 개수, 동시 요청 수, 재시도 횟수)
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "8000"))
+EMBEDDING_BATCH_MAX_ITEMS = int(os.getenv("EMBEDDING_BATCH_MAX_ITEMS", "256"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+
+def make_embedding_batches(text_list, max_tokens=None, max_items=None):
+    """
+    텍스트 목록을 토큰 예산 안에서 연속 구간으로 묶습니다.
+    반환값: [(시작 인덱스, [텍스트, ...]), ...] - 원래 순서를 그대로 유지합니다.
+    """
+    max_tokens = max_tokens or EMBEDDING_BATCH_MAX_TOKENS
+    max_items = max_items or EMBEDDING_BATCH_MAX_ITEMS
+    batches = []
+    start, current, current_tokens = 0, [], 0
+    for i, text in enumerate(text_list):
+        tokens = count_tokens(text)
+        # 예산 또는 개수를 넘으면 현재 배치를 닫음 (단일 텍스트가 예산보다 크면 단독 배치)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_items):
+            batches.append((start, current))
+            start, current, current_tokens = i, [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append((start, current))
+    return batches
+
+def embed_batch_with_retry(client, batch, model=None, max_retries=None):
+    """
+    배치 하나를 임베딩합니다. 임베딩 배포의 할당량(quota_scheduler)을 받은 뒤 요청하며,
+    429는 retry-after만큼, 그 밖의 일시적 오류는 지수 백오프(+지터)로 기다렸다가 재시도합니다.
+    응답의 index 기준으로 정렬하여 입력 순서와 동일한 순서로 반환합니다.
+    """
+    model = model or DEPLOYMENT_NAME
+    max_retries = EMBEDDING_MAX_RETRIES if max_retries is None else max_retries
+    tokens = sum(count_tokens(text) for text in batch)
+    with span("embedding.request", inputs=len(batch), tokens=tokens):
+        response = get_quota_scheduler(EMBEDDING_QUOTA).call(
+            lambda: client.embeddings.create(input=batch, model=model),
+            tokens=tokens,
+            max_retries=max_retries
         )
-        embeddings.append(response.data[0].embedding)
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+def get_azure_embeddings(text_list, max_tokens=None, max_workers=None):
+    """
+    텍스트 목록을 토큰 예산 단위 배치로 묶어 여러 배치를 동시에 임베딩합니다.
+    캐시에 있는 텍스트는 Azure를 호출하지 않습니다.
+    반환되는 embeddings의 순서는 text_list의 순서와 동일합니다.
+    """
+    if not text_list:
+        return []
+    # 이미 임베딩한 텍스트(재업로드된 PDF 등)는 캐시에서 가져오고 나머지만 요청
+    return get_cached_embeddings(
+        DEPLOYMENT_NAME,
+        text_list,
+        lambda missing: _request_azure_embeddings(missing, max_tokens=max_tokens, max_workers=max_workers)
+    )
+
+def _request_azure_embeddings(text_list, max_tokens=None, max_workers=None):
+    client = get_embedding_client()  # 공유 클라이언트 (keep-alive 연결 재사용)
+    batches = make_embedding_batches(text_list, max_tokens=max_tokens)
+    embeddings = [None] * len(text_list)
+    max_workers = max_workers or EMBEDDING_MAX_CONCURRENCY
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as executor:
+        futures = [
+            (start, executor.submit(bind_context(embed_batch_with_retry), client, batch))
+            for start, batch in batches
+        ]
+        for start, future in futures:
+            for offset, embedding in enumerate(future.result()):
+                embeddings[start + offset] = embedding
     return embeddings
 
 # Chroma DB에 저장 함수
-from chromadb import PersistentClient
+def save_to_chroma(text_chunks, embeddings, pdf_path=None, start_index=0, timestamp=None, pages=None, show_status=True, bulk=True):
+    """
+    청크와 임베딩을 PDF 전용 컬렉션(pdf_collection)에 저장합니다.
+    청크 ID는 문서 이름 + 내용 해시이므로 같은 청크를 다시 저장해도 중복되지 않습니다.
+    스트리밍 수집에서는 같은 문서를 여러 번 나눠 저장하므로
+    start_index(청크 번호 시작값)와 timestamp를 넘겨 메타데이터가 이어지도록 합니다.
+    pages를 넘기면 청크별 페이지 번호를 메타데이터에 함께 저장합니다.
 
-def save_to_chroma(text_chunks, embeddings, pdf_path=None):
-    persist_dir = get_chroma_db_path()  # 동적 경로 사용
-    
-    # 디렉토리가 없으면 생성
-    try:
-        os.makedirs(persist_dir, exist_ok=True)
-        print(f"ChromaDB 저장 경로 확인/생성: {persist_dir}")
-    except Exception as e:
-        print(f"ChromaDB 디렉토리 생성 실패: {e}")
-        raise
-    
-    client = PersistentClient(path=persist_dir)
-    collection = client.get_or_create_collection("pdf_collection")
-    # 파일명과 타임스탬프를 prefix로 사용
-    if pdf_path:
-        base = os.path.splitext(os.path.basename(pdf_path))[0]
-    else:
-        base = "pdf"
-    ts = int(time.time())
-    ids = [f"{base}_{ts}_chunk_{i}" for i in range(len(text_chunks))]
-    for i, (text, emb, id_) in enumerate(zip(text_chunks, embeddings, ids)):
-        collection.add(
-            documents=[text],
-            embeddings=[emb],
-            ids=[id_],
-            metadatas=[{
-                "type": "pdf",
-                "source": "pdf_document",
-                "filename": base,
-                "chunk_index": i,
-                "timestamp": ts
-            }]
-        )
-    print(f"{len(text_chunks)}개 청크 저장 완료! (저장경로: {persist_dir})")
+    bulk=True이면 ChromaDB 최대 배치 크기 단위로 upsert하고, 중간에 실패하면
+    이번 호출에서 저장한 청크를 모두 삭제하여 문서가 반쯤 저장된 상태로 남지 않게 합니다.
+    bulk=False는 비교용 기존 방식(청크마다 add 1회)입니다.
+
+    Returns:
+        dict: {'ids': [...], 'rows': int, 'elapsed': float, 'rows_per_sec': float}
+    """
+    # 동적 경로 사용 (NumPy 저장소는 컬렉션 디렉터리)
+    persist_dir = get_chroma_db_path() if VECTOR_STORE_BACKEND != "numpy" else os.path.join(get_vector_store_path(), PDF_COLLECTION)
+    collection = get_collection(PDF_COLLECTION)  # 공유 클라이언트/컬렉션 (디렉토리도 자동 생성)
+    # 파일명을 prefix로, 청크 내용 해시를 ID로 사용 (같은 내용은 항상 같은 ID → 재업로드해도 중복 저장 안 됨)
+    base = get_document_name(pdf_path)
+    ts = timestamp if timestamp is not None else int(time.time())
+    ids, documents, chunk_embeddings, metadatas = [], [], [], []
+    seen = set()
+    for i, (text, emb) in enumerate(zip(text_chunks, embeddings)):
+        id_ = make_chunk_id(base, text)
+        if id_ in seen:
+            continue  # 같은 문서 안의 동일한 청크는 한 번만 저장
+        seen.add(id_)
+        metadata = {
+            "type": "pdf",
+            "source": "pdf_document",
+            "filename": base,
+            "chunk_index": start_index + i,
+            "timestamp": ts
+        }
+        if pages is not None:
+            metadata["page"] = pages[i]
+        ids.append(id_)
+        documents.append(text)
+        chunk_embeddings.append(emb)
+        metadatas.append(metadata)
+
+    with span("chroma.write", collection=PDF_COLLECTION, rows=len(ids), bulk=bulk):
+        started = time.perf_counter()
+        # 통계 카운터에는 새로 생긴 청크만 더함 (같은 ID를 다시 저장하면 덮어쓰기)
+        existing_ids = find_existing_ids(collection, ids)
+        if bulk:
+            bulk_upsert(collection, ids, documents, chunk_embeddings, metadatas)
+        else:
+            for text, emb, id_, metadata in zip(documents, chunk_embeddings, ids, metadatas):
+                collection.add(
+                    documents=[text],
+                    embeddings=[emb],
+                    ids=[id_],
+                    metadatas=[metadata]
+                )
+        # 키워드 색인(SRM 번호, 시스템명, 한글 n-gram)도 함께 갱신
+        get_lexical_index().add("pdf", ids, documents)
+        get_collection_stats().adjust({"pdf_chunks": len(ids) - len(existing_ids)})
+        get_collection_stats().add_items("pdf", ids, [ts] * len(ids), [m["chunk_index"] for m in metadatas])
+        # 새 문서가 들어왔으므로 이전 답변과 검색 결과는 더 이상 정확하지 않을 수 있음
+        bump_index_version(PDF_COLLECTION)
+        invalidate_answer_cache()
+    elapsed = time.perf_counter() - started
+    rows_per_sec = len(ids) / elapsed if elapsed > 0 else float("inf")
+    result = {"ids": ids, "rows": len(ids), "elapsed": elapsed, "rows_per_sec": rows_per_sec}
+    logger.info(f"{len(ids)}개 청크 저장 완료! ({'일괄' if bulk else '개별'} 저장, {rows_per_sec:.1f} rows/sec, 저장경로: {persist_dir})")
+    if not show_status:
+        return result
     # 저장된 파일 목록 출력
     if os.path.exists(persist_dir):
-        print("\n[폴더 내 파일 목록]")
+        logger.info("[폴더 내 파일 목록]")
         for f in os.listdir(persist_dir):
-            print(f"- {f}")
+            logger.info(f"- {f}")
         show_chroma_db_status()
     else:
-        print("[경고] 저장 폴더가 존재하지 않습니다.")
+        logger.warning("[경고] 저장 폴더가 존재하지 않습니다.")
+    return result
+
+def get_document_name(pdf_path):
+    # 파일명(확장자 제외)을 문서 이름으로 사용
+    if pdf_path:
+        return os.path.splitext(os.path.basename(pdf_path))[0]
+    return "pdf"
+
+def make_chunk_id(document_name, text):
+    """
+    문서 이름 + 청크 내용 해시로 안정적인 청크 ID를 만듭니다.
+    같은 문서를 다시 적재해도 내용이 같은 청크는 같은 ID를 가집니다.
+    """
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+    return f"{document_name}_{digest}"
+
+def find_existing_ids(collection, ids):
+    """
+    주어진 ID 중 이미 컬렉션에 저장된 ID 집합을 반환합니다. (임베딩/문서는 조회하지 않음)
+    """
+    existing = set()
+    batch_size = get_max_batch_size()
+    for i in range(0, len(ids), batch_size):
+        existing.update(collection.get(ids=ids[i:i + batch_size], include=[])["ids"])
+    return existing
+
+def get_stored_embeddings(collection, ids):
+    """
+    저장된 임베딩을 ID별 dict로 반환합니다. (키워드 검색 결과처럼 임베딩 없이 찾은 문서용)
+    """
+    stored = {}
+    batch_size = get_max_batch_size()
+    for i in range(0, len(ids), batch_size):
+        data = collection.get(ids=ids[i:i + batch_size], include=["embeddings"])
+        for id_, embedding in zip(data["ids"], data["embeddings"]):
+            stored[id_] = list(embedding)
+    return stored
+
+def remove_stale_chunks(collection, document_name, keep_ids):
+    """
+    문서의 새 버전에 더 이상 없는 청크(이전 버전 청크, 예전 형식의 타임스탬프 ID 포함)를 삭제합니다.
+    삭제한 청크 수를 반환합니다.
+    """
+    stored_ids = collection.get(where={"filename": document_name}, include=[])["ids"]
+    stale_ids = [id_ for id_ in stored_ids if id_ not in keep_ids]
+    batch_size = get_max_batch_size()
+    for i in range(0, len(stale_ids), batch_size):
+        collection.delete(ids=stale_ids[i:i + batch_size])
+    if stale_ids:
+        bump_index_version(PDF_COLLECTION)
+    get_lexical_index().delete("pdf", stale_ids)
+    get_collection_stats().adjust({"pdf_chunks": -len(stale_ids)})
+    get_collection_stats().delete_items("pdf", stale_ids)
+    if stale_ids:
+        invalidate_answer_cache()
+        logger.info(f"'{document_name}' 문서에서 더 이상 없는 청크 {len(stale_ids)}개를 삭제했습니다.")
+    return len(stale_ids)
+
+def get_max_batch_size():
+    # ChromaDB가 한 번에 받을 수 있는 최대 행 수 (버전별로 다르므로 클라이언트에 조회)
+    if VECTOR_STORE_BACKEND == "numpy":
+        return 5000  # NumPy 저장소는 제한이 없으므로 기존 기본값 단위로 나눔
+    try:
+        return get_chroma_client().get_max_batch_size()
+    except Exception:
+        return 5000
+
+def bulk_upsert(collection, ids, documents, embeddings, metadatas):
+    """
+    최대 배치 크기 단위로 upsert합니다. 중간 배치가 실패하면 앞서 저장한 배치를 삭제(롤백)하고
+    예외를 다시 발생시킵니다. (전부 저장되거나 전혀 저장되지 않음)
+    """
+    batch_size = get_max_batch_size()
+    written = []
+    try:
+        for i in range(0, len(ids), batch_size):
+            collection.upsert(
+                ids=ids[i:i + batch_size],
+                documents=documents[i:i + batch_size],
+                embeddings=embeddings[i:i + batch_size],
+                metadatas=metadatas[i:i + batch_size]
+            )
+            written.extend(ids[i:i + batch_size])
+    except Exception:
+        # 아직 통계 카운터에 더하기 전이므로 카운터는 그대로 둠
+        rollback_chunks(collection, written, update_stats=False)
+        raise
+
+def rollback_chunks(collection, ids, update_stats=True):
+    """
+    이미 저장한 청크를 삭제합니다. 문서 적재가 실패했을 때 부분 저장분을 지우는 데 사용합니다.
+    update_stats=True이면 삭제한 만큼 통계 카운터에서 뺍니다.
+    """
+    if not ids:
+        return
+    batch_size = get_max_batch_size()
+    try:
+        for i in range(0, len(ids), batch_size):
+            collection.delete(ids=ids[i:i + batch_size])
+        bump_index_version(PDF_COLLECTION)
+        get_lexical_index().delete("pdf", ids)
+        if update_stats:
+            get_collection_stats().adjust({"pdf_chunks": -len(ids)})
+        get_collection_stats().delete_items("pdf", ids)
+        logger.warning(f"적재 실패로 {len(ids)}개 청크를 롤백했습니다.")
+    except Exception as e:
+        logger.warning(f"롤백 중 오류: {e}")
+
+def get_recent_items(limit=5, offset=0, collection_name=PDF_COLLECTION):
+    """
+    저장 시각(timestamp) 최신순으로 limit개씩 최근 항목을 반환합니다. offset으로 다음 페이지를 조회합니다.
+    정렬은 로컬 최근 항목 색인에서 하고, ChromaDB에서는 해당 페이지의 문서 내용만 가져옵니다.
+    색인에만 남은(컬렉션에서 삭제된) ID는 색인에서 지우고 다음 항목으로 채우며,
+    컬렉션에 문서가 있는데 색인이 비어 있으면 컬렉션 메타데이터로 색인을 다시 만듭니다.
+    반환값: [{'id', 'timestamp', 'document'}, ...]
+    """
+    scope = "conversation" if collection_name == CONVERSATION_COLLECTION else "pdf"
+    counter = "conversation_user" if scope == "conversation" else "pdf_chunks"
+    collection = get_collection(collection_name)
+    stats = get_collection_stats()
+    page = get_recent_item_ids(scope, limit=limit, offset=offset)
+    if not page and offset == 0 and stats.get()[counter] > 0:
+        recount_from_chroma()
+        page = stats.recent_items(scope, limit=limit, offset=offset)
+    items = []
+    while page:
+        data = collection.get(ids=[id_ for id_, _ in page], include=["documents"])
+        documents = dict(zip(data["ids"], data["documents"]))
+        items += [{"id": id_, "timestamp": ts, "document": documents[id_]} for id_, ts in page if id_ in documents]
+        missing = [id_ for id_, _ in page if id_ not in documents]
+        if not missing or len(items) >= limit:
+            break
+        stats.delete_items(scope, missing)
+        page = stats.recent_items(scope, limit=limit - len(items), offset=offset + len(items))
+    return items
 
-def show_chroma_db_status(recent_n=5):
-    # ChromaDB에 누적된 전체 청크/문서 개수와 최근 N개 ID, 내용을 최신순으로 출력
-    persist_dir = get_chroma_db_path()  # 동적 경로 사용
-    
+def show_chroma_db_status(recent_n=5, offset=0):
+    # ChromaDB에 누적된 전체 청크/문서 개수와 최근 N개 ID, 내용을 저장 시각 최신순으로 출력
+    # (개수는 PDF/대화 컬렉션별로 직접 조회, 최근 항목은 해당 페이지만 조회)
     try:
-        client = PersistentClient(path=persist_dir)
-        collection = client.get_or_create_collection("pdf_collection")
+        collection = get_collection(PDF_COLLECTION)
         count = collection.count()
-        print(f"총 저장된 청크 개수: {count}")
+        logger.info(f"총 저장된 청크 개수: {count}")
+        logger.info(f"저장된 대화 기록 개수: {get_collection(CONVERSATION_COLLECTION).count()}")
         
         if count > 0:
-            docs = collection.get()
-            ids = docs['ids']
-            documents = docs['documents']
-            # 최신순(가장 마지막에 추가된 순서)으로 최근 N개 출력
-            print(f"최근 저장된 문서 ID 목록 (최신순, 최대 {recent_n}개): {ids[-recent_n:][::-1]}")
-            print(f"최근 저장된 문서 내용 (최신순, 최대 {recent_n}개): {documents[-recent_n:][::-1]}")
-            return count, ids[-recent_n:][::-1], documents[-recent_n:][::-1]
+            items = get_recent_items(limit=recent_n, offset=offset)
+            ids = [item['id'] for item in items]
+            documents = [item['document'] for item in items]
+            logger.info(f"최근 저장된 문서 ID 목록 (최신순, {offset + 1}번째부터 최대 {recent_n}개): {ids}")
+            logger.info(f"최근 저장된 문서 내용 (최신순, {offset + 1}번째부터 최대 {recent_n}개): {documents}")
+            return count, ids, documents
         else:
-            print("저장된 문서가 없습니다.")
+            logger.info("저장된 문서가 없습니다.")
             return 0, [], []
             
     except Exception as e:
-        print(f"ChromaDB 상태 확인 중 오류: {e}")
+        logger.warning(f"ChromaDB 상태 확인 중 오류: {e}")
         return 0, [], []
 
 if __name__ == "__main__":
+    from pdf_pipeline import ingest_pdf_streaming
     pdf_path = "/Users/minho/Desktop/MS AI/pstn_voc.pdf"  # 사용할 PDF 파일 경로
-    text = extract_text_from_pdf(pdf_path)
-    chunks = split_text(text)
-    embeddings = get_azure_embeddings(chunks)
-    save_to_chroma(chunks, embeddings, pdf_path=pdf_path)
+    ingest_pdf_streaming(pdf_path)
     print("PDF -> 벡터 DB 변환 완료! (Azure OpenAI)")
 
 
@@ -0,0 +1,139 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+from tracing import span, increment
+from collection_stats import get_collection_stats
+
+# 환경변수 로드
+load_dotenv()
+
+# 벡터 검색 결과 캐시 설정
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1000"))  # 최대 보관 개수 (초과 시 LRU 제거, 0이면 사용 안 함)
+
+def make_query_key(query_embedding, n_results, where=None, include=None):
+    # 질의 벡터(float32 바이트) 해시 + 필터 + top_k + 조회 항목으로 키 생성
+    digest = hashlib.sha256(np.asarray(query_embedding, dtype=np.float32).tobytes())
+    digest.update(json.dumps([n_results, where, sorted(include or [])], sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
+class QueryResultCache:
+    """
+    컬렉션 검색(collection.query) 결과를 메모리에 보관하는 LRU 캐시입니다.
+    - 같은 질의 벡터/필터/top_k로 다시 검색하면(다른 세션, Streamlit rerun 등) 저장된 결과를 바로 반환합니다.
+    - 컬렉션마다 색인 버전을 두고, 저장/삭제가 일어날 때마다 bump()로 버전을 올립니다.
+      버전은 컬렉션 통계 DB(SQLite)에 저장하므로 다른 프로세스(CLI 적재, 대화 정리 등)가 올린 버전도 조회 때 반영됩니다.
+      항목은 검색을 시작할 때의 버전으로 저장되며 버전이 다른 항목은 반환하지 않으므로 오래된 결과를 쓰지 않습니다.
+      (검색 도중 저장이 끝난 경우에도 시작 시점 버전으로 기록되어 다음 조회에서 버려짐)
+    - 최대 개수를 넘으면 가장 오래 사용되지 않은 항목부터 제거합니다.
+    """
+
+    def __init__(self, max_entries=None):
+        self.max_entries = QUERY_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # (컬렉션 이름, 키) -> (버전, 결과) (뒤쪽일수록 최근 사용)
+        self._lock = threading.Lock()
+
+    def version(self, collection_name):
+        return get_collection_stats().get_version(f"index:{collection_name}")
+
+    def bump(self, collection_name):
+        """
+        컬렉션의 색인 버전을 올립니다. 이전 버전으로 저장된 결과는 더 이상 반환되지 않습니다.
+        """
+        get_collection_stats().bump_version(f"index:{collection_name}")
+
+    def get(self, collection_name, key):
+        """
+        현재 버전의 캐시된 검색 결과를 반환합니다. 없으면 None입니다.
+        """
+        version = self.version(collection_name)
+        with self._lock:
+            entry = self._entries.get((collection_name, key))
+            if entry is not None and entry[0] != version:
+                del self._entries[(collection_name, key)]
+                self.stale += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((collection_name, key))
+            self.hits += 1
+            return entry[1]
+
+    def put(self, collection_name, key, version, results):
+        """
+        검색 결과를 저장합니다. 검색하는 동안 버전이 바뀌었으면 저장하지 않습니다.
+        """
+        if self.max_entries <= 0:
+            return
+        if version != self.version(collection_name):
+            return
+        with self._lock:
+            self._entries[(collection_name, key)] = (version, results)
+            self._entries.move_to_end((collection_name, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits / total) if total else 0.0
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_query_cache():
+    """
+    프로세스 전체에서 공유하는 검색 결과 캐시를 반환합니다.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = QueryResultCache()
+        return _cache
+
+def bump_index_version(collection_name):
+    """
+    컬렉션에 저장/삭제가 일어났음을 알립니다. (저장/삭제가 끝난 뒤 호출)
+    """
+    get_query_cache().bump(collection_name)
+
+def cached_query(collection_name, collection, query_embedding, n_results, include, where=None):
+    """
+    collection.query를 캐시를 거쳐 실행합니다. 질의 벡터 하나에 대한 결과(ChromaDB query 반환 형식)를 반환합니다.
+    반환값은 다른 호출과 공유하므로 수정하지 말고 읽기만 해야 합니다.
+    """
+    cache = get_query_cache()
+    key = make_query_key(query_embedding, n_results, where=where, include=include)
+    results = cache.get(collection_name, key)
+    increment("query_cache.hits" if results is not None else "query_cache.misses")
+    if results is not None:
+        return results
+    version = cache.version(collection_name)
+    with span("chroma.query", collection=collection_name, top_k=n_results):
+        query_args = {"query_embeddings": [query_embedding], "n_results": n_results, "include": list(include)}
+        if where is not None:
+            query_args["where"] = where
+        results = collection.query(**query_args)
+    cache.put(collection_name, key, version, results)
+    return results
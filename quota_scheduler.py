@@ -0,0 +1,253 @@
+import os
+import time
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from tracing import get_logger, record_duration, increment
+from chunker import count_tokens
+
+# 환경변수 로드
+load_dotenv()
+
+logger = get_logger("quota_scheduler")
+
+# Azure 배포별 분당 요청 수(RPM) / 분당 토큰 수(TPM) 한도 (Azure 포털의 배포 할당량과 맞춰 설정, 0이면 제한 없음)
+AZURE_EMBEDDING_RPM = int(os.getenv("AZURE_EMBEDDING_RPM", "1440"))
+AZURE_EMBEDDING_TPM = int(os.getenv("AZURE_EMBEDDING_TPM", "240000"))
+AZURE_CHAT_RPM = int(os.getenv("AZURE_CHAT_RPM", "480"))
+AZURE_CHAT_TPM = int(os.getenv("AZURE_CHAT_TPM", "80000"))
+
+# 대량 작업(PDF 적재, 대화 백그라운드 저장)이 쓸 수 있는 할당량 비율 (나머지는 상담 질의용으로 남겨 둠)
+QUOTA_BULK_MAX_SHARE = float(os.getenv("QUOTA_BULK_MAX_SHARE", "0.7"))
+# 429/일시적 오류 재시도 횟수 (대량 작업은 EMBEDDING_MAX_RETRIES 등 호출부에서 따로 지정)
+QUOTA_MAX_RETRIES = int(os.getenv("QUOTA_MAX_RETRIES", "3"))
+# 챗 요청의 출력 토큰 추정치 (Azure는 요청 시점에 max_tokens 또는 추정 출력 토큰을 TPM에서 차감)
+CHAT_OUTPUT_TOKEN_ESTIMATE = int(os.getenv("CHAT_OUTPUT_TOKEN_ESTIMATE", "800"))
+
+# 요청 우선순위 (대화형 상담 질의가 항상 대량 작업보다 먼저 처리됨)
+LANE_INTERACTIVE = "interactive"
+LANE_BULK = "bulk"
+LANES = (LANE_INTERACTIVE, LANE_BULK)
+
+# 재시도 대상 오류 (429는 retry-after만큼 배포 전체를 멈추고, 나머지는 해당 요청만 지수 백오프)
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+_current_lane = contextvars.ContextVar("quota_lane", default=LANE_INTERACTIVE)
+
+@contextmanager
+def use_lane(lane):
+    """
+    이 구간에서 나가는 Azure 요청의 우선순위를 지정합니다. (스레드 풀로 넘길 때는 tracing.bind_context 사용)
+
+        with use_lane(LANE_BULK):
+            get_azure_embeddings(chunks)
+    """
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+def current_lane():
+    return _current_lane.get()
+
+def get_retry_after(error):
+    """
+    429 응답의 retry-after-ms / retry-after 헤더(초)를 반환합니다. 없으면 None입니다.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass  # HTTP 날짜 형식 등은 지수 백오프로 대체
+    return None
+
+class TokenBucket:
+    """
+    분당 한도(per_minute)만큼 채워지고 초당 per_minute/60씩 다시 차는 토큰 버킷입니다.
+    per_minute가 0이면 제한하지 않습니다.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self):
+        return self.capacity <= 0
+
+    def refill(self, now):
+        if not self.unlimited:
+            self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, reserve=0.0):
+        """
+        amount를 꺼낸 뒤에도 reserve 이상 남으려면 기다려야 하는 시간(초)입니다.
+        한도보다 큰 요청은 버킷이 가득 찼을 때 한 번에 꺼낼 수 있도록 한도로 자릅니다.
+        """
+        if self.unlimited:
+            return 0.0
+        amount = min(amount, self.capacity - reserve)
+        deficit = amount + reserve - self.available
+        return max(0.0, deficit / self.rate)
+
+    def take(self, amount):
+        if not self.unlimited:
+            self.available -= min(amount, self.capacity)
+
+class QuotaScheduler:
+    """
+    Azure 배포 하나의 RPM/TPM 할당량을 프로세스 전체에서 나눠 쓰기 위한 스케줄러입니다.
+    - 요청마다 요청 버킷에서 1, 토큰 버킷에서 추정 토큰 수를 꺼내고, 모자라면 찰 때까지 기다립니다.
+    - 대화형 요청이 기다리는 동안에는 대량 작업 요청을 내보내지 않고,
+      대량 작업은 할당량의 QUOTA_BULK_MAX_SHARE까지만 써서 상담 질의가 바로 나갈 여유를 남깁니다.
+    - 429를 받으면 retry-after 동안 이 배포로 가는 모든 요청을 멈춘 뒤 재시도합니다.
+    """
+
+    def __init__(self, name, rpm, tpm, bulk_max_share=None):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.bulk_max_share = QUOTA_BULK_MAX_SHARE if bulk_max_share is None else bulk_max_share
+        self.blocked_until = 0.0
+        self._cond = threading.Condition()
+        self._waiting = {lane: 0 for lane in LANES}
+        self.granted = {lane: 0 for lane in LANES}
+        self.wait_seconds = {lane: 0.0 for lane in LANES}
+        self.rate_limited = 0
+        self.retries = 0
+
+    def _wait_time(self, tokens, lane, now):
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        reserve = 1.0 - self.bulk_max_share if lane == LANE_BULK else 0.0
+        return max(
+            self.requests.wait_time(1, reserve * self.requests.capacity),
+            self.tokens.wait_time(tokens, reserve * self.tokens.capacity)
+        )
+
+    def acquire(self, tokens, lane=None):
+        """
+        요청을 보낼 수 있을 때까지 기다린 뒤 할당량을 차감합니다. 기다린 시간(초)을 반환합니다.
+        """
+        lane = lane or current_lane()
+        started = time.monotonic()
+        with self._cond:
+            self._waiting[lane] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    if lane == LANE_BULK and self._waiting[LANE_INTERACTIVE]:
+                        wait = None  # 대화형 요청이 먼저 나간 뒤 깨어남
+                    else:
+                        wait = self._wait_time(tokens, lane, now)
+                        if wait <= 0:
+                            self.requests.take(1)
+                            self.tokens.take(tokens)
+                            break
+                    self._cond.wait(wait)
+            finally:
+                self._waiting[lane] -= 1
+                self._cond.notify_all()
+            waited = time.monotonic() - started
+            self.granted[lane] += 1
+            self.wait_seconds[lane] += waited
+        if waited > 0.001:
+            record_duration("quota.wait", waited, deployment=self.name, lane=lane, tokens=tokens)
+        return waited
+
+    def pause(self, seconds):
+        """
+        429 응답을 받았을 때 이 배포로 가는 모든 요청을 seconds초 동안 멈춥니다.
+        """
+        with self._cond:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.rate_limited += 1
+            self._cond.notify_all()
+
+    def call(self, fn, tokens, lane=None, max_retries=None):
+        """
+        할당량을 받은 뒤 fn()을 호출합니다. 429는 retry-after만큼 배포 전체를 멈춘 뒤,
+        타임아웃/연결 오류/5xx는 지수 백오프(+지터) 후 다시 할당량을 받아 재시도합니다.
+        """
+        lane = lane or current_lane()
+        max_retries = QUOTA_MAX_RETRIES if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            self.acquire(tokens, lane)
+            try:
+                return fn()
+            except RETRYABLE_ERRORS as e:
+                attempt += 1
+                delay = min(2 ** attempt, 30) + random.uniform(0, 1)
+                if isinstance(e, RateLimitError):
+                    # 재시도하지 않더라도 다른 요청이 같은 한도에 부딪히지 않도록 배포 전체를 멈춤
+                    delay = get_retry_after(e) or delay
+                    self.pause(delay)
+                    increment("quota.rate_limited")
+                if attempt > max_retries:
+                    raise
+                with self._cond:
+                    self.retries += 1
+                logger.warning(f"{self.name} 요청 재시도 {attempt}/{max_retries} ({lane}, {delay:.1f}초 후): {e}")
+                if not isinstance(e, RateLimitError):
+                    time.sleep(delay)  # 429는 pause()로 멈춘 시간만큼 acquire에서 기다림
+
+    def stats(self):
+        with self._cond:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            return {
+                "name": self.name,
+                "rpm": self.requests.capacity,
+                "tpm": self.tokens.capacity,
+                "available_requests": None if self.requests.unlimited else self.requests.available,
+                "available_tokens": None if self.tokens.unlimited else self.tokens.available,
+                "blocked_for": max(0.0, self.blocked_until - now),
+                "waiting": dict(self._waiting),
+                "granted": dict(self.granted),
+                "wait_seconds": dict(self.wait_seconds),
+                "rate_limited": self.rate_limited,
+                "retries": self.retries
+            }
+
+# Azure 배포별 스케줄러 (프로세스 공유)
+EMBEDDING_QUOTA = "embedding"
+CHAT_QUOTA = "chat"
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_quota_scheduler(name):
+    """
+    배포 종류(EMBEDDING_QUOTA/CHAT_QUOTA)별로 프로세스 전체에서 공유하는 스케줄러를 반환합니다.
+    """
+    with _schedulers_lock:
+        if name not in _schedulers:
+            if name == EMBEDDING_QUOTA:
+                _schedulers[name] = QuotaScheduler(name, AZURE_EMBEDDING_RPM, AZURE_EMBEDDING_TPM)
+            elif name == CHAT_QUOTA:
+                _schedulers[name] = QuotaScheduler(name, AZURE_CHAT_RPM, AZURE_CHAT_TPM)
+            else:
+                raise ValueError(f"알 수 없는 할당량 이름: {name}")
+        return _schedulers[name]
+
+def estimate_chat_tokens(messages, max_tokens=None):
+    """
+    챗 요청이 TPM에서 차감될 토큰 수(프롬프트 + 출력 추정치)를 계산합니다.
+    """
+    prompt_tokens = sum(count_tokens(message["content"] or "") + 4 for message in messages)
+    return prompt_tokens + (max_tokens or CHAT_OUTPUT_TOKEN_ESTIMATE)
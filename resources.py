@@ -0,0 +1,237 @@
+import os
+import time
+import threading
+import httpx
+from dotenv import load_dotenv
+from openai import AzureOpenAI
+from chromadb import PersistentClient
+from tracing import get_logger
+from quota_scheduler import get_quota_scheduler, EMBEDDING_QUOTA
+from numpy_vector_store import NumpyCollection
+
+# 환경변수 로드
+load_dotenv()
+
+logger = get_logger("resources")
+
+# Azure OpenAI 챗 환경변수
+CHAT_API_KEY = os.getenv("OPENAI_API_KEY")
+CHAT_ENDPOINT = os.getenv("AZURE_ENDPOINT")
+CHAT_API_VERSION = os.getenv("OPENAI_API_VERSION")
+
+# Azure OpenAI 임베딩 환경변수
+AZURE_EMBEDDING_API_KEY = os.getenv("TEXT_EMBEDDING_AZURE_OPENAI_API_KEY")
+AZURE_EMBEDDING_ENDPOINT = os.getenv("TEXT_EMBEDDING_AZURE_OPENAI_ENDPOINT")
+AZURE_EMBEDDING_API_VERSION = os.getenv("TEXT_EMBEDDING_AZURE_OPENAI_API_VERSION")
+EMBEDDING_DEPLOYMENT_NAME = os.getenv("TEXT_EMBEDDING_DEPLOYMENT_NAME")
+
+# 컬렉션 이름 (PDF 청크와 대화 기록은 각각 별도 컬렉션/HNSW 색인에 저장)
+PDF_COLLECTION = "pdf_collection"
+CONVERSATION_COLLECTION = "conversation_collection"
+
+# 벡터 저장소 종류 (chroma: ChromaDB HNSW, numpy: 메모리 매핑 NumPy 전수 검색 - numpy_vector_store.py)
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "chroma").lower()
+
+# HNSW 색인 설정 (ChromaDB 컬렉션을 만들 때 적용)
+# space/M/ef_construction은 이미 만들어진 컬렉션에는 반영되지 않으므로 바꾼 뒤 index_maintenance.py로 색인을 다시 만듦
+HNSW_SPACE = os.getenv("HNSW_SPACE", "l2")  # 거리 함수 (l2, cosine, ip)
+HNSW_M = int(os.getenv("HNSW_M", "16"))  # 노드당 이웃 수 (클수록 정확도/메모리 증가)
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "100"))  # 색인 생성 시 탐색 폭
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "100"))  # 검색 시 탐색 폭 (기존 컬렉션에도 바로 반영)
+
+# HTTP 연결 풀 설정 (keep-alive 연결을 재사용하여 매 요청마다 TLS 핸드셰이크를 하지 않음)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "32"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "16"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "120"))
+
+# ChromaDB 저장 경로 (Azure Web App 호환)
+def get_chroma_db_path():
+    """
+    Azure Web App 환경에 맞는 ChromaDB 경로를 반환합니다.
+    Azure에서는 /home/site/wwwroot가 영구 저장소입니다.
+    (여러 모듈이 import 시점마다 호출하므로 경로는 DEBUG 로그로만 남기고, 실제 사용 경로는 클라이언트 생성 시 한 번 기록)
+    """
+    # Azure Web App 환경 감지
+    if os.getenv("WEBSITE_SITE_NAME"):
+        base_path = "/home/site/wwwroot/chroma_db"
+        logger.debug(f"Azure Web App 환경 감지: {base_path}")
+        return base_path
+    else:
+        # 로컬 개발 환경
+        base_path = os.path.join(os.getcwd(), "chroma_db")
+        logger.debug(f"로컬 개발 환경: {base_path}")
+        return base_path
+
+def get_data_file_path(filename):
+    """
+    ChromaDB 외에 앱이 관리하는 로컬 데이터 파일(캐시, 색인 등)의 경로를 반환합니다.
+    Azure Web App에서는 영구 저장소(/home/site/wwwroot)에 둡니다.
+    """
+    if os.getenv("WEBSITE_SITE_NAME"):
+        return os.path.join("/home/site/wwwroot", filename)
+    return os.path.join(os.getcwd(), filename)
+
+def get_vector_store_path():
+    """
+    NumPy 벡터 저장소 디렉터리를 반환합니다. (컬렉션별 하위 디렉터리)
+    """
+    return os.getenv("VECTOR_STORE_PATH") or get_data_file_path("vector_store")
+
+# 프로세스 전체에서 공유하는 핸들 (Streamlit rerun 사이에도 유지됨)
+_lock = threading.RLock()
+_chroma_client = None
+_collections = {}
+_embedding_client = None
+_chat_client = None
+_last_warm_up = None
+
+def _make_http_client():
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(60.0, connect=10.0)
+    )
+
+def get_chroma_client():
+    """
+    ChromaDB PersistentClient를 프로세스당 한 번만 생성하여 반환합니다.
+    """
+    global _chroma_client
+    with _lock:
+        if _chroma_client is None:
+            persist_dir = get_chroma_db_path()
+            os.makedirs(persist_dir, exist_ok=True)
+            _chroma_client = PersistentClient(path=persist_dir)
+            logger.info(f"ChromaDB 저장 경로: {persist_dir}")
+        return _chroma_client
+
+def get_hnsw_configuration():
+    """
+    컬렉션 생성 시 넘길 HNSW 설정을 반환합니다.
+    """
+    return {
+        "hnsw": {
+            "space": HNSW_SPACE,
+            "max_neighbors": HNSW_M,
+            "ef_construction": HNSW_EF_CONSTRUCTION,
+            "ef_search": HNSW_EF_SEARCH
+        }
+    }
+
+def _open_chroma_collection(name):
+    wanted = get_hnsw_configuration()["hnsw"]
+    collection = get_chroma_client().get_or_create_collection(name, configuration=get_hnsw_configuration())
+    current = (collection.configuration or {}).get("hnsw") or {}
+    # ef_search는 색인을 다시 만들지 않고 바꿀 수 있음
+    if current.get("ef_search") not in (None, wanted["ef_search"]):
+        collection.modify(configuration={"hnsw": {"ef_search": wanted["ef_search"]}})
+    stale = [key for key in ("space", "max_neighbors", "ef_construction") if current.get(key) not in (None, wanted[key])]
+    if stale:
+        logger.warning(
+            f"'{name}' 컬렉션의 HNSW 설정이 환경변수와 다릅니다: "
+            + ", ".join(f"{key} {current[key]} → {wanted[key]}" for key in stale)
+            + f" (적용하려면 python index_maintenance.py --collections {name})"
+        )
+    return collection
+
+def get_collection(name=PDF_COLLECTION):
+    """
+    컬렉션 핸들을 캐시하여 반환합니다. get_or_create_collection은 최초 1회만 호출됩니다.
+    VECTOR_STORE_BACKEND=numpy이면 같은 API(add/upsert/get/query/delete/count)를 가진 NumpyCollection을 반환하므로
+    검색/저장 코드는 저장소 종류와 관계없이 이 핸들만 사용합니다.
+    """
+    with _lock:
+        if name not in _collections:
+            if VECTOR_STORE_BACKEND == "numpy":
+                _collections[name] = NumpyCollection(name, os.path.join(get_vector_store_path(), name))
+            else:
+                _collections[name] = _open_chroma_collection(name)
+        return _collections[name]
+
+def get_embedding_client():
+    """
+    임베딩용 AzureOpenAI 클라이언트를 프로세스당 한 번만 생성하여 반환합니다.
+    """
+    global _embedding_client
+    with _lock:
+        if _embedding_client is None:
+            _embedding_client = AzureOpenAI(
+                api_key=AZURE_EMBEDDING_API_KEY,
+                azure_endpoint=AZURE_EMBEDDING_ENDPOINT,
+                api_version=AZURE_EMBEDDING_API_VERSION,
+                http_client=_make_http_client(),
+                max_retries=0  # 재시도는 quota_scheduler가 할당량과 retry-after를 반영하여 처리
+            )
+        return _embedding_client
+
+def get_chat_client():
+    """
+    챗 완성용 AzureOpenAI 클라이언트를 프로세스당 한 번만 생성하여 반환합니다.
+    """
+    global _chat_client
+    with _lock:
+        if _chat_client is None:
+            _chat_client = AzureOpenAI(
+                api_key=CHAT_API_KEY,
+                azure_endpoint=CHAT_ENDPOINT,
+                api_version=CHAT_API_VERSION,
+                http_client=_make_http_client(),
+                max_retries=0  # 재시도는 quota_scheduler가 할당량과 retry-after를 반영하여 처리
+            )
+        return _chat_client
+
+def reset_collections():
+    """
+    캐시된 컬렉션 핸들을 비웁니다. 컬렉션을 삭제/재생성한 뒤 호출해야 합니다.
+    """
+    with _lock:
+        _collections.clear()
+
+def warm_up(collection_names=(PDF_COLLECTION, CONVERSATION_COLLECTION)):
+    """
+    앱 시작 시 ChromaDB(SQLite 오픈, 컬렉션 로드)와 HTTP 연결을 미리 준비합니다.
+    단계별 소요 시간(초)을 dict로 반환합니다.
+    """
+    global _last_warm_up
+    timings = {}
+    started = time.perf_counter()
+
+    t = time.perf_counter()
+    try:
+        for name in collection_names:
+            get_collection(name).count()
+    except Exception as e:
+        logger.warning(f"ChromaDB 워밍업 중 오류: {e}")
+    timings["chroma"] = time.perf_counter() - t
+
+    # 임베딩 엔드포인트에 연결을 하나 열어 keep-alive 풀에 넣어 둠
+    t = time.perf_counter()
+    try:
+        get_quota_scheduler(EMBEDDING_QUOTA).call(
+            lambda: get_embedding_client().embeddings.create(input="warmup", model=EMBEDDING_DEPLOYMENT_NAME),
+            tokens=1, max_retries=0
+        )
+    except Exception as e:
+        logger.warning(f"임베딩 연결 워밍업 중 오류: {e}")
+    timings["embedding_http"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    get_chat_client()
+    timings["chat_client"] = time.perf_counter() - t
+
+    timings["total"] = time.perf_counter() - started
+    _last_warm_up = timings
+    logger.info(
+        f"리소스 워밍업 완료: 총 {timings['total']:.2f}초 "
+        f"(ChromaDB {timings['chroma']:.2f}초, 임베딩 연결 {timings['embedding_http']:.2f}초)"
+    )
+    return timings
+
+def get_last_warm_up():
+    """
+    마지막 워밍업 소요 시간을 반환합니다. 워밍업 전이면 None입니다.
+    """
+    return _last_warm_up
@@ -3,6 +3,7 @@ pip install openai
 pip install python-dotenv
 pip install chromadb
 pip install pdfplumber
+pip install tiktoken
 
 if ! grep -q "deb http://ftp.debian.org/debian stable main" /etc/apt/sources.list; then
   echo "deb http://ftp.debian.org/debian stable main" >> /etc/apt/sources.list
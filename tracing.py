@@ -0,0 +1,207 @@
+import os
+import sys
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import defaultdict, deque
+from logging.handlers import RotatingFileHandler
+from dotenv import load_dotenv
+
+# 환경변수 로드
+load_dotenv()
+
+# 로그/추적 설정
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "true").lower() not in ("0", "false", "no")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))  # 추적 파일 1개 최대 크기
+TRACE_BACKUP_COUNT = int(os.getenv("TRACE_BACKUP_COUNT", "5"))  # 보관할 이전 추적 파일 수
+TRACE_WINDOW = int(os.getenv("TRACE_WINDOW", "500"))  # 단계별 지연 시간 백분위수 계산에 쓰는 최근 표본 수
+
+def get_trace_file_path():
+    # resources가 이 모듈의 로거를 사용하므로 순환 import를 피하기 위해 함수 안에서 import
+    from resources import get_data_file_path
+    return os.getenv("TRACE_FILE_PATH") or get_data_file_path("traces.jsonl")
+
+_configure_lock = threading.Lock()
+_configured = False
+_trace_logger = None
+
+def _configure():
+    # 앱 로그는 표준 출력으로 기록
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        app_logger = logging.getLogger("voc")
+        if not app_logger.handlers:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+            app_logger.addHandler(handler)
+        app_logger.setLevel(LOG_LEVEL)
+        app_logger.propagate = False
+        _configured = True
+
+def _get_trace_logger():
+    # 추적 이벤트는 크기 기준으로 교체되는 JSONL 파일로 기록
+    # (resources 모듈 로딩 중에 열지 않도록 첫 span이 끝날 때 파일을 염)
+    global _trace_logger
+    _configure()
+    if _trace_logger is not None:
+        return _trace_logger
+    # resources import 중에 get_logger가 같은 잠금을 잡으므로 경로는 잠금 밖에서 계산
+    path = get_trace_file_path()
+    with _configure_lock:
+        if _trace_logger is not None:
+            return _trace_logger
+        trace_logger = logging.getLogger("voc.trace")
+        trace_logger.propagate = False
+        trace_logger.setLevel(logging.INFO)
+        if not trace_logger.handlers:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                file_handler = RotatingFileHandler(
+                    path, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUP_COUNT, encoding="utf-8"
+                )
+                file_handler.setFormatter(logging.Formatter("%(message)s"))
+                trace_logger.addHandler(file_handler)
+            except OSError as e:
+                logging.getLogger("voc").warning(f"추적 파일을 열 수 없어 파일 기록을 생략합니다: {e}")
+        _trace_logger = trace_logger
+        return _trace_logger
+
+def get_logger(name):
+    """
+    모듈별 로거를 반환합니다. (print 대신 사용, 'voc.<모듈명>' 이름으로 표준 출력에 기록)
+    """
+    _configure()
+    return logging.getLogger(f"voc.{name}")
+
+# 현재 실행 중인 span (스레드/컨텍스트별)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+# 단계별 최근 소요 시간(초)과 누적 카운터 (진단 패널용)
+_stats_lock = threading.Lock()
+_durations = defaultdict(lambda: deque(maxlen=TRACE_WINDOW))
+_counters = defaultdict(float)
+
+class Span:
+    def __init__(self, name, trace_id, parent_id, attrs):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attrs = dict(attrs)
+        self.started = time.perf_counter()
+        self.timestamp = time.time()
+
+    def set(self, **attrs):
+        """
+        span에 속성(토큰 수, 캐시 적중 여부 등)을 추가합니다.
+        """
+        self.attrs.update(attrs)
+
+@contextmanager
+def span(name, **attrs):
+    """
+    코드 구간의 소요 시간을 기록하는 span을 엽니다. 중첩하면 같은 trace_id로 묶입니다.
+
+        with span("pdf_search", top_k=4) as s:
+            ...
+            s.set(hits=len(hits))
+    """
+    parent = _current_span.get()
+    current = Span(name, parent.trace_id if parent else uuid.uuid4().hex[:16], parent.span_id if parent else None, attrs)
+    token = _current_span.set(current)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        duration = time.perf_counter() - current.started
+        _finish(current, duration, error)
+
+def _finish(current, duration, error):
+    with _stats_lock:
+        _durations[current.name].append(duration)
+    if not TRACE_ENABLED:
+        return
+    trace_logger = _get_trace_logger()
+    event = {
+        "ts": current.timestamp,
+        "trace_id": current.trace_id,
+        "span_id": current.span_id,
+        "parent_id": current.parent_id,
+        "name": current.name,
+        "duration_ms": round(duration * 1000, 3),
+        "attrs": current.attrs
+    }
+    if error:
+        event["error"] = error
+    try:
+        trace_logger.info(json.dumps(event, ensure_ascii=False, default=str))
+    except Exception:
+        pass
+
+def record_duration(name, seconds, **attrs):
+    """
+    span으로 감싸기 어려운 구간(예: 스트리밍 첫 토큰까지 시간)의 소요 시간을 직접 기록합니다.
+    """
+    parent = _current_span.get()
+    current = Span(name, parent.trace_id if parent else uuid.uuid4().hex[:16], parent.span_id if parent else None, attrs)
+    current.timestamp = time.time() - seconds
+    _finish(current, seconds, None)
+
+def increment(name, value=1):
+    """
+    캐시 적중/미스, 토큰 수 등 누적 카운터를 증가시킵니다.
+    """
+    with _stats_lock:
+        _counters[name] += value
+
+def current_span():
+    return _current_span.get()
+
+def bind_context(fn):
+    """
+    현재 span 컨텍스트를 유지한 채 다른 스레드(스레드 풀)에서 fn을 실행하도록 감쌉니다.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+def _percentile(ordered, p):
+    rank = max(1, -(-p * len(ordered) // 100))
+    return ordered[rank - 1]
+
+def get_latency_summary():
+    """
+    단계별 최근 소요 시간 백분위수를 반환합니다.
+    반환값: {단계명: {'count', 'p50', 'p95', 'p99', 'max'}} (초)
+    """
+    with _stats_lock:
+        snapshot = {name: sorted(values) for name, values in _durations.items() if values}
+    return {
+        name: {
+            "count": len(values),
+            "p50": _percentile(values, 50),
+            "p95": _percentile(values, 95),
+            "p99": _percentile(values, 99),
+            "max": values[-1]
+        }
+        for name, values in sorted(snapshot.items())
+    }
+
+def get_counters():
+    with _stats_lock:
+        return dict(sorted(_counters.items()))
+
+def reset_metrics():
+    with _stats_lock:
+        _durations.clear()
+        _counters.clear()
@@ -0,0 +1,56 @@
+import os
+import html
+from functools import lru_cache
+from dotenv import load_dotenv
+
+# 환경변수 로드
+load_dotenv()
+
+# 채팅 화면 렌더링 설정
+TRANSCRIPT_WINDOW = int(os.getenv("TRANSCRIPT_WINDOW", "30"))  # 처음에 보여줄 최근 메시지 수
+TRANSCRIPT_PAGE_SIZE = int(os.getenv("TRANSCRIPT_PAGE_SIZE", "30"))  # '이전 대화 더 보기' 1회당 추가 메시지 수
+TRANSCRIPT_FRAGMENT_CACHE_SIZE = int(os.getenv("TRANSCRIPT_FRAGMENT_CACHE_SIZE", "512"))  # 메시지별 HTML 캐시 크기
+
+BUBBLE_TEMPLATES = {
+    "user": "<div style='text-align:right; margin:8px 0;'><span class='chat-bubble-user'>{}</span></div>",
+    "assistant": "<div style='text-align:left; margin:8px 0;'><span class='chat-bubble-assistant'>{}</span></div>"
+}
+
+@lru_cache(maxsize=TRANSCRIPT_FRAGMENT_CACHE_SIZE)
+def render_message(role, content):
+    """
+    메시지 하나를 채팅 버블 HTML로 만듭니다. 내용은 HTML 이스케이프하고 줄바꿈은 <br>로 바꿉니다.
+    같은 메시지는 rerun마다 다시 만들지 않도록 캐시합니다.
+    """
+    template = BUBBLE_TEMPLATES.get(role)
+    if template is None:
+        return ""
+    return template.format(html.escape(content).replace("\n", "<br>"))
+
+def visible_messages(messages, limit):
+    """
+    화면에 표시할 최근 메시지(system 제외) 최대 limit개와 숨겨진 이전 메시지 수를 반환합니다.
+    뒤에서부터 필요한 만큼만 확인하므로 세션이 길어져도 비용이 늘지 않습니다.
+    (숨겨진 메시지 수는 system 메시지를 포함한 대략적인 값)
+    """
+    shown = []
+    index = len(messages)
+    while index > 0 and len(shown) < limit:
+        index -= 1
+        if messages[index]["role"] != "system":
+            shown.append(messages[index])
+    shown.reverse()
+    return shown, index
+
+def build_transcript_html(messages, limit):
+    """
+    채팅 영역 HTML(닫는 </div> 제외)과 숨겨진 이전 메시지 수를 반환합니다.
+    스트리밍 중에는 이 HTML 뒤에 생성 중인 답변 버블을 덧붙여 그립니다.
+    """
+    shown, hidden = visible_messages(messages, limit)
+    fragments = [render_message(message["role"], message["content"]) for message in shown]
+    return '<div id="chat-area">' + "".join(fragments), hidden
+
+def render_streaming_html(transcript_html, text):
+    # 생성 중인 답변은 매번 바뀌므로 캐시하지 않음
+    return transcript_html + BUBBLE_TEMPLATES["assistant"].format(html.escape(text).replace("\n", "<br>")) + "</div>"